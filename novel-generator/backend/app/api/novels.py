@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Request, Depends
+import asyncio
 from typing import List, Optional
 from bson import ObjectId
 
+from ..config import settings
 from ..models.novel import Novel, NovelCreateRequest, NovelResponse, ChapterResponse
 from ..services.novel_generator import NovelGenerator
+from ..services.idempotency_service import idempotency_service, IdempotencyConflictError
+from ..services.disconnect_guard import run_until_disconnected
+from ..services.llm_scheduler import require_llm_capacity, tag_llm_context, PRIORITY_INTERACTIVE
 
 router = APIRouter()
 
@@ -60,9 +65,35 @@ async def get_novel(novel_id: str):
         raise HTTPException(status_code=500, detail=f"获取小说失败: {str(e)}")
 
 
-@router.post("/{novel_id}/generate")
-async def generate_novel_content(novel_id: str, material_id: Optional[str] = None):
+async def _idempotent(idempotency_key: Optional[str], scope: str, factory):
+    """按Idempotency-Key执行生成，同一个键用于不同请求时返回422"""
+    try:
+        return await idempotency_service.execute(idempotency_key, scope, factory)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.post("/{novel_id}/generate", dependencies=[Depends(require_llm_capacity(PRIORITY_INTERACTIVE))])
+async def generate_novel_content(novel_id: str, material_id: Optional[str] = None,
+                                 idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+                                 http_request: Request = None):
+    """生成小说内容（相同Idempotency-Key的重试请求复用同一次生成）
+    
+    客户端断开时按client_disconnect_policy取消或在后台完成；带Idempotency-Key时生成任务不会被取消，可凭同一个键取回结果
+    """
+    return await run_until_disconnected(
+        http_request,
+        lambda: _idempotent(
+            idempotency_key, f"generate:{novel_id}:{material_id}",
+            lambda: _generate_novel_content(novel_id, material_id)
+        ),
+        "novel_generate"
+    )
+
+
+async def _generate_novel_content(novel_id: str, material_id: Optional[str]):
     """生成小说内容（支持材料投喂）"""
+    tag_llm_context(PRIORITY_INTERACTIVE, fair_key=novel_id)
     try:
         if not ObjectId.is_valid(novel_id):
             raise HTTPException(status_code=400, detail="无效的小说ID")
@@ -71,16 +102,15 @@ async def generate_novel_content(novel_id: str, material_id: Optional[str] = Non
         if not novel:
             raise HTTPException(status_code=404, detail="小说不存在")
         
-        if novel.status == "generating":
+        # 原子地切换为生成中，避免并发请求重复生成
+        previous_status = novel.status
+        if not await novel.try_start_generation(settings.novel_generation_lease_seconds):
             raise HTTPException(status_code=400, detail="小说正在生成中，请稍后重试")
         
-        # 更新状态为生成中
-        await novel.update_status("generating")
-        
         try:
             # 使用AI生成内容
             generator = NovelGenerator()
-            content = await generator.generate_novel_content(
+            result = await generator.generate_novel_with_analysis(
                 title=novel.title,
                 description=novel.description,
                 genre=novel.genre,
@@ -90,12 +120,17 @@ async def generate_novel_content(novel_id: str, material_id: Optional[str] = Non
                 material_id=material_id
             )
             
-            # 更新小说内容
-            await novel.update_content(content)
+            # 更新小说内容和章节
+            novel.chapters = result["chapters"]
+            await novel.update_content(result["content"])
             await novel.update_status("completed")
             
             return {"success": True, "message": "小说生成完成"}
             
+        except asyncio.CancelledError:
+            # 客户端断开取消生成，恢复原状态
+            await asyncio.shield(novel.update_status(previous_status))
+            raise
         except Exception as e:
             # 生成失败，更新状态
             await novel.update_status("failed")
@@ -107,23 +142,49 @@ async def generate_novel_content(novel_id: str, material_id: Optional[str] = Non
         raise HTTPException(status_code=500, detail=f"处理请求失败: {str(e)}")
 
 
-@router.post("/{novel_id}/generate-with-validation")
-async def generate_novel_with_validation(novel_id: str, material_id: str, max_retries: int = 3):
-    """使用材料验证生成小说（确保必须字符使用率达标）"""
+@router.post("/{novel_id}/generate-with-validation", dependencies=[Depends(require_llm_capacity(PRIORITY_INTERACTIVE))])
+async def generate_novel_with_validation(novel_id: str, material_id: str, max_retries: int = 3,
+                                        concurrent_drafts: int = 1,
+                                        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+                                        http_request: Request = None):
+    """使用材料验证生成小说（相同Idempotency-Key的重试请求复用同一次生成）
+    
+    客户端断开时按client_disconnect_policy取消或在后台完成；带Idempotency-Key时生成任务不会被取消，可凭同一个键取回结果
+    """
+    return await run_until_disconnected(
+        http_request,
+        lambda: _idempotent(
+            idempotency_key,
+            f"generate-with-validation:{novel_id}:{material_id}:{max_retries}:{concurrent_drafts}",
+            lambda: _generate_novel_with_validation(novel_id, material_id, max_retries, concurrent_drafts)
+        ),
+        "novel_generate_with_validation"
+    )
+
+
+async def _generate_novel_with_validation(novel_id: str, material_id: str, max_retries: int,
+                                          concurrent_drafts: int):
+    """使用材料验证生成小说（确保必须字符使用率达标）
+    
+    concurrent_drafts > 1 时每轮并发生成多份草稿，取首个达标的结果；不达标时最多进行max_retries轮。
+    """
+    tag_llm_context(PRIORITY_INTERACTIVE, fair_key=novel_id)
     try:
         if not ObjectId.is_valid(novel_id):
             raise HTTPException(status_code=400, detail="无效的小说ID")
         
+        if concurrent_drafts < 1 or concurrent_drafts > 5:
+            raise HTTPException(status_code=400, detail="并发草稿数需在1到5之间")
+        
         novel = await Novel.get(ObjectId(novel_id))
         if not novel:
             raise HTTPException(status_code=404, detail="小说不存在")
         
-        if novel.status == "generating":
+        # 原子地切换为生成中，避免并发请求重复生成
+        previous_status = novel.status
+        if not await novel.try_start_generation(settings.novel_generation_lease_seconds):
             raise HTTPException(status_code=400, detail="小说正在生成中，请稍后重试")
         
-        # 更新状态为生成中
-        await novel.update_status("generating")
-        
         try:
             # 使用小说生成器的验证模式
             generator = NovelGenerator()
@@ -135,19 +196,26 @@ async def generate_novel_with_validation(novel_id: str, material_id: str, max_re
                 character_info=novel.character_info,
                 plot_outline=novel.plot_outline,
                 material_id=material_id,
-                max_retries=max_retries
+                max_retries=max_retries,
+                concurrent_drafts=concurrent_drafts
             )
             
-            # 更新小说内容和状态
+            # 更新小说内容、章节和状态
+            novel.chapters = result["chapters"]
             await novel.update_content(result["content"])
             await novel.update_status("completed" if result["success"] else "failed")
             
             return {
                 "success": result["success"],
                 "message": f"小说生成完成（尝试{result['attempt']}次）",
-                "character_usage_analysis": result["analysis"]
+                "character_usage_analysis": result["analysis"],
+                "analysis_stats": result["stats"]
             }
             
+        except asyncio.CancelledError:
+            # 客户端断开取消生成，恢复原状态
+            await asyncio.shield(novel.update_status(previous_status))
+            raise
         except Exception as e:
             # 生成失败，更新状态
             await novel.update_status("failed")
@@ -1,15 +1,32 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Header, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
+import asyncio
+import json
 import os
+import time
 from datetime import datetime
 
 from ..services.outline_generator import OutlineGenerator
 from ..services.deepseek_outline_generator import DeepSeekOutlineGenerator
 from ..services.chapter_generator import ChapterGenerator
 from ..services.material_parser import MaterialParser
-from ..models.material import Material
+from ..models.material import Material, MaterialContextView
 from ..models.chapter_novel import ChapterNovel, ChapterInfo, NovelStatus, ChapterStatus
+from ..services.outline_template_service import outline_template_service
+from ..services.generation_metrics import generation_metrics
+from ..services.chapter_run_service import (
+    chapter_run_service, generate_chapter_record, format_sse, ChapterLockedError
+)
+from ..services.warm_pool_service import warm_pool_service
+from ..services.entity_index_service import entity_index_service
+from ..services.generation_estimator import generation_estimator
+from ..services.idempotency_service import idempotency_service, IdempotencyConflictError
+from ..services.disconnect_guard import run_until_disconnected
+from ..services.llm_scheduler import (
+    require_llm_capacity, tag_llm_context, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+)
 from ..config import settings
 
 router = APIRouter()
@@ -25,10 +42,16 @@ class OutlineResponse(BaseModel):
     summary: str
     main_characters: List[Dict[str, str]]
     chapters: List[Dict[str, Any]]
+    volumes: Optional[List[Dict[str, Any]]] = None  # 分卷大纲的卷信息
 
 class ChapterGenerateRequest(BaseModel):
     target_length: int = 2000
 
+class GenerateRemainingRequest(BaseModel):
+    target_length: int = 2000
+    concurrency: Optional[int] = None  # 为空时使用配置的默认并发数
+    material_ids: List[str] = []
+
 class NovelResponse(BaseModel):
     id: str
     title: str
@@ -46,6 +69,7 @@ class ChapterResponse(BaseModel):
     summary: Optional[str]
     word_count: int
     status: str
+    continuation_count: int = 0
 
 # 全局变量存储生成器实例
 outline_generator = None
@@ -110,41 +134,209 @@ async def create_novel(request: NovelCreateRequest):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"创建小说失败: {str(e)}")
 
+class WarmPoolClaimRequest(BaseModel):
+    category: Optional[str] = None  # 材料类别，与material_id二选一
+    material_id: Optional[str] = None
+    title: Optional[str] = None  # 为空时使用大纲生成的标题
+
+@router.post("/warm-pool/claim")
+async def claim_warm_novel(request: WarmPoolClaimRequest):
+    """从预生成池领取一部已有大纲和第一章的小说；池中没有时返回404，客户端按常规流程创建"""
+    category = request.category
+    if not category and request.material_id:
+        object_ids = _parse_object_ids([request.material_id])
+        material = await Material.get(object_ids[0]) if object_ids else None
+        if not material:
+            raise HTTPException(status_code=404, detail="材料不存在")
+        category = material.category
+    if not category:
+        raise HTTPException(status_code=400, detail="需要提供category或material_id")
+    
+    novel = await warm_pool_service.claim(category, request.title)
+    if not novel:
+        raise HTTPException(status_code=404, detail="该类别暂无预生成的小说")
+    
+    first_chapter = await novel.get_chapter(1)
+    return {
+        "success": True,
+        "novel": novel.to_dict(),
+        "first_chapter": first_chapter.to_dict() if first_chapter else None
+    }
+
+@router.get("/warm-pool")
+async def get_warm_pool():
+    """预生成池各类别的就绪数、预生成中数量和目标大小"""
+    return await warm_pool_service.stats()
+
+@router.get("/estimate")
+async def estimate_generation(chapter_count: int = 10, target_length: int = 2000,
+                              concurrency: Optional[int] = None):
+    """估算新小说的大纲、单章和全部章节生成的token数、费用和耗时（低/预期/高）"""
+    if chapter_count < 1 or target_length < 1:
+        raise HTTPException(status_code=400, detail="章节数和目标字数必须大于0")
+    return {
+        "outline": generation_estimator.estimate_outline(chapter_count),
+        "chapter": generation_estimator.estimate_chapter(target_length),
+        "remaining_chapters": generation_estimator.estimate_chapters(chapter_count, target_length, concurrency)
+    }
+
 class OutlineGenerateRequest(BaseModel):
     material_ids: List[str] = []
     required_words: List[str] = []
+    use_template: bool = False  # 按模板复用策略尝试直接实例化已有大纲（需显式开启）
+    personalize_template: bool = False  # 复用模板时是否用模型改写简介
+    discard_written_chapters: bool = False  # 已有完成章节时确认重新生成（大纲变化的章节会被清空正文）
 
-@router.post("/{novel_id}/outline")
+class OutlineFromTemplateRequest(BaseModel):
+    material_ids: List[str] = []
+    required_words: List[str] = []
+    personalize: bool = False
+    discard_written_chapters: bool = False  # 已有完成章节时确认重新生成（大纲变化的章节会被清空正文）
+
+def _parse_object_ids(material_ids: List[str]) -> List[Any]:
+    """将字符串ID转换为ObjectId，跳过无效ID"""
+    from bson import ObjectId
+    object_ids = []
+    for mid in material_ids:
+        try:
+            object_ids.append(ObjectId(mid))
+        except:
+            print(f"警告: 无效的材料ID {mid}")
+    return object_ids
+
+async def _load_materials(material_ids: List[str]) -> List[Dict[str, Any]]:
+    """按ID批量获取材料"""
+    materials = []
+    object_ids = _parse_object_ids(material_ids)
+    if object_ids:
+        material_docs = await Material.find({"_id": {"$in": object_ids}}).to_list()
+        materials = [material.to_dict() for material in material_docs]
+    return materials
+
+async def _load_material_contexts(material_ids: List[str]) -> List[Dict[str, Any]]:
+    """按ID批量获取章节生成所需的材料字段（只投影写作指导和必须字词）"""
+    object_ids = _parse_object_ids(material_ids)
+    if not object_ids:
+        return []
+    views = await Material.find({"_id": {"$in": object_ids}}).project(MaterialContextView).to_list()
+    return [view.model_dump() for view in views]
+
+def _idempotency_scope(*parts: Any) -> str:
+    """生成幂等键的作用域：接口名、路径参数和请求体"""
+    return json.dumps(
+        [part.model_dump() if isinstance(part, BaseModel) else part for part in parts],
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+
+async def _idempotent(idempotency_key: Optional[str], scope: str, factory):
+    """按Idempotency-Key执行生成，同一个键用于不同请求时返回422"""
+    try:
+        return await idempotency_service.execute(idempotency_key, scope, factory)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def _timed(timings: Dict[str, float], name: str, awaitable):
+    """执行数据库查询并记录耗时（毫秒）"""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+async def _check_outline_regeneration(novel: ChapterNovel, discard_written_chapters: bool):
+    """重新生成大纲前的检查：写作中的小说不允许；已有完成章节时需要调用方确认会清空变化章节的正文"""
+    if novel.status == NovelStatus.WRITING:
+        raise HTTPException(status_code=400, detail="小说已开始写作，无法重新生成大纲")
+    
+    completed = await ChapterInfo.find(
+        ChapterInfo.novel_id == str(novel.id),
+        ChapterInfo.status == ChapterStatus.COMPLETED
+    ).count()
+    if completed and not discard_written_chapters:
+        raise HTTPException(
+            status_code=409,
+            detail=f"已有{completed}章完成写作，重新生成大纲会清空大纲变化章节的正文；确认后请设置discard_written_chapters为true"
+        )
+
+async def _save_outline(novel: ChapterNovel, outline_data: Dict[str, Any]):
+    """保存大纲，并一次批量写入（更新或插入）全部章节记录
+    
+    大纲变化的章节会被重置为PLANNED，已完成章节数按重置后的章节记录重新统计
+    """
+    await ChapterInfo.upsert_outline_chapters(str(novel.id), outline_data["chapters"])
+    
+    novel.outline = outline_data
+    novel.status = NovelStatus.OUTLINED
+    novel.completed_chapters = await ChapterInfo.find(
+        ChapterInfo.novel_id == str(novel.id),
+        ChapterInfo.status == ChapterStatus.COMPLETED
+    ).count()
+    novel.updated_at = datetime.now()
+    await novel.save()
+
+@router.post("/{novel_id}/outline", dependencies=[Depends(require_llm_capacity(PRIORITY_INTERACTIVE))])
 async def generate_outline(
     novel_id: str, 
     request: OutlineGenerateRequest,
-    outline_gen: OutlineGenerator = Depends(get_outline_generator)
+    outline_gen: OutlineGenerator = Depends(get_outline_generator),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    http_request: Request = None
+):
+    """生成小说大纲（相同Idempotency-Key的重试请求复用同一次生成）
+    
+    客户端断开时按client_disconnect_policy取消或在后台完成；带Idempotency-Key时生成任务不会被取消，可凭同一个键取回结果
+    """
+    return await run_until_disconnected(
+        http_request,
+        lambda: _idempotent(
+            idempotency_key, _idempotency_scope("outline", novel_id, request),
+            lambda: _generate_outline(novel_id, request, outline_gen)
+        ),
+        "outline"
+    )
+
+async def _generate_outline(
+    novel_id: str,
+    request: OutlineGenerateRequest,
+    outline_gen: OutlineGenerator
 ):
     """生成小说大纲"""
+    tag_llm_context(PRIORITY_INTERACTIVE, fair_key=novel_id)
     try:
         # 获取小说
         novel = await ChapterNovel.get(novel_id)
         if not novel:
             raise HTTPException(status_code=404, detail="小说不存在")
         
-        if novel.status == NovelStatus.WRITING:
-            raise HTTPException(status_code=400, detail="小说已开始写作，无法重新生成大纲")
+        await _check_outline_regeneration(novel, request.discard_written_chapters)
+        
+        # 未指定材料时使用小说关联的材料，模板键与实际生成所用的材料一致
+        material_ids = request.material_ids or novel.material_ids
+        
+        # 按复用策略尝试从模板直接实例化（跳过本小说自己生成的模板）
+        if request.use_template:
+            template = await outline_template_service.pick_template(
+                material_ids, novel.total_chapters, request.required_words, exclude_novel_id=str(novel.id)
+            )
+            if template:
+                outline_data = await outline_template_service.instantiate(
+                    template, novel.title, outline_gen, personalize=request.personalize_template
+                )
+                await _save_outline(novel, outline_data)
+                return {
+                    "success": True,
+                    "message": "大纲已从模板生成",
+                    "outline": outline_data,
+                    "from_template": True,
+                    "template_id": str(template.id)
+                }
         
         # 获取材料
-        materials = []
-        if request.material_ids:
-            from bson import ObjectId
-            # 转换字符串ID为ObjectId
-            object_ids = []
-            for mid in request.material_ids:
-                try:
-                    object_ids.append(ObjectId(mid))
-                except:
-                    print(f"警告: 无效的材料ID {mid}")
-            
-            if object_ids:
-                material_docs = await Material.find({"_id": {"$in": object_ids}}).to_list()
-                materials = [material.to_dict() for material in material_docs]
+        materials = await _load_materials(material_ids)
+        
+        # 流式解析出的章节立即补上缺失的章节记录；已有记录等最终大纲保存时再统一更新或重置
+        async def save_streamed_chapter(chapter_info: Dict[str, Any]):
+            await ChapterInfo.insert_missing_outline_chapters(str(novel.id), [chapter_info])
         
         # 生成大纲
         if isinstance(outline_gen, DeepSeekOutlineGenerator):
@@ -152,7 +344,8 @@ async def generate_outline(
                 title=novel.title,
                 materials=materials,
                 chapter_count=novel.total_chapters,
-                required_words=request.required_words
+                required_words=request.required_words,
+                on_chapter=save_streamed_chapter
             )
         else:
             outline_data = outline_gen.generate_outline(
@@ -162,31 +355,90 @@ async def generate_outline(
             )
         
         # 保存大纲
-        novel.outline = outline_data
-        novel.status = NovelStatus.OUTLINED
-        novel.updated_at = datetime.now()
-        await novel.save()
-        
-        # 创建章节记录
-        for chapter_info in outline_data["chapters"]:
-            chapter = ChapterInfo(
-                novel_id=str(novel.id),
-                chapter_number=chapter_info["number"],
-                title=chapter_info["title"],
-                summary=chapter_info["summary"],
-                status=ChapterStatus.PLANNED
-            )
-            await chapter.save()
+        await _save_outline(novel, outline_data)
+        
+        # 完整的大纲保存为模板，供相同材料的小说复用
+        if isinstance(outline_gen, DeepSeekOutlineGenerator) and not outline_gen.has_placeholders(outline_data):
+            try:
+                await outline_template_service.save_template(
+                    material_ids, novel.total_chapters, request.required_words, outline_data,
+                    source_novel_id=str(novel.id)
+                )
+            except Exception as e:
+                print(f"⚠️ 保存大纲模板失败: {e}")
         
         return {
             "success": True,
             "message": "大纲生成完成",
-            "outline": outline_data
+            "outline": outline_data,
+            "from_template": False
         }
         
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=f"生成大纲失败: {str(e)}")
 
+@router.post("/{novel_id}/outline/from-template", dependencies=[Depends(require_llm_capacity(PRIORITY_INTERACTIVE))])
+async def generate_outline_from_template(
+    novel_id: str,
+    request: OutlineFromTemplateRequest,
+    outline_gen: OutlineGenerator = Depends(get_outline_generator),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    http_request: Request = None
+):
+    """从大纲模板即时生成大纲（相同Idempotency-Key的重试请求复用同一次生成）
+    
+    客户端断开时按client_disconnect_policy取消或在后台完成；带Idempotency-Key时生成任务不会被取消，可凭同一个键取回结果
+    """
+    return await run_until_disconnected(
+        http_request,
+        lambda: _idempotent(
+            idempotency_key, _idempotency_scope("outline-from-template", novel_id, request),
+            lambda: _generate_outline_from_template(novel_id, request, outline_gen)
+        ),
+        "outline_from_template"
+    )
+
+async def _generate_outline_from_template(
+    novel_id: str,
+    request: OutlineFromTemplateRequest,
+    outline_gen: OutlineGenerator
+):
+    """从大纲模板即时生成大纲（可选用模型改写简介）"""
+    tag_llm_context(PRIORITY_INTERACTIVE, fair_key=novel_id)
+    try:
+        novel = await ChapterNovel.get(novel_id)
+        if not novel:
+            raise HTTPException(status_code=404, detail="小说不存在")
+        
+        await _check_outline_regeneration(novel, request.discard_written_chapters)
+        
+        template = await outline_template_service.pick_template(
+            request.material_ids or novel.material_ids, novel.total_chapters, request.required_words,
+            force=True, exclude_novel_id=str(novel.id)
+        )
+        if not template:
+            raise HTTPException(status_code=404, detail="没有可用的大纲模板")
+        
+        outline_data = await outline_template_service.instantiate(
+            template, novel.title, outline_gen, personalize=request.personalize
+        )
+        await _save_outline(novel, outline_data)
+        
+        return {
+            "success": True,
+            "message": "大纲已从模板生成",
+            "outline": outline_data,
+            "from_template": True,
+            "template_id": str(template.id)
+        }
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"从模板生成大纲失败: {str(e)}")
+
 @router.get("/{novel_id}/outline", response_model=OutlineResponse)
 async def get_outline(novel_id: str):
     """获取小说大纲"""
@@ -205,25 +457,193 @@ async def get_outline(novel_id: str):
             raise e
         raise HTTPException(status_code=500, detail=f"获取大纲失败: {str(e)}")
 
-@router.post("/{novel_id}/chapters/{chapter_number}/generate")
+class OutlineChapterEditRequest(BaseModel):
+    title: Optional[str] = None
+    summary: Optional[str] = None
+    key_events: Optional[List[str]] = None
+    characters_involved: Optional[List[str]] = None
+    replan_downstream: bool = True  # 是否重新规划后续尚未写作的章节
+    replan_limit: Optional[int] = None  # 只重新规划紧随其后的N章，为空时最多重新规划outline_replan_max_chapters章
+
+@router.put("/{novel_id}/outline/chapters/{chapter_number}", dependencies=[Depends(require_llm_capacity(PRIORITY_INTERACTIVE))])
+async def edit_outline_chapter(
+    novel_id: str,
+    chapter_number: int,
+    request: OutlineChapterEditRequest,
+    outline_gen: OutlineGenerator = Depends(get_outline_generator),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    http_request: Request = None
+):
+    """修改一章的大纲，并只重新规划其后尚未写作（PLANNED）的章节（相同Idempotency-Key的重试请求复用同一次结果）
+    
+    修改期间该章节已开始写作时返回409；重新规划的章节在此期间开始写作的保留原大纲，列在skipped中
+    """
+    return await run_until_disconnected(
+        http_request,
+        lambda: _idempotent(
+            idempotency_key, _idempotency_scope("outline-chapter", novel_id, chapter_number, request),
+            lambda: _edit_outline_chapter(novel_id, chapter_number, request, outline_gen)
+        ),
+        "outline_chapter"
+    )
+
+async def _edit_outline_chapter(
+    novel_id: str,
+    chapter_number: int,
+    request: OutlineChapterEditRequest,
+    outline_gen: OutlineGenerator
+):
+    """修改一章的大纲并局部重新规划后续章节"""
+    tag_llm_context(PRIORITY_INTERACTIVE, fair_key=novel_id)
+    try:
+        novel = await ChapterNovel.get(novel_id)
+        if not novel:
+            raise HTTPException(status_code=404, detail="小说不存在")
+        if not novel.outline:
+            raise HTTPException(status_code=404, detail="大纲尚未生成")
+        
+        outline_data = dict(novel.outline)
+        original_chapters = {chapter["number"]: chapter for chapter in outline_data.get("chapters", [])}
+        chapters_by_number = {number: dict(chapter) for number, chapter in original_chapters.items()}
+        if chapter_number not in chapters_by_number:
+            raise HTTPException(status_code=404, detail="大纲中未找到该章节")
+        
+        # 只查询章节号和状态，不加载正文
+        statuses = {
+            doc["chapter_number"]: doc["status"]
+            for doc in await ChapterInfo.get_pymongo_collection().find(
+                {"novel_id": novel_id}, projection={"chapter_number": 1, "status": 1}
+            ).to_list(length=None)
+        }
+        if statuses.get(chapter_number) in (ChapterStatus.WRITING.value, ChapterStatus.COMPLETED.value):
+            raise HTTPException(status_code=409, detail="该章节已开始写作或已完成，无法修改大纲")
+        
+        edited = chapters_by_number[chapter_number]
+        edited.update(request.model_dump(
+            include={"title", "summary", "key_events", "characters_involved"}, exclude_none=True
+        ))
+        
+        # 后续尚未写作的章节需要重新规划，其余章节作为固定上下文
+        downstream = sorted(
+            number for number in chapters_by_number
+            if number > chapter_number and statuses.get(number, ChapterStatus.PLANNED.value) == ChapterStatus.PLANNED.value
+        )
+        replan_limit = settings.outline_replan_max_chapters if request.replan_limit is None else request.replan_limit
+        downstream = downstream[:max(0, replan_limit)]
+        
+        replanned: List[Dict[str, Any]] = []
+        if request.replan_downstream and downstream:
+            if not isinstance(outline_gen, DeepSeekOutlineGenerator):
+                raise HTTPException(status_code=400, detail="当前大纲生成器不支持局部重新规划")
+            outline_data["chapters"] = [chapters_by_number[number] for number in sorted(chapters_by_number)]
+            fixed_numbers = [number for number in chapters_by_number if number not in downstream]
+            replanned = await outline_gen.replan_chapters(outline_data, chapter_number, fixed_numbers, downstream)
+            for chapter in replanned:
+                # 保留原章节分配到的必须字词
+                previous = chapters_by_number[chapter["number"]]
+                if "required_words" in previous:
+                    chapter["required_words"] = previous["required_words"]
+                chapters_by_number[chapter["number"]] = chapter
+        
+        # 模型调用期间章节可能已开始生成：逐章条件写入，只写仍未开始写作的章节
+        if not await ChapterInfo.update_unstarted_outline_chapter(
+            novel_id, edited, [ChapterStatus.PLANNED, ChapterStatus.FAILED]
+        ):
+            raise HTTPException(status_code=409, detail="该章节在修改期间已开始写作，修改未保存")
+        written = [edited]
+        skipped: List[int] = []
+        for chapter in replanned:
+            if await ChapterInfo.update_unstarted_outline_chapter(novel_id, chapter, [ChapterStatus.PLANNED]):
+                written.append(chapter)
+            else:
+                skipped.append(chapter["number"])
+                chapters_by_number[chapter["number"]] = original_chapters[chapter["number"]]
+        
+        # 只更新大纲中被修改的章节条目，不覆盖并发请求对其他章节的修改
+        positions = {chapter["number"]: index for index, chapter in enumerate(novel.outline.get("chapters", []))}
+        now = datetime.now()
+        result = await ChapterNovel.get_pymongo_collection().update_one(
+            {
+                "_id": novel.id,
+                **{f"outline.chapters.{positions[chapter['number']]}.number": chapter["number"] for chapter in written}
+            },
+            {"$set": {
+                **{f"outline.chapters.{positions[chapter['number']]}": chapter for chapter in written},
+                "updated_at": now
+            }}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=409, detail="大纲已被其他请求重新生成，修改未保存")
+        outline_data["chapters"] = [chapters_by_number[number] for number in sorted(chapters_by_number)]
+        
+        replanned_numbers = [chapter["number"] for chapter in written[1:]]
+        return {
+            "success": True,
+            "message": f"第{chapter_number}章大纲已修改，重新规划了{len(replanned_numbers)}章",
+            "chapter": edited,
+            "replanned": replanned_numbers,
+            "skipped": skipped,
+            "unchanged": [number for number in downstream if number not in replanned_numbers and number not in skipped],
+            "outline": outline_data
+        }
+        
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=f"修改章节大纲失败: {str(e)}")
+
+@router.post("/{novel_id}/chapters/{chapter_number}/generate", dependencies=[Depends(require_llm_capacity(PRIORITY_INTERACTIVE))])
 async def generate_chapter(
     novel_id: str,
     chapter_number: int,
     request: ChapterGenerateRequest = ChapterGenerateRequest(),
     material_ids: List[str] = [],
-    chapter_gen: ChapterGenerator = Depends(get_chapter_generator)
+    chapter_gen: ChapterGenerator = Depends(get_chapter_generator),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    http_request: Request = None
+):
+    """生成指定章节（相同Idempotency-Key的重试请求复用同一次生成）
+    
+    客户端断开时按client_disconnect_policy取消或在后台完成；带Idempotency-Key时生成任务不会被取消，可凭同一个键取回结果
+    """
+    return await run_until_disconnected(
+        http_request,
+        lambda: _idempotent(
+            idempotency_key,
+            _idempotency_scope("chapter", novel_id, chapter_number, request, sorted(material_ids)),
+            lambda: _generate_chapter(novel_id, chapter_number, request, material_ids, chapter_gen)
+        ),
+        "chapter"
+    )
+
+async def _generate_chapter(
+    novel_id: str,
+    chapter_number: int,
+    request: ChapterGenerateRequest,
+    material_ids: List[str],
+    chapter_gen: ChapterGenerator
 ):
     """生成指定章节"""
+    tag_llm_context(PRIORITY_INTERACTIVE, fair_key=novel_id)
     try:
-        # 获取小说和章节
-        novel = await ChapterNovel.get(novel_id)
+        # 小说、章节、前文开头片段和材料互不依赖，并发查询
+        timings: Dict[str, float] = {}
+        fetch_start = time.perf_counter()
+        novel, chapter, previous_heads, materials = await asyncio.gather(
+            _timed(timings, "novel", ChapterNovel.get(novel_id)),
+            _timed(timings, "chapter", ChapterInfo.find_one(
+                ChapterInfo.novel_id == novel_id,
+                ChapterInfo.chapter_number == chapter_number
+            )),
+            _timed(timings, "previous_chapters", ChapterInfo.get_context_heads(novel_id, chapter_number)),
+            _timed(timings, "materials", _load_material_contexts(material_ids))
+        )
+        timings["total"] = round((time.perf_counter() - fetch_start) * 1000, 2)
+        for name, elapsed in timings.items():
+            generation_metrics.observe(f"generate_chapter.db_ms.{name}", elapsed)
+        
         if not novel:
             raise HTTPException(status_code=404, detail="小说不存在")
-        
-        chapter = await ChapterInfo.find_one(
-            ChapterInfo.novel_id == novel_id,
-            ChapterInfo.chapter_number == chapter_number
-        )
         if not chapter:
             raise HTTPException(status_code=404, detail="章节不存在")
         
@@ -241,56 +661,13 @@ async def generate_chapter(
         if not chapter_info:
             raise HTTPException(status_code=404, detail="大纲中未找到该章节信息")
         
-        # 获取前面已完成的章节内容
-        previous_chapters = await ChapterInfo.find(
-            ChapterInfo.novel_id == novel_id,
-            ChapterInfo.chapter_number < chapter_number,
-            ChapterInfo.status == ChapterStatus.COMPLETED
-        ).sort(ChapterInfo.chapter_number).to_list()
-        
-        previous_contents = [ch.content for ch in previous_chapters if ch.content]
-        
-        # 获取材料
-        materials = []
-        if material_ids:
-            from bson import ObjectId
-            # 转换字符串ID为ObjectId
-            object_ids = []
-            for mid in material_ids:
-                try:
-                    object_ids.append(ObjectId(mid))
-                except:
-                    print(f"警告: 无效的材料ID {mid}")
-            
-            if object_ids:
-                material_docs = await Material.find({"_id": {"$in": object_ids}}).to_list()
-                materials = [material.to_dict() for material in material_docs]
-        
-        # 更新章节状态
-        chapter.status = ChapterStatus.WRITING
-        chapter.updated_at = datetime.now()
-        await chapter.save()
-        
-        # 生成章节内容
-        result = chapter_gen.generate_chapter(
-            novel_title=novel.title,
-            chapter_info=chapter_info,
-            previous_chapters=previous_contents,
-            materials=materials,
-            target_length=request.target_length
+        # 生成并保存章节内容
+        await generate_chapter_record(
+            novel, chapter, chapter_info, chapter_gen, materials,
+            target_length=request.target_length,
+            previous_heads=previous_heads
         )
         
-        # 保存章节内容
-        chapter.content = result["content"]
-        chapter.word_count = result["word_count"]
-        chapter.status = ChapterStatus.COMPLETED if result["status"] == "completed" else ChapterStatus.FAILED
-        chapter.updated_at = datetime.now()
-        await chapter.save()
-        
-        # 更新小说状态
-        if chapter.status == ChapterStatus.COMPLETED:
-            await novel.update_completed_count()
-        
         return {
             "success": True,
             "message": f"第{chapter_number}章生成完成",
@@ -299,20 +676,86 @@ async def generate_chapter(
                 "title": chapter.title,
                 "content": chapter.content,
                 "word_count": chapter.word_count,
+                "continuation_count": chapter.continuation_count,
                 "status": chapter.status.value
-            }
+            },
+            "db_timings_ms": timings
         }
         
+    except ChapterLockedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=f"生成章节失败: {str(e)}")
 
+@router.post("/{novel_id}/generate-remaining", dependencies=[Depends(require_llm_capacity(PRIORITY_BATCH))])
+async def generate_remaining_chapters(
+    novel_id: str,
+    request: GenerateRemainingRequest = GenerateRemainingRequest(),
+    chapter_gen: ChapterGenerator = Depends(get_chapter_generator),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """按并发上限生成所有待生成（PLANNED/FAILED）章节，以SSE流式返回每章进度
+    
+    任务在后台运行，客户端断开后继续生成；同一小说已有运行中的任务时直接接入该任务的进度流，
+    带相同Idempotency-Key的重试请求即使任务已结束也会回放该任务的全部进度事件
+    """
+    novel = await ChapterNovel.get(novel_id)
+    if not novel:
+        raise HTTPException(status_code=404, detail="小说不存在")
+    if not novel.outline:
+        raise HTTPException(status_code=400, detail="请先生成小说大纲")
+    if request.concurrency is not None and request.concurrency < 1:
+        raise HTTPException(status_code=400, detail="并发数必须大于0")
+    
+    async def start_or_attach():
+        run = chapter_run_service.get_active_run(novel_id)
+        if run:
+            return run
+        materials = await _load_material_contexts(request.material_ids or novel.material_ids)
+        return await chapter_run_service.start_run(
+            novel, chapter_gen, materials,
+            target_length=request.target_length,
+            concurrency=request.concurrency
+        )
+    
+    run = await _idempotent(
+        idempotency_key, _idempotency_scope("generate-remaining", novel_id, request), start_or_attach
+    )
+    
+    async def event_stream():
+        async for event in run.subscribe():
+            yield format_sse(event)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Run-Id": run.run_id}
+    )
+
+@router.get("/{novel_id}/generate-remaining")
+async def get_generate_remaining_status(novel_id: str):
+    """查询最近一次剩余章节生成任务的状态"""
+    run = chapter_run_service.get_run(novel_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="没有生成任务")
+    return run.to_dict()
+
+@router.post("/{novel_id}/generate-remaining/cancel")
+async def cancel_generate_remaining(novel_id: str):
+    """取消运行中的剩余章节生成任务"""
+    run = await chapter_run_service.cancel_run(novel_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="没有运行中的生成任务")
+    return {"success": True, "message": "生成任务已取消", "run": run.to_dict()}
+
 @router.get("/", response_model=List[NovelResponse])
 async def get_novels(skip: int = 0, limit: int = 20):
     """获取小说列表"""
     try:
-        novels = await ChapterNovel.find().skip(skip).limit(limit).to_list()
+        # 预生成池中尚未被领取的小说不出现在列表中
+        novels = await ChapterNovel.find({"pool_state": None}).skip(skip).limit(limit).to_list()
         return [
             NovelResponse(
                 id=str(novel.id),
@@ -363,7 +806,8 @@ async def get_chapters(novel_id: str):
                 content=chapter.content,
                 summary=chapter.summary,
                 word_count=chapter.word_count,
-                status=chapter.status.value
+                status=chapter.status.value,
+                continuation_count=chapter.continuation_count
             )
             for chapter in chapters
         ]
@@ -388,13 +832,42 @@ async def get_chapter(novel_id: str, chapter_number: int):
             content=chapter.content,
             summary=chapter.summary,
             word_count=chapter.word_count,
-            status=chapter.status.value
+            status=chapter.status.value,
+            continuation_count=chapter.continuation_count
         )
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=f"获取章节失败: {str(e)}")
 
+@router.get("/{novel_id}/estimate")
+async def estimate_novel_generation(novel_id: str, target_length: int = 2000, concurrency: Optional[int] = None):
+    """估算指定小说的大纲、单章和剩余（PLANNED/FAILED）章节生成的token数、费用和耗时"""
+    if target_length < 1:
+        raise HTTPException(status_code=400, detail="目标字数必须大于0")
+    novel = await ChapterNovel.get(novel_id)
+    if not novel:
+        raise HTTPException(status_code=404, detail="小说不存在")
+    
+    remaining = novel.total_chapters
+    if novel.outline:
+        remaining = await ChapterInfo.find(
+            ChapterInfo.novel_id == novel_id,
+            {"status": {"$in": [ChapterStatus.PLANNED.value, ChapterStatus.FAILED.value]}}
+        ).count()
+    return {
+        "novel_id": novel_id,
+        "outline": None if novel.outline else generation_estimator.estimate_outline(novel.total_chapters),
+        "chapter": generation_estimator.estimate_chapter(target_length),
+        "remaining_chapters": generation_estimator.estimate_chapters(remaining, target_length, concurrency),
+        "active_run": chapter_run_service.get_active_run(novel_id) is not None
+    }
+
+@router.get("/{novel_id}/entities")
+async def get_novel_entities(novel_id: str):
+    """获取小说的角色索引（首次/最近出场章节、台词行数、简介）"""
+    return {"novel_id": novel_id, "characters": await entity_index_service.get_index(novel_id)}
+
 @router.delete("/{novel_id}")
 async def delete_novel(novel_id: str):
     """删除小说"""
@@ -403,8 +876,9 @@ async def delete_novel(novel_id: str):
         if not novel:
             raise HTTPException(status_code=404, detail="小说不存在")
         
-        # 删除相关章节
+        # 删除相关章节和角色索引
         await ChapterInfo.find(ChapterInfo.novel_id == novel_id).delete()
+        await entity_index_service.delete_novel(novel_id)
         
         # 删除小说
         await novel.delete()
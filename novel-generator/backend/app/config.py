@@ -12,6 +12,7 @@ class Settings(BaseSettings):
     deepseek_api_key: Optional[str] = None
     deepseek_api_base: str = "https://api.deepseek.com"
     deepseek_model: str = "deepseek-reasoner"
+    json_mode_models: str = "deepseek-chat"  # 支持JSON输出模式的模型，逗号分隔
     
     # 应用配置
     secret_key: str = "your_secret_key_here"
@@ -21,7 +22,106 @@ class Settings(BaseSettings):
     # 文件上传配置
     upload_dir: str = "./uploads"
     max_file_size: int = 10485760  # 10MB
-    
+
+    # 按任务选择模型（逗号分隔的候选模型，优先的放前面）
+    outline_model: str = "deepseek-chat,deepseek-reasoner"
+    chapter_model: str = "deepseek-chat,deepseek-reasoner"
+    repair_model: str = "deepseek-chat"
+    validation_retry_model: str = "deepseek-chat,deepseek-reasoner"
+    task_model_adaptive: bool = True  # 根据实测耗时和成功率自动切换候选模型
+    task_model_min_samples: int = 5  # 样本数不足时按配置顺序选择
+    task_model_min_success_rate: float = 0.7  # 低于该成功率视为不健康
+    task_model_min_coverage: float = 0.8  # 章节类任务必须字词覆盖率达到该值视为成功
+    task_model_explore_ratio: float = 0.05  # 随机试用其他候选模型的概率
+    task_model_latency_budget_outline: float = 90.0  # 各任务的平均耗时预算（秒）
+    task_model_latency_budget_chapter: float = 120.0
+    task_model_latency_budget_repair: float = 45.0
+    task_model_latency_budget_validation_retry: float = 180.0
+
+    # 流式输出校验配置
+    stream_guard_enabled: bool = True
+    stream_guard_check_lines: int = 6  # 检查前N个有效行的标记格式
+    stream_guard_min_marker_ratio: float = 0.6  # 前N行中带标记行的最低比例
+    stream_guard_length_ratio: float = 1.6  # 超过目标字数的倍数即中断
+    stream_guard_repeat_threshold: int = 3  # 同一行重复出现次数上限
+    stream_guard_max_retries: int = 1  # 格式异常中断后的重试次数
+
+    # 章节max_tokens校准配置
+    token_calibration_enabled: bool = True  # 按观测到的字符/token比例计算max_tokens，关闭时固定为4000
+    token_calibration_margin: float = 0.15  # 基础安全余量（近期截断率会叠加在上面）
+    token_calibration_min_tokens: int = 512
+    token_calibration_max_tokens: int = 8000
+
+    # 长度截断续写配置
+    continuation_max_rounds: int = 2  # 输出达到max_tokens上限时最多续写的次数
+    continuation_tail_chars: int = 800  # 续写请求附带的已写内容结尾字数
+
+    # 生成耗时和费用估算配置
+    estimator_model_prices: str = "deepseek-chat:2:8,deepseek-reasoner:4:16"  # 模型:输入单价:输出单价（元/百万tokens）
+    estimator_default_tokens_per_second: float = 25.0  # 没有历史数据时假定的输出速度
+    estimator_default_first_token_seconds: float = 3.0  # 没有历史数据时假定的首个token延迟
+    estimator_min_samples: int = 5  # 历史样本少于该数时使用默认值（区间按±50%给出）
+
+    # 整本小说（v1）分章并发生成配置
+    novel_chapter_concurrency: int = 4  # 同时生成的章节数
+    novel_chapter_max_tokens: int = 3000  # 单章生成的token上限
+    novel_chapter_retries: int = 1  # 只重新生成失败章节的次数，仍失败时整本退回模拟内容
+
+    # 剩余章节批量生成（v2）配置
+    chapter_run_concurrency: int = 3  # 默认同时生成的章节数
+    chapter_run_max_concurrency: int = 8  # 请求可指定的最大并发数
+
+    # 生成租约与幂等配置
+    chapter_lease_seconds: int = 600  # 章节生成租约时长，超时后其他请求可以接管
+    chapter_lease_renew_seconds: int = 120  # 生成过程中续约章节租约的间隔（应明显短于租约时长）
+    novel_generation_lease_seconds: int = 1800  # 整本小说（v1）生成中状态的租约时长
+    idempotency_ttl_seconds: int = 3600  # Idempotency-Key结果的保留时间
+    idempotency_max_entries: int = 1000  # 最多保留的幂等键数量
+
+    # 卡住的生成记录回收配置
+    generation_reaper_enabled: bool = True
+    generation_reaper_interval_seconds: int = 300  # 定期回收的间隔
+    generation_reaper_single_instance: bool = True  # 单实例部署：启动时直接回收启动前遗留的进行中记录
+
+    # 小说预生成池配置
+    warm_pool_enabled: bool = False  # 开启后在后台按类别预生成小说（会持续消耗模型调用）
+    warm_pool_min_size: int = 1  # 每个类别至少保持的可领取数量
+    warm_pool_max_size: int = 5  # 每个类别最多保持的数量
+    warm_pool_claim_window_seconds: int = 3600  # 统计领取速率的时间窗口
+    warm_pool_lead_seconds: int = 600  # 预生成一部小说的大致耗时，用于按领取速率换算目标数量
+    warm_pool_refill_interval_seconds: int = 60  # 补充检查间隔（有领取时立即检查）
+    warm_pool_concurrency: int = 2  # 同时预生成的小说数
+    warm_pool_chapter_count: int = 10  # 预生成小说的章节数
+    warm_pool_target_length: int = 2000  # 预生成第一章的目标字数
+
+    # 模型调用调度配置
+    llm_max_concurrency: int = 8  # 同时进行的模型调用数
+    llm_interactive_reserved_slots: int = 2  # 只给交互请求使用的槽位数
+    llm_queue_limit_interactive: int = 32  # 各类别排队上限，超出时入口返回429
+    llm_queue_limit_batch: int = 256
+    llm_queue_limit_background: int = 64
+
+    # 客户端断开处理配置
+    client_disconnect_policy: str = "cancel"  # cancel：取消上游生成 / background：后台完成并保存
+    client_disconnect_poll_seconds: float = 1.0  # 检测客户端断开的轮询间隔
+
+    # 大纲修复配置
+    outline_repair_max_rounds: int = 2  # 补写缺失章节的最大请求轮数
+
+    # 修改章节大纲后的局部重新规划
+    outline_replan_max_chapters: int = 20  # 未指定replan_limit时最多重新规划的后续章节数
+
+    # 分卷大纲配置（长篇连载）
+    outline_hierarchical_threshold: int = 20  # 章节数超过该值时使用分卷大纲
+    outline_volume_size: int = 15  # 每卷的目标章节数
+    outline_volume_concurrency: int = 4  # 同时生成的卷数
+
+    # 大纲模板复用配置
+    outline_template_policy: str = "variety"  # off / reuse / variety
+    outline_template_reuse_ratio: float = 0.8  # variety策略下复用模板的概率
+    outline_template_max_uses: int = 20  # variety策略下单个模板的最大复用次数
+    outline_template_max_per_key: int = 5  # 每组材料最多保留的模板数
+
     class Config:
         env_file = ["env.local", ".env"]
         case_sensitive = False
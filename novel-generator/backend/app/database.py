@@ -5,6 +5,9 @@ from app.models.novel import Novel
 from app.models.material import Material
 from app.models.dialogue import NovelSession
 
+LEGACY_CHAPTER_INDEX = "novel_id_1_chapter_number_1"  # 旧的非唯一复合索引
+CHAPTER_UNIQUE_INDEX = "novel_chapter_unique"  # 章节唯一索引（ChapterInfo.Settings中定义）
+
 
 class MongoDB:
     client: AsyncIOMotorClient = None
@@ -23,17 +26,60 @@ async def connect_to_mongo():
     mongodb.client = AsyncIOMotorClient(mongodb_url)
     mongodb.database = mongodb.client[database_name]
     
+    # 章节唯一索引迁移（需在Beanie创建索引之前完成）
+    await _migrate_chapter_indexes(mongodb.database)
+    
     # 初始化Beanie ODM
     from .models.chapter_novel import ChapterNovel, ChapterInfo
+    from .models.outline_template import OutlineTemplate
+    from .models.novel_entity import NovelEntity
     
     await init_beanie(
         database=mongodb.database,
-        document_models=[Novel, Material, NovelSession, ChapterNovel, ChapterInfo]
+        document_models=[Novel, Material, NovelSession, ChapterNovel, ChapterInfo, OutlineTemplate, NovelEntity]
     )
     
     print(f"Connected to MongoDB: {mongodb_url}/{database_name}")
 
 
+async def _migrate_chapter_indexes(database):
+    """清理重复的(novel_id, chapter_number)章节记录，并移除旧的非唯一复合索引
+    
+    唯一索引novel_chapter_unique建立后不可能再有重复记录，只在旧索引仍存在（或唯一索引尚未建立）时执行，
+    避免每次启动都全表扫描；分组排序允许使用磁盘，大集合在旧版MongoDB上也不会超出内存限制
+    """
+    chapters = database["chapters"]
+    index_info = await chapters.index_information()
+    if LEGACY_CHAPTER_INDEX not in index_info and CHAPTER_UNIQUE_INDEX in index_info:
+        return
+    
+    duplicates = chapters.aggregate([
+        {"$sort": {"updated_at": -1}},
+        {"$group": {
+            "_id": {"novel_id": "$novel_id", "chapter_number": "$chapter_number"},
+            "ids": {"$push": "$_id"},
+            "statuses": {"$push": "$status"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    
+    removed = 0
+    async for group in duplicates:
+        # 优先保留已完成的章节，其次保留最近更新的记录
+        ids, statuses = group["ids"], group["statuses"]
+        keep_index = statuses.index("completed") if "completed" in statuses else 0
+        stale_ids = [doc_id for i, doc_id in enumerate(ids) if i != keep_index]
+        result = await chapters.delete_many({"_id": {"$in": stale_ids}})
+        removed += result.deleted_count
+    if removed:
+        print(f"🧹 已清理 {removed} 条重复章节记录")
+    
+    if LEGACY_CHAPTER_INDEX in index_info:
+        await chapters.drop_index(LEGACY_CHAPTER_INDEX)
+        print("🔧 已移除旧的章节复合索引，改用唯一索引")
+
+
 async def close_mongo_connection():
     """关闭MongoDB连接"""
     if mongodb.client:
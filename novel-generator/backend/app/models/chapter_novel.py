@@ -1,7 +1,9 @@
 from beanie import Document
-from pydantic import Field
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, UpdateOne, DeleteMany, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 
 class NovelStatus(str, Enum):
@@ -11,12 +13,21 @@ class NovelStatus(str, Enum):
     COMPLETED = "completed"
     PAUSED = "paused"
 
+# 预生成池状态：warming为正在预生成，ready为可领取；被领取后清空
+POOL_WARMING = "warming"
+POOL_READY = "ready"
+
 class ChapterStatus(str, Enum):
     PLANNED = "planned"
     WRITING = "writing"
     COMPLETED = "completed"
     FAILED = "failed"
 
+class ChapterContextHead(BaseModel):
+    """前文章节的开头片段（构建章节上下文用的投影结果）"""
+    chapter_number: int
+    head: str = ""
+
 class ChapterInfo(Document):
     """章节信息文档"""
     novel_id: str = Field(..., description="所属小说ID")
@@ -26,17 +37,241 @@ class ChapterInfo(Document):
     content: Optional[str] = Field(None, description="章节内容")
     word_count: int = Field(default=0, description="字数统计")
     status: ChapterStatus = Field(default=ChapterStatus.PLANNED, description="章节状态")
+    format_report: Optional[Dict[str, Any]] = Field(None, description="生成时的输出规范化报告")
+    continuation_count: int = Field(default=0, description="生成时因长度上限截断而续写的次数")
+    lease_owner: Optional[str] = Field(None, description="当前生成租约的持有者")
+    lease_expires_at: Optional[datetime] = Field(None, description="生成租约过期时间")
     created_at: datetime = Field(default_factory=datetime.now, description="创建时间")
     updated_at: datetime = Field(default_factory=datetime.now, description="更新时间")
     
     class Settings:
         name = "chapters"
         indexes = [
-            [("novel_id", 1), ("chapter_number", 1)],  # 复合索引
+            # 唯一复合索引：同一小说的同一章节只有一条记录
+            IndexModel([("novel_id", 1), ("chapter_number", 1)], unique=True, name="novel_chapter_unique"),
             "novel_id",
             "status"
         ]
     
+    async def acquire_lease(self, owner: str, lease_seconds: int) -> Optional[ChapterStatus]:
+        """原子地把章节从PLANNED/FAILED（或租约已过期的WRITING）切换为WRITING
+        
+        成功时返回切换前的状态，章节已被其他请求占用或已完成时返回None
+        """
+        now = datetime.now()
+        stale_before = now - timedelta(seconds=lease_seconds)
+        previous = await ChapterInfo.get_pymongo_collection().find_one_and_update(
+            {
+                "_id": self.id,
+                "$or": [
+                    {"status": {"$in": [ChapterStatus.PLANNED.value, ChapterStatus.FAILED.value]}},
+                    {"status": ChapterStatus.WRITING.value, "lease_expires_at": {"$lt": now}},
+                    # 没有租约信息的旧记录按更新时间判断是否过期
+                    {"status": ChapterStatus.WRITING.value, "lease_expires_at": None,
+                     "updated_at": {"$lt": stale_before}}
+                ]
+            },
+            {"$set": {
+                "status": ChapterStatus.WRITING.value,
+                "lease_owner": owner,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updated_at": now
+            }},
+            projection={"status": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not previous:
+            return None
+        
+        self.status = ChapterStatus.WRITING
+        self.lease_owner = owner
+        self.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        self.updated_at = now
+        return ChapterStatus(previous["status"])
+    
+    async def renew_lease(self, owner: str, lease_seconds: int) -> bool:
+        """仍持有租约时延长过期时间；租约已被回收或接管时返回False"""
+        expires_at = datetime.now() + timedelta(seconds=lease_seconds)
+        result = await ChapterInfo.get_pymongo_collection().update_one(
+            {"_id": self.id, "lease_owner": owner, "status": ChapterStatus.WRITING.value},
+            {"$set": {"lease_expires_at": expires_at}}
+        )
+        if result.matched_count == 0:
+            return False
+        self.lease_expires_at = expires_at
+        return True
+    
+    async def release_lease(self, owner: str, status: ChapterStatus, **fields: Any) -> bool:
+        """持有租约时写入结果并释放租约；租约已被其他请求接管时不写入并返回False"""
+        now = datetime.now()
+        update = {
+            "status": status.value,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "updated_at": now,
+            **fields
+        }
+        result = await ChapterInfo.get_pymongo_collection().update_one(
+            {"_id": self.id, "lease_owner": owner},
+            {"$set": update}
+        )
+        if result.matched_count == 0:
+            return False
+        
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.status = status
+        self.lease_owner = None
+        self.lease_expires_at = None
+        self.updated_at = now
+        return True
+    
+    @classmethod
+    async def get_context_heads(cls,
+                                novel_id: str,
+                                before_number: int,
+                                limit: int = 3,
+                                head_chars: int = 200) -> List[ChapterContextHead]:
+        """获取指定章节之前最近几个已完成章节的开头片段，按章节号升序返回
+        
+        只在数据库端截取head_chars+1个字符，避免加载整章内容。
+        """
+        pipeline = [
+            {"$match": {
+                "novel_id": novel_id,
+                "chapter_number": {"$lt": before_number},
+                "status": ChapterStatus.COMPLETED.value,
+                "content": {"$nin": [None, ""]}
+            }},
+            {"$sort": {"chapter_number": -1}},
+            {"$limit": limit},
+            {"$project": {
+                "_id": 0,
+                "chapter_number": 1,
+                "head": {"$substrCP": ["$content", 0, head_chars + 1]}
+            }}
+        ]
+        # 数据库驱动为motor，直接使用集合的聚合游标
+        docs = await cls.get_pymongo_collection().aggregate(pipeline).to_list(length=None)
+        heads = [ChapterContextHead(**doc) for doc in docs]
+        return sorted(heads, key=lambda head: head.chapter_number)
+    
+    @classmethod
+    async def insert_missing_outline_chapters(cls, novel_id: str, chapters: List[Dict[str, Any]]) -> None:
+        """只插入还没有记录的大纲章节，已有记录保持不变
+        
+        用于大纲流式生成过程中：最终大纲确定之前不修改、不重置已有章节（由upsert_outline_chapters统一处理）
+        """
+        now = datetime.now()
+        operations = [
+            UpdateOne(
+                {"novel_id": novel_id, "chapter_number": chapter["number"]},
+                {"$setOnInsert": {
+                    "title": chapter["title"],
+                    "summary": chapter["summary"],
+                    "content": None,
+                    "word_count": 0,
+                    "status": ChapterStatus.PLANNED.value,
+                    "created_at": now,
+                    "updated_at": now
+                }},
+                upsert=True
+            )
+            for chapter in chapters
+        ]
+        if operations:
+            await cls.get_pymongo_collection().bulk_write(operations, ordered=False)
+    
+    @classmethod
+    async def upsert_outline_chapters(cls,
+                                      novel_id: str,
+                                      chapters: List[Dict[str, Any]],
+                                      prune: bool = True) -> None:
+        """一次批量写入大纲章节：按(novel_id, chapter_number)更新或插入
+        
+        prune为True时同时删除大纲中已不存在的章节记录，重复调用不会产生重复文档。
+        标题或摘要变化的已有章节重置为PLANNED并清空内容，旧正文不再与新大纲混在一起；
+        正在生成的章节同时清除租约，旧的生成结果不会再写回。
+        """
+        now = datetime.now()
+        operations = []
+        for chapter in chapters:
+            key = {"novel_id": novel_id, "chapter_number": chapter["number"]}
+            # 两个操作互不依赖执行顺序：新章节只由第二个操作插入，已有章节只由第一个操作在大纲变化时重置
+            operations.append(UpdateOne(
+                {**key, "$or": [{"title": {"$ne": chapter["title"]}}, {"summary": {"$ne": chapter["summary"]}}]},
+                {"$set": {
+                    "title": chapter["title"],
+                    "summary": chapter["summary"],
+                    "content": None,
+                    "word_count": 0,
+                    "status": ChapterStatus.PLANNED.value,
+                    "format_report": None,
+                    "continuation_count": 0,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                    "updated_at": now
+                }}
+            ))
+            operations.append(UpdateOne(
+                key,
+                {"$setOnInsert": {
+                    "title": chapter["title"],
+                    "summary": chapter["summary"],
+                    "content": None,
+                    "word_count": 0,
+                    "status": ChapterStatus.PLANNED.value,
+                    "created_at": now,
+                    "updated_at": now
+                }},
+                upsert=True
+            ))
+        if prune:
+            operations.append(DeleteMany({
+                "novel_id": novel_id,
+                "chapter_number": {"$nin": [chapter["number"] for chapter in chapters]}
+            }))
+        if operations:
+            await cls.get_pymongo_collection().bulk_write(operations, ordered=False)
+    
+    @classmethod
+    async def update_unstarted_outline_chapter(cls,
+                                               novel_id: str,
+                                               chapter: Dict[str, Any],
+                                               statuses: List[ChapterStatus]) -> bool:
+        """章节仍处于statuses之一（尚未开始写作）时写入新的标题和摘要并重置为PLANNED
+        
+        状态检查和写入是同一次条件更新，修改大纲期间章节已开始生成或已完成时不写入并返回False；
+        还没有章节记录时插入新记录。
+        """
+        now = datetime.now()
+        try:
+            await cls.get_pymongo_collection().update_one(
+                {
+                    "novel_id": novel_id,
+                    "chapter_number": chapter["number"],
+                    "status": {"$in": [status.value for status in statuses]}
+                },
+                {
+                    "$set": {
+                        "title": chapter["title"],
+                        "summary": chapter["summary"],
+                        "content": None,
+                        "word_count": 0,
+                        "status": ChapterStatus.PLANNED.value,
+                        "format_report": None,
+                        "continuation_count": 0,
+                        "updated_at": now
+                    },
+                    "$setOnInsert": {"created_at": now}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # 章节记录存在但状态已变化，条件不满足时的插入与唯一索引冲突
+            return False
+        return True
+    
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式"""
         return {
@@ -47,6 +282,7 @@ class ChapterInfo(Document):
             "summary": self.summary,
             "content": self.content,
             "word_count": self.word_count,
+            "continuation_count": self.continuation_count,
             "status": self.status.value,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
@@ -61,6 +297,9 @@ class ChapterNovel(Document):
     completed_chapters: int = Field(default=0, description="已完成章节数")
     status: NovelStatus = Field(default=NovelStatus.PLANNING, description="小说状态")
     material_ids: List[str] = Field(default_factory=list, description="关联的材料ID列表")
+    pool_category: Optional[str] = Field(None, description="预生成池的材料类别（由预生成池创建时设置）")
+    pool_state: Optional[str] = Field(None, description="预生成池状态：warming / ready，领取后为空")
+    pool_claimed_at: Optional[datetime] = Field(None, description="从预生成池领取的时间")
     created_at: datetime = Field(default_factory=datetime.now, description="创建时间")
     updated_at: datetime = Field(default_factory=datetime.now, description="更新时间")
     
@@ -69,9 +308,25 @@ class ChapterNovel(Document):
         indexes = [
             "title",
             "status",
-            "created_at"
+            "created_at",
+            [("pool_category", 1), ("pool_state", 1), ("created_at", 1)]
         ]
     
+    @classmethod
+    async def claim_pooled(cls, category: str, title: Optional[str] = None) -> Optional["ChapterNovel"]:
+        """原子地领取预生成池中最早就绪的一部小说，没有就绪的小说时返回None"""
+        now = datetime.now()
+        update = {"pool_state": None, "pool_claimed_at": now, "created_at": now, "updated_at": now}
+        if title:
+            update["title"] = title
+        doc = await cls.get_pymongo_collection().find_one_and_update(
+            {"pool_category": category, "pool_state": POOL_READY},
+            {"$set": update},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return cls.model_validate(doc) if doc else None
+    
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式"""
         return {
@@ -114,4 +369,9 @@ class ChapterNovel(Document):
             self.status = NovelStatus.WRITING
         
         self.updated_at = datetime.now()
-        await self.save()
+        # 只更新变化的字段，避免整篇文档（含大纲）回写
+        await self.set({
+            ChapterNovel.completed_chapters: self.completed_chapters,
+            ChapterNovel.status: self.status,
+            ChapterNovel.updated_at: self.updated_at
+        })
@@ -37,6 +37,12 @@ class Material(Document):
     
     class Settings:
         name = "materials"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式（供大纲和章节生成使用）"""
+        data = self.model_dump(exclude={"id", "revision_id"})
+        data["id"] = str(self.id)
+        return data
         
     class Config:
         json_schema_extra = {
@@ -60,6 +66,12 @@ class Material(Document):
         }
 
 
+class MaterialContextView(BaseModel):
+    """章节生成上下文所需的材料字段（投影查询用）"""
+    writing_guidelines: WritingGuideline
+    required_characters: List[RequiredCharacter] = []
+
+
 class MaterialCreate(BaseModel):
     """创建材料请求"""
     title: str
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, List
 from beanie import Document
 from pydantic import BaseModel, Field
@@ -91,6 +91,26 @@ class Novel(Document):
         self.updated_at = datetime.utcnow()
         await self.save()
 
+    async def try_start_generation(self, lease_seconds: int) -> bool:
+        """原子地把状态切换为generating；正在生成（且未超过租约时间）时返回False"""
+        now = datetime.utcnow()
+        result = await Novel.get_pymongo_collection().update_one(
+            {
+                "_id": self.id,
+                "$or": [
+                    {"status": {"$ne": "generating"}},
+                    {"updated_at": {"$lt": now - timedelta(seconds=lease_seconds)}}
+                ]
+            },
+            {"$set": {"status": "generating", "updated_at": now}}
+        )
+        if result.modified_count == 0:
+            return False
+        
+        self.status = "generating"
+        self.updated_at = now
+        return True
+
     async def update_content(self, content: str):
         """更新内容"""
         self.content = content
@@ -0,0 +1,124 @@
+from beanie import Document
+from pydantic import Field
+from pymongo import IndexModel, UpdateOne, UpdateMany
+from typing import Optional, List, Dict, Any
+from datetime import datetime
+
+BOUNDS_UPDATE_RETRIES = 3  # 重新计算出场章节范围时，遇到并发修改的重试次数
+
+
+class NovelEntity(Document):
+    """小说角色索引文档（每部小说每个角色一条，章节完成时更新）"""
+    novel_id: str = Field(..., description="所属小说ID")
+    name: str = Field(..., description="角色名")
+    description: Optional[str] = Field(None, description="角色简介（来自大纲主要角色）")
+    first_chapter: Optional[int] = Field(None, description="首次出场章节")
+    last_chapter: Optional[int] = Field(None, description="最近出场章节")
+    chapter_lines: Dict[str, int] = Field(default_factory=dict, description="各章台词行数（章节号 -> 行数）")
+    recent_line: Optional[str] = Field(None, description="最近出场章节中的一句台词")
+    recent_line_chapter: Optional[int] = Field(None, description="recent_line所在的章节")
+    updated_at: datetime = Field(default_factory=datetime.now, description="更新时间")
+
+    class Settings:
+        name = "novel_entities"
+        indexes = [
+            IndexModel([("novel_id", 1), ("name", 1)], unique=True, name="novel_entity_unique")
+        ]
+
+    @property
+    def line_count(self) -> int:
+        return sum(self.chapter_lines.values())
+
+    @classmethod
+    async def record_chapter(cls,
+                             novel_id: str,
+                             chapter_number: int,
+                             appearances: Dict[str, Dict[str, Any]]) -> None:
+        """一次批量写入某章的角色出场情况
+
+        appearances: {角色名: {"lines": 台词行数, "recent_line": 台词, "description": 简介}}；
+        台词行数按章节记录，同一章重新生成时覆盖而不是累加。章节可能乱序完成或重新生成：
+        最近台词只由最近出场的章节（或台词原本所在的章节）写入；重新生成后不再出场的角色移除本章记录，
+        并按剩余章节重新计算首次/最近出场章节
+        """
+        now = datetime.now()
+        chapter_key = f"chapter_lines.{chapter_number}"
+        collection = cls.get_pymongo_collection()
+        dropped_filter = {"novel_id": novel_id, "name": {"$nin": list(appearances)}, chapter_key: {"$exists": True}}
+        dropped = await collection.distinct("name", dropped_filter)
+
+        operations = []
+        for name, appearance in appearances.items():
+            key = {"novel_id": novel_id, "name": name}
+            update = {
+                "$min": {"first_chapter": chapter_number},
+                "$max": {"last_chapter": chapter_number},
+                "$set": {chapter_key: appearance.get("lines", 0), "updated_at": now}
+            }
+            if appearance.get("description"):
+                update["$set"]["description"] = appearance["description"]
+            operations.append(UpdateOne(key, update, upsert=True))
+
+            if appearance.get("recent_line"):
+                # 本章是最近出场章节，或者替换本章旧内容中的台词
+                operations.append(UpdateOne(
+                    {**key, "$or": [{"last_chapter": {"$lte": chapter_number}}, {"recent_line_chapter": chapter_number}]},
+                    {"$set": {"recent_line": appearance["recent_line"], "recent_line_chapter": chapter_number}}
+                ))
+            else:
+                # 本章重新生成后没有台词，旧台词不再有效
+                operations.append(UpdateOne(
+                    {**key, "recent_line_chapter": chapter_number},
+                    {"$set": {"recent_line": None, "recent_line_chapter": None}}
+                ))
+        if dropped:
+            operations.append(UpdateMany(
+                {**dropped_filter, "name": {"$in": dropped}},
+                {"$unset": {chapter_key: ""}, "$set": {"updated_at": now}}
+            ))
+            operations.append(UpdateMany(
+                {"novel_id": novel_id, "name": {"$in": dropped}, "recent_line_chapter": chapter_number},
+                {"$set": {"recent_line": None, "recent_line_chapter": None}}
+            ))
+        if operations:
+            # 按顺序执行：台词的条件更新依赖前面的插入
+            await collection.bulk_write(operations, ordered=True)
+        for name in dropped:
+            await cls._recompute_bounds(novel_id, name)
+
+    @classmethod
+    async def _recompute_bounds(cls, novel_id: str, name: str) -> None:
+        """按chapter_lines中剩余的章节重新计算首次/最近出场章节，不再出场于任何章节时删除该角色
+
+        以读取到的chapter_lines作为条件写入，期间其他章节更新了该角色时重新读取
+        """
+        collection = cls.get_pymongo_collection()
+        for _ in range(BOUNDS_UPDATE_RETRIES):
+            doc = await collection.find_one({"novel_id": novel_id, "name": name}, projection={"chapter_lines": 1})
+            if not doc:
+                return
+            chapter_lines = doc.get("chapter_lines") or {}
+            guard = {"_id": doc["_id"], "chapter_lines": chapter_lines}
+            if not chapter_lines:
+                result = await collection.delete_one(guard)
+                if result.deleted_count:
+                    return
+                continue
+            chapters = [int(number) for number in chapter_lines]
+            result = await collection.update_one(
+                guard, {"$set": {"first_chapter": min(chapters), "last_chapter": max(chapters)}}
+            )
+            if result.matched_count:
+                return
+        print(f"⚠️ 角色 {name} 的出场章节范围更新冲突，保留当前值")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "first_chapter": self.first_chapter,
+            "last_chapter": self.last_chapter,
+            "line_count": self.line_count,
+            "recent_line": self.recent_line
+        }
@@ -0,0 +1,39 @@
+from beanie import Document
+from pydantic import Field
+from typing import Optional, List, Dict, Any
+from datetime import datetime
+
+
+class OutlineTemplate(Document):
+    """大纲模板文档（按材料、章节数和必须字词复用已生成的大纲）"""
+    template_key: str = Field(..., description="模板键：材料ID、章节数、必须字词的摘要")
+    material_ids: List[str] = Field(default_factory=list, description="关联的材料ID列表")
+    chapter_count: int = Field(..., description="章节数")
+    required_words: List[str] = Field(default_factory=list, description="必须字词")
+    outline: Dict[str, Any] = Field(..., description="大纲内容")
+    source_novel_id: Optional[str] = Field(None, description="生成该模板的小说ID")
+    use_count: int = Field(default=0, description="被实例化的次数")
+    created_at: datetime = Field(default_factory=datetime.now, description="创建时间")
+    last_used_at: Optional[datetime] = Field(None, description="最近使用时间")
+
+    class Settings:
+        name = "outline_templates"
+        indexes = [
+            [("template_key", 1), ("use_count", 1)],
+            "created_at"
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            "id": str(self.id),
+            "template_key": self.template_key,
+            "material_ids": self.material_ids,
+            "chapter_count": self.chapter_count,
+            "required_words": self.required_words,
+            "outline": self.outline,
+            "source_novel_id": self.source_novel_id,
+            "use_count": self.use_count,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "last_used_at": self.last_used_at.isoformat() if self.last_used_at else None
+        }
@@ -6,6 +6,7 @@ from app.models.chapter_novel import ChapterNovel, ChapterInfo
 # from app.services.deepseek_client import DeepSeekClient  # 已移除DeepSeek依赖
 from app.services.protagonist_roleplay import ProtagonistRoleplaySystem
 from app.services.pinyin_service import pinyin_service
+from app.services.content_normalizer import parse_normalized_content
 import os
 import json
 import re
@@ -28,12 +29,20 @@ sessions = {}
 # 主角扮演系统实例
 roleplay_system = ProtagonistRoleplaySystem()
 
-async def extract_dialogues_from_chapter(chapter_content):
-    """从章节内容中提取对话 - 支持新的标记格式（正文：、主角：、角色名：）"""
+async def extract_dialogues_from_chapter(chapter_content, format_report=None):
+    """从章节内容中提取对话 - 支持新的标记格式（正文：、主角：、角色名：）
+    
+    生成时已规范化且格式合格的章节（format_report.format_ok）直接按行切分
+    """
     import time
     start_time = time.time()
     print(f"🔍 开始解析章节内容，长度: {len(chapter_content)} 字符")
     
+    if format_report and format_report.get("format_ok"):
+        dialogues = parse_normalized_content(chapter_content)
+        print(f"✅ 规范化内容快速解析完成，耗时: {time.time() - start_time:.3f}秒，提取 {len(dialogues)} 个段落")
+        return dialogues
+    
     try:
         # 快速检查是否有标记格式
         if '正文：' in chapter_content or '主角：' in chapter_content:
@@ -221,7 +230,7 @@ async def get_chapter_dialogues(novel_id: str, chapter_number: int):
             raise HTTPException(status_code=404, detail="章节内容为空")
         
         # 从章节内容中提取对话
-        dialogues = await extract_dialogues_from_chapter(chapter.content)
+        dialogues = await extract_dialogues_from_chapter(chapter.content, chapter.format_report)
         
         return {
             "novel_id": novel_id,
@@ -265,7 +274,7 @@ async def get_current_chapter_dialogue(request: DialogueRequest):
                 raise HTTPException(status_code=404, detail="章节不存在")
             
             # 从章节内容中提取对话（只在新会话时执行）
-            dialogues = await extract_dialogues_from_chapter(chapter.content)
+            dialogues = await extract_dialogues_from_chapter(chapter.content, chapter.format_report)
             
             if not dialogues:
                 raise HTTPException(status_code=404, detail="章节中没有找到对话内容")
@@ -1,25 +1,39 @@
-import openai
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
+from contextlib import aclosing
 import json
 
+from ..config import settings
+from .deepseek_client import DeepSeekClient
+from .stream_guard import StreamGuard
+from .content_normalizer import ChapterNormalizer
+from .continuation import MAX_OVERLAP_CHARS, build_continuation_messages, stitch_continuation
+from .entity_index_service import format_character_context
+from .generation_metrics import generation_metrics
+from .token_calibrator import token_calibrator
+from .model_policy import model_policy, TASK_CHAPTER, TASK_VALIDATION_RETRY
+
 class ChapterGenerator:
     def __init__(self, api_key: str):
-        # 使用DeepSeek API端点
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            base_url="https://api.deepseek.com/v1"
-        )
+        # 使用DeepSeek API端点（流式输出，便于提前中断异常生成），模型按任务选择策略决定
+        self.client = DeepSeekClient(api_key)
     
-    def generate_chapter(self, 
+    async def generate_chapter(self, 
                         novel_title: str,
                         chapter_info: Dict[str, Any],
                         previous_chapters: List[str],
                         materials: List[Dict[str, Any]],
-                        target_length: int = 2000) -> Dict[str, Any]:
-        """生成单个章节内容"""
+                        target_length: int = 2000,
+                        previous_chapter_numbers: Optional[List[int]] = None,
+                        characters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """生成单个章节内容
+        
+        previous_chapter_numbers与previous_chapters一一对应时，上下文中使用真实章节号；
+        characters为本章涉及角色的索引资料（只包含characters_involved中的角色）
+        """
         
         # 构建上下文
-        context = self._build_context(novel_title, chapter_info, previous_chapters, materials)
+        context = self._build_context(novel_title, chapter_info, previous_chapters, materials,
+                                      previous_chapter_numbers, characters)
         
         # 获取必须用到的字（优先使用章节指定的，否则从材料中提取）
         required_words = chapter_info.get('required_words', [])
@@ -72,18 +86,51 @@ class ChapterGenerator:
 正文：他看向远处的大楼，心中涌起不安的预感。
 """
         
+        return await self._generate_and_check(
+            task=TASK_CHAPTER,
+            messages=[
+                {"role": "system", "content": "你是一个专业的小说作家，擅长写作各种类型的小说章节。"},
+                {"role": "user", "content": prompt}
+            ],
+            chapter_info=chapter_info,
+            target_length=target_length,
+            temperature=0.8
+        )
+    
+    async def _generate_and_check(self,
+                                  task: str,
+                                  messages: List[Dict[str, str]],
+                                  chapter_info: Dict[str, Any],
+                                  target_length: int,
+                                  temperature: float,
+                                  extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """按任务选择模型生成章节并检查必须字词，覆盖率达标记为该模型的一次成功"""
+        async with model_policy.use(task) as decision:
+            result = await self._generate_checked_content(
+                messages, chapter_info, target_length, temperature, decision.model
+            )
+            decision.success = (result["status"] == "completed" and
+                                result["words_completion_rate"] >= settings.task_model_min_coverage)
+        if extra:
+            result.update(extra)
+        return result
+    
+    async def _generate_checked_content(self,
+                                        messages: List[Dict[str, str]],
+                                        chapter_info: Dict[str, Any],
+                                        target_length: int,
+                                        temperature: float,
+                                        model: str) -> Dict[str, Any]:
+        """生成章节内容并统计必须字词的使用情况，生成失败时返回failed状态"""
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "你是一个专业的小说作家，擅长写作各种类型的小说章节。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.8,
-                max_tokens=4000
+            content, format_report, continuations = await self._stream_with_guard(
+                messages=messages,
+                target_length=target_length,
+                temperature=temperature,
+                max_tokens=token_calibrator.max_tokens_for(model, target_length),
+                model=model
             )
             
-            content = response.choices[0].message.content
             word_count = len(content)
             
             # 验证必须用到的字是否都包含在内容中
@@ -105,7 +152,9 @@ class ChapterGenerator:
                 "required_words": required_words,
                 "used_words": used_words,
                 "missing_words": missing_words,
-                "words_completion_rate": len(used_words) / len(required_words) if required_words else 1.0
+                "words_completion_rate": len(used_words) / len(required_words) if required_words else 1.0,
+                "format_report": format_report,
+                "continuation_count": continuations
             }
                 
         except Exception as e:
@@ -113,14 +162,155 @@ class ChapterGenerator:
             return {
                 "content": f"第{chapter_info['number']}章内容生成失败，请重试。",
                 "word_count": 0,
-                "status": "failed"
+                "status": "failed",
+                "words_completion_rate": 0.0
             }
     
+    async def _stream_with_guard(self,
+                                 messages: List[Dict[str, str]],
+                                 target_length: int,
+                                 temperature: float,
+                                 max_tokens: int,
+                                 model: Optional[str] = None) -> Tuple[str, Dict[str, Any], int]:
+        """流式生成章节并实时校验，格式异常时提前中断上游请求并重试
+        
+        输出同时逐行规范化；因max_tokens上限被截断时自动续写，返回(规范化后的内容, 格式报告, 续写次数)
+        """
+        
+        attempts = settings.stream_guard_max_retries + 1 if settings.stream_guard_enabled else 1
+        
+        for attempt in range(attempts):
+            # 最后一次尝试不再因格式问题中断，保证总能拿到内容
+            is_last_attempt = attempt == attempts - 1
+            guard = StreamGuard(
+                target_length=target_length,
+                check_lines=settings.stream_guard_check_lines,
+                min_marker_ratio=settings.stream_guard_min_marker_ratio,
+                length_ratio=settings.stream_guard_length_ratio if settings.stream_guard_enabled else 0,
+                repeat_threshold=settings.stream_guard_repeat_threshold if settings.stream_guard_enabled else 0,
+                enforce_format=settings.stream_guard_enabled and not is_last_attempt
+            )
+            normalizer = ChapterNormalizer(settings.stream_guard_min_marker_ratio)
+            finish_reason, usage = None, None
+            
+            async with aclosing(self.client.stream_chat_completion(
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                model=model
+            )) as stream:
+                async for chunk in stream:
+                    finish_reason = chunk.get("finish_reason") or finish_reason
+                    usage = chunk.get("usage") or usage
+                    if not guard.feed(chunk["content"]):
+                        break
+                    normalizer.feed(chunk["content"])
+            
+            if not guard.aborted:
+                # 只有完整结束的生成参与校准（中断的输出长度不代表模型的自然长度）
+                token_calibrator.record(
+                    model or settings.deepseek_model,
+                    len(guard.text),
+                    (usage or {}).get("completion_tokens"),
+                    truncated=finish_reason == "length"
+                )
+                continuations = 0
+                if finish_reason == "length":
+                    continuations = await self._continue_truncated(
+                        messages, guard, normalizer, max_tokens, temperature, model
+                    )
+                if not guard.aborted:
+                    return (*self._finish_normalized(normalizer), continuations)
+                # 续写内容触发了校验（超长、重复），按中断处理
+                normalizer = ChapterNormalizer(settings.stream_guard_min_marker_ratio)
+                normalizer.feed(guard.result_text())
+                print(f"🛑 续写内容被流式校验中断: {guard.abort_reason}")
+                return (*self._finish_normalized(normalizer), continuations)
+            
+            tokens_saved = guard.estimate_tokens_saved(max_tokens)
+            generation_metrics.incr("stream_guard.aborts")
+            generation_metrics.incr(f"stream_guard.aborts.{guard.abort_reason}")
+            generation_metrics.incr("stream_guard.tokens_saved", tokens_saved)
+            print(f"🛑 流式校验中断生成: {guard.abort_reason}，已生成 {len(guard.text)} 字符，约节省 {tokens_saved} tokens")
+            
+            if guard.should_retry and not is_last_attempt:
+                generation_metrics.incr("stream_guard.retries")
+                print(f"🔄 第 {attempt + 1} 次生成被中断，重新生成...")
+                continue
+            
+            # 中断时只保留到完整行，重新规范化截取后的内容
+            normalizer = ChapterNormalizer(settings.stream_guard_min_marker_ratio)
+            normalizer.feed(guard.result_text())
+            return (*self._finish_normalized(normalizer), 0)
+    
+    async def _continue_truncated(self,
+                                  messages: List[Dict[str, str]],
+                                  guard: StreamGuard,
+                                  normalizer: ChapterNormalizer,
+                                  max_tokens: int,
+                                  temperature: float,
+                                  model: Optional[str]) -> int:
+        """以已写内容的结尾为种子续写被截断的章节，续写内容同样经过流式校验和规范化，返回续写次数"""
+        continuations = 0
+        finish_reason = "length"
+        while finish_reason == "length" and continuations < settings.continuation_max_rounds and not guard.aborted:
+            continuations += 1
+            print(f"✂️ 章节输出达到长度上限，第 {continuations} 次续写（已有 {len(guard.text)} 字符）")
+            finish_reason = None
+            head, stitched = "", False
+            
+            async with aclosing(self.client.stream_chat_completion(
+                messages=build_continuation_messages(messages, guard.text, settings.continuation_tail_chars),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                model=model
+            )) as stream:
+                async for chunk in stream:
+                    finish_reason = chunk.get("finish_reason") or finish_reason
+                    delta = chunk["content"]
+                    if not stitched:
+                        # 先攒够可能与已写结尾重叠的长度，去掉重复部分后再送入校验
+                        head += delta
+                        if len(head) < MAX_OVERLAP_CHARS:
+                            continue
+                        delta = stitch_continuation(guard.text, head)[len(guard.text):]
+                        stitched = True
+                    if not guard.feed(delta):
+                        break
+                    normalizer.feed(delta)
+            
+            if not stitched:
+                if not head.strip():
+                    break
+                delta = stitch_continuation(guard.text, head)[len(guard.text):]
+                if guard.feed(delta):
+                    normalizer.feed(delta)
+        
+        generation_metrics.incr("continuation.requests", continuations)
+        if finish_reason == "length" and not guard.aborted:
+            generation_metrics.incr("continuation.exhausted")
+            print(f"⚠️ 续写 {continuations} 次后仍被截断，保留已生成的内容")
+        return continuations
+    
+    def _finish_normalized(self, normalizer: ChapterNormalizer) -> Tuple[str, Dict[str, Any]]:
+        """结束规范化并记录格式指标"""
+        content = normalizer.finish()
+        report = normalizer.report
+        generation_metrics.incr("normalizer.chapters")
+        generation_metrics.incr("normalizer.unmarked_lines", report["unmarked_lines"])
+        generation_metrics.incr("normalizer.removed_lines", report["removed_lines"])
+        if not report["format_ok"]:
+            generation_metrics.incr("normalizer.format_failures")
+            print(f"⚠️ 章节输出不符合标记格式（标记行占比 {report['marked_ratio']:.0%}）")
+        return content, report
+    
     def _build_context(self, 
                       novel_title: str,
                       chapter_info: Dict[str, Any], 
                       previous_chapters: List[str],
-                      materials: List[Dict[str, Any]]) -> str:
+                      materials: List[Dict[str, Any]],
+                      previous_chapter_numbers: Optional[List[int]] = None,
+                      characters: Optional[List[Dict[str, Any]]] = None) -> str:
         """构建章节生成的上下文"""
         
         context_parts = []
@@ -138,13 +328,22 @@ class ChapterGenerator:
         # 添加前面章节的摘要（最多3章）
         if previous_chapters:
             recent_chapters = previous_chapters[-3:]  # 只取最近3章
+            if previous_chapter_numbers and len(previous_chapter_numbers) == len(previous_chapters):
+                recent_numbers = previous_chapter_numbers[-3:]
+            else:
+                recent_numbers = [len(previous_chapters) - len(recent_chapters) + i
+                                  for i in range(1, len(recent_chapters) + 1)]
             chapter_context = "前面章节概要：\n"
-            for i, chapter_content in enumerate(recent_chapters, 1):
+            for number, chapter_content in zip(recent_numbers, recent_chapters):
                 # 截取章节开头作为摘要
                 summary = chapter_content[:200] + "..." if len(chapter_content) > 200 else chapter_content
-                chapter_context += f"第{len(previous_chapters) - len(recent_chapters) + i}章：{summary}\n\n"
+                chapter_context += f"第{number}章：{summary}\n\n"
             context_parts.append(chapter_context)
         
+        # 本章涉及角色的连贯性资料
+        if characters:
+            context_parts.append(format_character_context(characters))
+        
         return "\n".join(context_parts)
     
     def _extract_required_words_from_materials(self, materials: List[Dict[str, Any]]) -> List[str]:
@@ -161,7 +360,7 @@ class ChapterGenerator:
         
         return list(set(required_words))  # 去重
     
-    def generate_chapter_with_dialogue(self, 
+    async def generate_chapter_with_dialogue(self, 
                                      novel_title: str,
                                      chapter_info: Dict[str, Any],
                                      previous_chapters: List[str],
@@ -170,7 +369,7 @@ class ChapterGenerator:
                                      target_length: int = 2000) -> Dict[str, Any]:
         """生成包含对话交互的章节"""
         
-        base_result = self.generate_chapter(novel_title, chapter_info, previous_chapters, materials, target_length)
+        base_result = await self.generate_chapter(novel_title, chapter_info, previous_chapters, materials, target_length)
         
         if dialogue_context:
             # 如果有对话上下文，可以在这里添加特殊处理
@@ -179,7 +378,7 @@ class ChapterGenerator:
         
         return base_result
     
-    def regenerate_chapter_with_missing_words(self, 
+    async def regenerate_chapter_with_missing_words(self, 
                                             novel_title: str,
                                             chapter_info: Dict[str, Any],
                                             previous_chapters: List[str],
@@ -233,48 +432,14 @@ class ChapterGenerator:
 正文：他看向远处的大楼，心中涌起不安的预感。
 """
         
-        try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "你是一个专业的小说作家，擅长写作各种类型的小说章节。你特别擅长在保持故事流畅性的同时，自然地融入指定的字词。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.9,  # 稍微提高创造性
-                max_tokens=4000
-            )
-            
-            content = response.choices[0].message.content
-            word_count = len(content)
-            
-            # 验证必须用到的字是否都包含在内容中
-            required_words = chapter_info.get('required_words', [])
-            used_words = []
-            still_missing_words = []
-            
-            if required_words:
-                for word in required_words:
-                    if word in content:
-                        used_words.append(word)
-                    else:
-                        still_missing_words.append(word)
-            
-            return {
-                "content": content,
-                "word_count": word_count,
-                "status": "completed",
-                "required_words": required_words,
-                "used_words": used_words,
-                "missing_words": still_missing_words,
-                "words_completion_rate": len(used_words) / len(required_words) if required_words else 1.0,
-                "is_regenerated": True
-            }
-                
-        except Exception as e:
-            print(f"重新生成章节时出错: {e}")
-            return {
-                "content": f"第{chapter_info['number']}章重新生成失败，请重试。",
-                "word_count": 0,
-                "status": "failed",
-                "is_regenerated": True
-            }
+        return await self._generate_and_check(
+            task=TASK_VALIDATION_RETRY,
+            messages=[
+                {"role": "system", "content": "你是一个专业的小说作家，擅长写作各种类型的小说章节。你特别擅长在保持故事流畅性的同时，自然地融入指定的字词。"},
+                {"role": "user", "content": prompt}
+            ],
+            chapter_info=chapter_info,
+            target_length=target_length,
+            temperature=0.9,  # 稍微提高创造性
+            extra={"is_regenerated": True}
+        )
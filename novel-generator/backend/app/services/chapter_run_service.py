@@ -0,0 +1,299 @@
+"""
+章节批量生成服务
+提供单章生成的公共流程，以及按并发上限生成小说剩余章节的后台任务（进度事件可被多个订阅者流式读取，可取消）
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Any, Optional, AsyncIterator
+
+from ..config import settings
+from ..models.chapter_novel import ChapterNovel, ChapterInfo, ChapterStatus, ChapterContextHead
+from .entity_index_service import entity_index_service
+from .generation_metrics import generation_metrics
+from .llm_scheduler import tag_llm_context, PRIORITY_BATCH
+
+RUN_RUNNING = "running"
+RUN_COMPLETED = "completed"
+RUN_CANCELLED = "cancelled"
+RUN_FAILED = "failed"
+
+
+class ChapterLockedError(Exception):
+    """章节正在被其他请求生成（或已完成）"""
+
+
+async def _renew_lease_periodically(chapter: ChapterInfo, owner: str) -> None:
+    """生成期间定期续约，避免耗时较长的生成被回收任务或其他请求当作过期租约接管"""
+    while True:
+        await asyncio.sleep(settings.chapter_lease_renew_seconds)
+        try:
+            if not await chapter.renew_lease(owner, settings.chapter_lease_seconds):
+                return
+        except Exception as e:
+            print(f"⚠️ 第{chapter.chapter_number}章租约续约失败: {e}")
+
+
+async def generate_chapter_record(novel: ChapterNovel,
+                                  chapter: ChapterInfo,
+                                  chapter_info: Dict[str, Any],
+                                  chapter_gen: Any,
+                                  materials: List[Dict[str, Any]],
+                                  target_length: int = 2000,
+                                  previous_heads: Optional[List[ChapterContextHead]] = None) -> Dict[str, Any]:
+    """生成单个章节并保存（单章接口和批量任务共用）
+
+    previous_heads为空时自行查询前文开头片段；章节已被占用时抛出ChapterLockedError；
+    生成期间按chapter_lease_renew_seconds续约租约；生成过程中被取消时，章节状态恢复为生成前的状态后再抛出取消异常
+    """
+    # 前面已完成章节只取最近3章的开头片段（数据库端截取）
+    if previous_heads is None:
+        previous_heads = await ChapterInfo.get_context_heads(str(novel.id), chapter.chapter_number)
+
+    # 原子地获取章节生成租约（PLANNED/FAILED -> WRITING），避免并发请求重复调用模型
+    owner = uuid.uuid4().hex
+    previous_status = await chapter.acquire_lease(owner, settings.chapter_lease_seconds)
+    if previous_status is None:
+        generation_metrics.incr("chapter_lease.conflicts")
+        raise ChapterLockedError(f"第{chapter.chapter_number}章正在生成中或已完成")
+
+    heartbeat = asyncio.create_task(_renew_lease_periodically(chapter, owner))
+    try:
+        characters = await entity_index_service.context_for_chapter(novel, chapter_info)
+        result = await chapter_gen.generate_chapter(
+            novel_title=novel.title,
+            chapter_info=chapter_info,
+            previous_chapters=[head.head for head in previous_heads],
+            materials=materials,
+            target_length=target_length,
+            previous_chapter_numbers=[head.chapter_number for head in previous_heads],
+            characters=characters
+        )
+    except asyncio.CancelledError:
+        await asyncio.shield(chapter.release_lease(owner, previous_status))
+        raise
+    except Exception:
+        await chapter.release_lease(owner, ChapterStatus.FAILED)
+        raise
+    finally:
+        heartbeat.cancel()
+
+    # 保存章节内容（租约已被接管时放弃本次结果）
+    status = ChapterStatus.COMPLETED if result["status"] == "completed" else ChapterStatus.FAILED
+    saved = await chapter.release_lease(owner, status, content=result["content"],
+                                        word_count=result["word_count"],
+                                        format_report=result.get("format_report"),
+                                        continuation_count=result.get("continuation_count", 0))
+    if not saved:
+        generation_metrics.incr("chapter_lease.lost")
+        raise ChapterLockedError(f"第{chapter.chapter_number}章的生成租约已过期并被其他请求接管")
+
+    # 更新小说状态和角色索引
+    if chapter.status == ChapterStatus.COMPLETED:
+        await novel.update_completed_count()
+        try:
+            await entity_index_service.update_from_chapter(novel, chapter.chapter_number, chapter.content)
+        except Exception as e:
+            print(f"⚠️ 更新角色索引失败: {e}")
+
+    return result
+
+
+class ChapterRun:
+    """一次“生成剩余章节”任务，记录全部进度事件，订阅者可以从头回放并持续接收"""
+
+    def __init__(self, novel_id: str, chapter_numbers: List[int], concurrency: int):
+        self.run_id = uuid.uuid4().hex
+        self.novel_id = novel_id
+        self.chapter_numbers = chapter_numbers
+        self.concurrency = concurrency
+        self.status = RUN_RUNNING
+        self.completed: List[int] = []
+        self.failed: List[int] = []
+        self.events: List[Dict[str, Any]] = []
+        self.created_at = datetime.now()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != RUN_RUNNING
+
+    async def emit(self, event: str, **data: Any) -> None:
+        """追加一条进度事件并唤醒所有订阅者"""
+        async with self._changed:
+            self.events.append({"event": event, "data": {"run_id": self.run_id, **data}})
+            self._changed.notify_all()
+
+    async def finish(self, status: str, **data: Any) -> None:
+        """标记任务结束并发送结束事件"""
+        self.status = status
+        await self.emit("run_finished", status=status, completed=self.completed,
+                        failed=self.failed, **data)
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        """按顺序产出全部事件，任务结束且事件读完后停止"""
+        index = 0
+        while True:
+            async with self._changed:
+                while index >= len(self.events) and not self.finished:
+                    await self._changed.wait()
+                pending = self.events[index:]
+                done = self.finished
+            for event in pending:
+                yield event
+            index += len(pending)
+            if done and index >= len(self.events):
+                return
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            "run_id": self.run_id,
+            "novel_id": self.novel_id,
+            "status": self.status,
+            "chapters": self.chapter_numbers,
+            "concurrency": self.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "created_at": self.created_at.isoformat()
+        }
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """把进度事件编码为SSE消息"""
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+class ChapterRunService:
+    """剩余章节批量生成任务管理（进程内，每部小说同时只有一个运行中的任务）"""
+
+    def __init__(self):
+        self._runs: Dict[str, ChapterRun] = {}  # novel_id -> 最近一次任务
+
+    def get_run(self, novel_id: str) -> Optional[ChapterRun]:
+        return self._runs.get(novel_id)
+
+    def get_active_run(self, novel_id: str) -> Optional[ChapterRun]:
+        run = self._runs.get(novel_id)
+        return run if run and not run.finished else None
+
+    async def start_run(self,
+                        novel: ChapterNovel,
+                        chapter_gen: Any,
+                        materials: List[Dict[str, Any]],
+                        target_length: int = 2000,
+                        concurrency: Optional[int] = None) -> ChapterRun:
+        """启动剩余章节（PLANNED/FAILED）的生成任务；已有运行中的任务时直接返回该任务"""
+        novel_id = str(novel.id)
+        active = self.get_active_run(novel_id)
+        if active:
+            return active
+
+        concurrency = max(1, min(concurrency or settings.chapter_run_concurrency,
+                                 settings.chapter_run_max_concurrency))
+        # 先登记任务再查询章节，避免并发请求重复启动
+        run = ChapterRun(novel_id, [], concurrency)
+        self._runs[novel_id] = run
+        try:
+            chapters = await ChapterInfo.find(
+                ChapterInfo.novel_id == novel_id,
+                {"status": {"$in": [ChapterStatus.PLANNED.value, ChapterStatus.FAILED.value]}}
+            ).sort(ChapterInfo.chapter_number).to_list()
+            run.chapter_numbers = [chapter.chapter_number for chapter in chapters]
+
+            await run.emit("run_started", chapters=run.chapter_numbers, concurrency=concurrency)
+            run.task = asyncio.create_task(
+                self._execute(run, novel, chapters, chapter_gen, materials, target_length)
+            )
+        except BaseException as e:
+            # 启动失败（含请求被取消）时结束已登记的任务，避免留下没有后台任务、永远处于运行中的记录
+            generation_metrics.incr("chapter_run.start_failed")
+            await asyncio.shield(run.finish(RUN_FAILED, error=str(e) or type(e).__name__))
+            raise
+        generation_metrics.incr("chapter_run.started")
+        return run
+
+    async def cancel_run(self, novel_id: str) -> Optional[ChapterRun]:
+        """取消运行中的任务，正在生成的章节恢复原状态"""
+        run = self.get_active_run(novel_id)
+        if run and run.task:
+            run.task.cancel()
+            try:
+                await run.task
+            except asyncio.CancelledError:
+                pass
+        return run
+
+    async def _execute(self,
+                       run: ChapterRun,
+                       novel: ChapterNovel,
+                       chapters: List[ChapterInfo],
+                       chapter_gen: Any,
+                       materials: List[Dict[str, Any]],
+                       target_length: int) -> None:
+        """按并发上限生成章节，每章开始/完成/失败都发送进度事件"""
+        # 批量任务的模型调用排在交互请求之后，同类任务之间按小说公平排队
+        tag_llm_context(PRIORITY_BATCH, fair_key=run.novel_id)
+        outline_chapters = {ch["number"]: ch for ch in (novel.outline or {}).get("chapters", [])}
+        semaphore = asyncio.Semaphore(run.concurrency)
+        start = time.perf_counter()
+
+        async def generate_one(chapter: ChapterInfo) -> None:
+            async with semaphore:
+                number = chapter.chapter_number
+                chapter_info = outline_chapters.get(number)
+                if not chapter_info:
+                    run.failed.append(number)
+                    await run.emit("chapter_failed", chapter_number=number, error="大纲中未找到该章节信息")
+                    return
+
+                await run.emit("chapter_started", chapter_number=number, title=chapter.title)
+                chapter_start = time.perf_counter()
+                try:
+                    result = await generate_chapter_record(
+                        novel, chapter, chapter_info, chapter_gen, materials, target_length
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except ChapterLockedError as e:
+                    await run.emit("chapter_skipped", chapter_number=number, reason=str(e))
+                    return
+                except Exception as e:
+                    run.failed.append(number)
+                    generation_metrics.incr("chapter_run.chapters_failed")
+                    await run.emit("chapter_failed", chapter_number=number, error=str(e))
+                    return
+
+                elapsed = round(time.perf_counter() - chapter_start, 2)
+                if chapter.status == ChapterStatus.COMPLETED:
+                    run.completed.append(number)
+                    generation_metrics.incr("chapter_run.chapters_completed")
+                    await run.emit("chapter_completed", chapter_number=number,
+                                   word_count=result["word_count"], elapsed_seconds=elapsed,
+                                   progress=f"{len(run.completed) + len(run.failed)}/{len(run.chapter_numbers)}")
+                else:
+                    run.failed.append(number)
+                    generation_metrics.incr("chapter_run.chapters_failed")
+                    await run.emit("chapter_failed", chapter_number=number,
+                                   error=result.get("error", "生成失败"), elapsed_seconds=elapsed)
+
+        try:
+            await asyncio.gather(*(generate_one(chapter) for chapter in chapters))
+        except asyncio.CancelledError:
+            generation_metrics.incr("chapter_run.cancelled")
+            await run.finish(RUN_CANCELLED, elapsed_seconds=round(time.perf_counter() - start, 2))
+            raise
+        except Exception as e:
+            print(f"❌ 剩余章节生成任务异常: {e}")
+            await run.finish(RUN_FAILED, error=str(e), elapsed_seconds=round(time.perf_counter() - start, 2))
+            return
+
+        await run.finish(RUN_COMPLETED, elapsed_seconds=round(time.perf_counter() - start, 2))
+
+
+# 创建全局实例
+chapter_run_service = ChapterRunService()
@@ -0,0 +1,146 @@
+"""
+章节输出规范化
+在章节流式生成时逐行规范化模型输出：去掉Markdown标题、分隔线和章节标题行，统一标记（正文：/主角：/角色名：）
+和冒号、引号写法，去掉空行，并标记不符合格式的行。保存的章节内容每行都是“标记：内容”，
+读取端（对话提取、角色扮演）直接按行切分即可，不再需要各自的兼容处理
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+NARRATION_MARKER = "正文"
+PROTAGONIST_MARKER = "主角"
+
+# 旁白标记的其他写法
+NARRATION_ALIASES = {"正文", "旁白", "叙述", "描写", "叙事"}
+
+# 统一为半角双引号（DialogueParser按半角双引号识别对话）
+QUOTE_TABLE = str.maketrans({"“": '"', "”": '"', "「": '"', "」": '"', "『": '"', "』": '"', "＂": '"'})
+
+HEADER_PATTERN = re.compile(r'^#{1,6}\s*')
+CHAPTER_TITLE_PATTERN = re.compile(r'^第[零一二三四五六七八九十百千\d]+[章节]')
+RULE_PATTERN = re.compile(r'^([-*_=]\s*){3,}$')
+BULLET_PATTERN = re.compile(r'^(?:[-*+>]\s+)+')
+# 标记行：说话者（可带括号注释，如“张三（低声）”）+ 全角或半角冒号
+MARKER_PATTERN = re.compile(r'^([^\s：:"（）()]{1,20})\s*(?:[（(][^）)]{0,20}[）)])?\s*[：:]\s*(.*)$')
+
+# “他说：……”这类叙述句中的冒号不是标记
+SPEECH_VERB_SUFFIXES = ("说", "道", "问", "喊", "答", "叫")
+
+FLAG_SAMPLE_LIMIT = 5
+FLAG_SAMPLE_CHARS = 40
+
+
+def canonicalize_quotes(text: str) -> str:
+    """把全角、直角引号统一为半角双引号"""
+    return text.translate(QUOTE_TABLE)
+
+
+class ChapterNormalizer:
+    """章节内容的逐行规范化器
+
+    feed()接收流式增量，finish()返回规范化后的全文；没有标记的行在标记行占比不低于min_marked_ratio时
+    作为旁白补上“正文：”，否则保持原样（整章未按格式输出），两种情况都会计入报告
+    """
+
+    def __init__(self, min_marked_ratio: float = 0.5):
+        self.min_marked_ratio = min_marked_ratio
+        self._pending = ""
+        self._lines: List[str] = []
+        self._unmarked: List[int] = []  # 没有标记的行在_lines中的位置
+        self._dangling_marker: Optional[str] = None  # 只有标记没有内容的行，内容在下一行
+        self._removed = 0
+        self._quotes = 0
+        self.report: Dict[str, Any] = {}
+
+    def feed(self, delta: str) -> None:
+        """输入一段增量内容，处理其中的完整行"""
+        if not delta:
+            return
+        self._pending += delta
+        while "\n" in self._pending:
+            line, self._pending = self._pending.split("\n", 1)
+            self._process_line(line)
+
+    def finish(self) -> str:
+        """处理最后一行并返回规范化后的内容，报告写入self.report"""
+        if self._pending:
+            self._process_line(self._pending)
+            self._pending = ""
+
+        total = len(self._lines)
+        marked = total - len(self._unmarked)
+        marked_ratio = marked / total if total else 0.0
+        format_ok = total > 0 and marked_ratio >= self.min_marked_ratio
+        flagged = [self._lines[index] for index in self._unmarked]
+        if format_ok:
+            for index in self._unmarked:
+                self._lines[index] = f"{NARRATION_MARKER}：{self._lines[index]}"
+
+        self.report = {
+            "normalized": True,
+            "format_ok": format_ok,
+            "lines": total,
+            "marked_ratio": round(marked_ratio, 3),
+            "unmarked_lines": len(flagged),
+            "unmarked_samples": [line[:FLAG_SAMPLE_CHARS] for line in flagged[:FLAG_SAMPLE_LIMIT]],
+            "removed_lines": self._removed,
+            "quotes_replaced": self._quotes
+        }
+        return "\n".join(self._lines)
+
+    def _process_line(self, raw: str) -> None:
+        line = raw.strip().replace("**", "")
+        if not line:
+            return
+        if HEADER_PATTERN.match(line) or RULE_PATTERN.match(line) or CHAPTER_TITLE_PATTERN.match(line):
+            self._removed += 1
+            return
+        line = BULLET_PATTERN.sub("", line)
+
+        canonical = canonicalize_quotes(line)
+        if canonical != line:
+            self._quotes += sum(1 for a, b in zip(line, canonical) if a != b)
+            line = canonical
+
+        match = MARKER_PATTERN.match(line)
+        if match and not match.group(1).endswith(SPEECH_VERB_SUFFIXES):
+            speaker, text = match.group(1), match.group(2).strip()
+            if speaker in NARRATION_ALIASES:
+                speaker = NARRATION_MARKER
+            if not text:
+                self._dangling_marker = speaker
+                return
+            self._dangling_marker = None
+            self._lines.append(f"{speaker}：{text}")
+            return
+
+        if self._dangling_marker:
+            self._lines.append(f"{self._dangling_marker}：{line}")
+            self._dangling_marker = None
+            return
+        self._unmarked.append(len(self._lines))
+        self._lines.append(line)
+
+
+def normalize_chapter_content(text: str, min_marked_ratio: float = 0.5) -> tuple:
+    """一次性规范化整章内容，返回(内容, 报告)"""
+    normalizer = ChapterNormalizer(min_marked_ratio)
+    normalizer.feed(text)
+    return normalizer.finish(), normalizer.report
+
+
+def parse_normalized_content(content: str) -> List[Dict[str, Any]]:
+    """解析已规范化的章节内容：每行“标记：内容”，按第一个全角冒号切分"""
+    dialogues = []
+    for line in content.split("\n"):
+        speaker, sep, text = line.partition("：")
+        if not sep:
+            continue
+        if speaker == NARRATION_MARKER:
+            dialogues.append({"speaker": "旁白", "text": text, "type": "narration",
+                              "is_protagonist": False, "required_chars_used": []})
+        else:
+            dialogues.append({"speaker": speaker, "text": text, "type": "dialogue",
+                              "is_protagonist": speaker == PROTAGONIST_MARKER, "required_chars_used": []})
+    return dialogues
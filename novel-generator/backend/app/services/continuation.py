@@ -0,0 +1,29 @@
+"""
+长度截断续写
+模型输出因max_tokens达到上限（finish_reason == "length"）被截断时，把已写内容的结尾作为助手消息附在原请求后，
+请模型从断开处接着写，再把续写内容去掉与结尾重复的部分后拼接。续写轮数受continuation_max_rounds限制
+"""
+
+from typing import Dict, List
+
+CONTINUATION_INSTRUCTION = "上文因长度限制中断。请从断开处直接接着写完，不要重复已写的内容，不要添加任何说明，保持相同的格式。"
+
+MIN_OVERLAP_CHARS = 6  # 重叠少于该字数时视为巧合，不做去重
+MAX_OVERLAP_CHARS = 200  # 最多检查的重叠长度
+
+
+def build_continuation_messages(messages: List[Dict[str, str]], text: str, tail_chars: int) -> List[Dict[str, str]]:
+    """续写请求的消息：原始消息 + 已写内容的结尾（助手消息）+ 续写指令"""
+    return messages + [
+        {"role": "assistant", "content": text[-tail_chars:]},
+        {"role": "user", "content": CONTINUATION_INSTRUCTION}
+    ]
+
+
+def stitch_continuation(text: str, addition: str, max_overlap: int = MAX_OVERLAP_CHARS) -> str:
+    """拼接续写内容，去掉续写开头重复已写结尾的部分"""
+    for size in range(min(max_overlap, len(text), len(addition)), MIN_OVERLAP_CHARS - 1, -1):
+        if text.endswith(addition[:size]):
+            addition = addition[size:]
+            break
+    return text + addition
@@ -1,8 +1,13 @@
 import httpx
 import json
 import asyncio
-from typing import Dict, List, Any, Optional
+import time
+from typing import Dict, List, Any, Optional, AsyncIterator, Tuple
 from ..config import settings
+from .continuation import build_continuation_messages, stitch_continuation
+from .generation_metrics import generation_metrics
+from .llm_usage import record_llm_usage, record_llm_throughput, estimate_tokens
+from .llm_scheduler import llm_scheduler
 
 class DeepSeekClient:
     """DeepSeek API客户端"""
@@ -20,7 +25,9 @@ class DeepSeekClient:
         messages: List[Dict[str, str]],
         max_tokens: int = 4000,
         temperature: float = 0.8,
-        stream: bool = False
+        stream: bool = False,
+        model: Optional[str] = None,
+        response_format: Optional[Dict[str, str]] = None
     ) -> Dict[str, Any]:
         """调用DeepSeek聊天完成API"""
         
@@ -32,58 +39,70 @@ class DeepSeekClient:
         }
         
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": messages,
             "max_tokens": max_tokens,
             "temperature": temperature,
             "stream": stream
         }
+        if response_format:
+            payload["response_format"] = response_format
         
         try:
             # 为长文本生成增加超时时间
             timeout = httpx.Timeout(300.0, connect=30.0, read=300.0, write=30.0)
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                print(f"🌐 发送请求到: {url}")
-                print(f"🔑 使用API密钥: {self.api_key[:8]}...")
-                print(f"📊 请求载荷大小: {len(json.dumps(payload))} 字符")
-                
-                response = await client.post(
-                    url,
-                    headers=headers,
-                    json=payload
-                )
-                
-                print(f"📡 收到响应状态: {response.status_code}")
-                print(f"📄 响应内容长度: {len(response.text)} 字符")
-                
-                if response.status_code == 200:
-                    response_data = response.json()
+            async with llm_scheduler.slot():
+                async with httpx.AsyncClient(timeout=timeout) as client:
+                    print(f"🌐 发送请求到: {url}")
+                    print(f"🔑 使用API密钥: {self.api_key[:8]}...")
+                    print(f"📊 请求载荷大小: {len(json.dumps(payload))} 字符")
                     
-                    # 检查响应内容是否为空
-                    if 'choices' in response_data and len(response_data['choices']) > 0:
-                        message = response_data['choices'][0]['message']
-                        content = message.get('content', '')
-                        reasoning_content = message.get('reasoning_content', '')
+                    request_start = time.perf_counter()
+                    response = await client.post(
+                        url,
+                        headers=headers,
+                        json=payload
+                    )
+                    
+                    print(f"📡 收到响应状态: {response.status_code}")
+                    print(f"📄 响应内容长度: {len(response.text)} 字符")
+                    
+                    if response.status_code == 200:
+                        response_data = response.json()
+                        usage = response_data.get("usage") or {}
+                        record_llm_usage(
+                            prompt_tokens=usage.get("prompt_tokens", 0),
+                            completion_tokens=usage.get("completion_tokens", 0),
+                            calls=1
+                        )
+                        record_llm_throughput(payload["model"], usage.get("completion_tokens", 0),
+                                              time.perf_counter() - request_start)
                         
-                        # DeepSeek-reasoner模型优先使用reasoning_content
-                        final_content = content if content and content.strip() else reasoning_content
+                        # 检查响应内容是否为空
+                        if 'choices' in response_data and len(response_data['choices']) > 0:
+                            message = response_data['choices'][0]['message']
+                            content = message.get('content', '')
+                            reasoning_content = message.get('reasoning_content', '')
+                            
+                            # DeepSeek-reasoner模型优先使用reasoning_content
+                            final_content = content if content and content.strip() else reasoning_content
+                            
+                            if not final_content or final_content.strip() == "":
+                                print("⚠️ API返回空内容，可能是因为:")
+                                print("   1. 请求内容触发了安全过滤")
+                                print("   2. API服务器临时问题")
+                                print("   3. 请求超出了模型能力范围")
+                                print("🔄 建议稍后重试或调整提示词")
+                            else:
+                                print(f"✅ 获得有效响应，内容长度: {len(final_content)} 字符")
+                                if reasoning_content and not content:
+                                    print("🧠 使用reasoning_content作为主要内容")
                         
-                        if not final_content or final_content.strip() == "":
-                            print("⚠️ API返回空内容，可能是因为:")
-                            print("   1. 请求内容触发了安全过滤")
-                            print("   2. API服务器临时问题")
-                            print("   3. 请求超出了模型能力范围")
-                            print("🔄 建议稍后重试或调整提示词")
-                        else:
-                            print(f"✅ 获得有效响应，内容长度: {len(final_content)} 字符")
-                            if reasoning_content and not content:
-                                print("🧠 使用reasoning_content作为主要内容")
-                    
-                    return response_data
-                else:
-                    error_msg = f"API调用失败: {response.status_code} - {response.text}"
-                    print(error_msg)
-                    raise Exception(error_msg)
+                        return response_data
+                    else:
+                        error_msg = f"API调用失败: {response.status_code} - {response.text}"
+                        print(error_msg)
+                        raise Exception(error_msg)
                     
         except httpx.ReadTimeout:
             error_msg = "DeepSeek API请求超时，请稍后重试"
@@ -98,8 +117,131 @@ class DeepSeekClient:
             print(error_msg)
             raise Exception(error_msg)
     
-    async def generate_novel_content(self, prompt: str, max_retries: int = 3) -> str:
-        """生成小说内容（带重试机制）"""
+    def supports_json_mode(self, model: Optional[str] = None) -> bool:
+        """判断模型是否支持JSON输出模式（response_format=json_object）"""
+        json_models = [name.strip() for name in settings.json_mode_models.split(",") if name.strip()]
+        return (model or self.model) in json_models
+    
+    def json_response_format(self, model: Optional[str] = None) -> Optional[Dict[str, str]]:
+        """支持时返回JSON输出模式参数，否则返回None"""
+        return {"type": "json_object"} if self.supports_json_mode(model) else None
+    
+    async def stream_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 4000,
+        temperature: float = 0.8,
+        model: Optional[str] = None,
+        response_format: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """流式调用DeepSeek聊天完成API，逐块产出增量内容
+        
+        调用方提前关闭生成器（aclose）即会断开上游连接，停止继续生成。
+        """
+        
+        url = f"{self.api_base}/v1/chat/completions"
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": model or self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+            # 最后一个数据块附带实际token用量
+            "stream_options": {"include_usage": True}
+        }
+        if response_format:
+            payload["response_format"] = response_format
+        
+        timeout = httpx.Timeout(300.0, connect=30.0, read=300.0, write=30.0)
+        received_chars = 0
+        usage = None
+        request_start = first_token_at = None
+        try:
+            async with llm_scheduler.slot():
+                request_start = time.perf_counter()
+                async with httpx.AsyncClient(timeout=timeout) as client:
+                    async with client.stream("POST", url, headers=headers, json=payload) as response:
+                        if response.status_code != 200:
+                            body = await response.aread()
+                            error_msg = f"API调用失败: {response.status_code} - {body.decode('utf-8', errors='ignore')}"
+                            print(error_msg)
+                            raise Exception(error_msg)
+                        
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            
+                            chunk = json.loads(data)
+                            if chunk.get("usage"):
+                                usage = chunk["usage"]
+                            choices = chunk.get("choices") or []
+                            if not choices:
+                                if usage:
+                                    # 用量块没有增量内容，单独产出供调用方校准
+                                    yield {"content": "", "reasoning_content": "", "finish_reason": None, "usage": usage}
+                                continue
+                            delta = choices[0].get("delta") or {}
+                            delta_chars = len(delta.get("content") or "") + len(delta.get("reasoning_content") or "")
+                            if delta_chars and first_token_at is None:
+                                first_token_at = time.perf_counter()
+                            received_chars += delta_chars
+                            yield {
+                                "content": delta.get("content") or "",
+                                "reasoning_content": delta.get("reasoning_content") or "",
+                                "finish_reason": choices[0].get("finish_reason"),
+                                "usage": usage
+                            }
+        except httpx.ReadTimeout:
+            error_msg = "DeepSeek API请求超时，请稍后重试"
+            print(error_msg)
+            raise Exception(error_msg)
+        except httpx.ConnectTimeout:
+            error_msg = "连接DeepSeek API超时，请检查网络连接"
+            print(error_msg)
+            raise Exception(error_msg)
+        finally:
+            # 有usage块时使用实际用量，否则（提前中断、服务端不支持）按已收到的字符数估算
+            if usage:
+                record_llm_usage(
+                    prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    calls=1
+                )
+            else:
+                record_llm_usage(
+                    prompt_tokens=estimate_tokens(sum(len(m.get("content", "")) for m in messages)),
+                    completion_tokens=estimate_tokens(received_chars),
+                    calls=1
+                )
+            if first_token_at is not None:
+                record_llm_throughput(
+                    payload["model"],
+                    usage.get("completion_tokens", 0) if usage else estimate_tokens(received_chars),
+                    time.perf_counter() - first_token_at,
+                    first_token_seconds=first_token_at - request_start
+                )
+    
+    async def generate_novel_content(self, prompt: str, max_retries: int = 3, max_tokens: int = 10000,
+                                     model: Optional[str] = None) -> str:
+        """生成小说内容（带重试机制），model为空时使用默认模型"""
+        content, _ = await self.generate_novel_content_with_continuations(
+            prompt, max_retries=max_retries, max_tokens=max_tokens, model=model
+        )
+        return content
+    
+    async def generate_novel_content_with_continuations(self, prompt: str, max_retries: int = 3,
+                                                        max_tokens: int = 10000,
+                                                        model: Optional[str] = None) -> Tuple[str, int]:
+        """生成小说内容，输出因长度上限被截断时自动续写，返回(内容, 续写次数)"""
         messages = [
             {
                 "role": "system",
@@ -117,8 +259,9 @@ class DeepSeekClient:
                 
                 response = await self.chat_completion(
                     messages=messages,
-                    max_tokens=10000,  # 增加token限制确保完整输出
-                    temperature=0.8
+                    max_tokens=max_tokens,  # 默认10000，确保整本输出完整
+                    temperature=0.8,
+                    model=model
                 )
                 
                 if 'choices' in response and len(response['choices']) > 0:
@@ -134,7 +277,9 @@ class DeepSeekClient:
                         print(f"✅ 第 {attempt + 1} 次尝试成功！")
                         if reasoning_content and not content:
                             print("🧠 使用reasoning_content作为主要内容")
-                        return final_content
+                        if response['choices'][0].get('finish_reason') == "length":
+                            return await self._continue_truncated(messages, final_content, max_tokens, model)
+                        return final_content, 0
                     else:
                         print(f"⚠️ 第 {attempt + 1} 次尝试返回空内容")
                         if attempt < max_retries - 1:
@@ -155,3 +300,35 @@ class DeepSeekClient:
                 else:
                     print(f"💔 {max_retries} 次尝试全部失败")
                     raise e
+    
+    async def _continue_truncated(self, messages: List[Dict[str, str]], content: str, max_tokens: int,
+                                  model: Optional[str]) -> Tuple[str, int]:
+        """输出被长度上限截断时，以已写内容的结尾为种子续写并拼接，最多continuation_max_rounds轮"""
+        continuations = 0
+        finish_reason = "length"
+        while finish_reason == "length" and continuations < settings.continuation_max_rounds:
+            continuations += 1
+            print(f"✂️ 输出达到长度上限，第 {continuations} 次续写（已有 {len(content)} 字符）")
+            try:
+                response = await self.chat_completion(
+                    messages=build_continuation_messages(messages, content, settings.continuation_tail_chars),
+                    max_tokens=max_tokens,
+                    temperature=0.8,
+                    model=model
+                )
+            except Exception as e:
+                # 续写失败时保留已有内容，不重新生成整段
+                print(f"❌ 续写失败: {e}")
+                break
+            choice = (response.get('choices') or [{}])[0]
+            addition = (choice.get('message') or {}).get('content') or ""
+            finish_reason = choice.get('finish_reason')
+            if not addition.strip():
+                break
+            content = stitch_continuation(content, addition)
+        
+        generation_metrics.incr("continuation.requests", continuations)
+        if finish_reason == "length":
+            generation_metrics.incr("continuation.exhausted")
+            print(f"⚠️ 续写 {continuations} 次后仍被截断，保留已生成的内容")
+        return content, continuations
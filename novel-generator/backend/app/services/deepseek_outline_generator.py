@@ -1,6 +1,21 @@
+import asyncio
 import json
-from typing import Dict, List, Any
+import math
+import time
+from contextlib import aclosing
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Set
 from .deepseek_client import DeepSeekClient
+from .outline_stream_parser import IncrementalOutlineParser
+from .generation_metrics import generation_metrics
+from .model_policy import model_policy, ModelDecision, TASK_OUTLINE, TASK_REPAIR
+from ..config import settings
+
+# 返回{"chapters": [...]}的小请求的输出上限：每章预留的token数和固定部分，总量不超过CHAPTER_LIST_MAX_TOKENS
+CHAPTER_LIST_TOKENS_PER_CHAPTER = 400
+CHAPTER_LIST_BASE_TOKENS = 200
+CHAPTER_LIST_MAX_TOKENS = 4000
+# 一次请求最多重新规划的章节数，保证输出上限足够容纳全部章节，JSON不会被截断
+REPLAN_BATCH_SIZE = (CHAPTER_LIST_MAX_TOKENS - CHAPTER_LIST_BASE_TOKENS) // CHAPTER_LIST_TOKENS_PER_CHAPTER
 
 class DeepSeekOutlineGenerator:
     def __init__(self, api_key: str):
@@ -10,8 +25,34 @@ class DeepSeekOutlineGenerator:
                         title: str, 
                         materials: List[Dict[str, Any]], 
                         chapter_count: int = 10,
-                        required_words: List[str] = None) -> Dict[str, Any]:
-        """使用DeepSeek API生成小说大纲"""
+                        required_words: List[str] = None,
+                        on_chapter: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """使用DeepSeek API生成小说大纲
+        
+        大纲以流式方式接收并增量解析，每个章节对象闭合时立即回调on_chapter；
+        输出被截断或部分章节不合格时保留有效章节，只为缺失章节发起补写请求。
+        模型由按任务选择策略决定，一次生成即得到完整合格大纲记为成功。
+        章节数超过outline_hierarchical_threshold时改用分卷大纲（先生成全书分卷，再并发生成各卷章节）。
+        """
+        if chapter_count > settings.outline_hierarchical_threshold:
+            return await self.generate_hierarchical_outline(
+                title, materials, chapter_count, required_words, on_chapter
+            )
+        
+        async with model_policy.use(TASK_OUTLINE) as decision:
+            return await self._generate_outline(
+                title, materials, chapter_count, required_words, on_chapter, decision
+            )
+    
+    async def _generate_outline(self,
+                                title: str,
+                                materials: List[Dict[str, Any]],
+                                chapter_count: int,
+                                required_words: Optional[List[str]],
+                                on_chapter: Optional[Callable[[Dict[str, Any]], Awaitable[None]]],
+                                decision: ModelDecision) -> Dict[str, Any]:
+        """生成大纲的实际流程"""
+        decision.success = False
         
         # 构建材料信息
         material_info = self._format_materials(materials)
@@ -69,53 +110,567 @@ class DeepSeekOutlineGenerator:
                 {"role": "user", "content": prompt}
             ]
             
-            response = await self.client.chat_completion(
-                messages=messages,
-                temperature=0.8,
-                max_tokens=4000
-            )
+            parser = IncrementalOutlineParser()
+            reasoning_parts = []
+            emitted_numbers: Set[int] = set()
             
-            if 'choices' in response and len(response['choices']) > 0:
-                message = response['choices'][0]['message']
-                content = message.get('content', '')
-                reasoning_content = message.get('reasoning_content', '')
-                
-                # DeepSeek-reasoner模型优先使用reasoning_content
-                final_content = content if content and content.strip() else reasoning_content
+            try:
+                async with aclosing(self.client.stream_chat_completion(
+                    messages=messages,
+                    temperature=0.8,
+                    max_tokens=4000,
+                    model=decision.model,
+                    response_format=self.client.json_response_format(decision.model)
+                )) as stream:
+                    async for chunk in stream:
+                        if chunk["reasoning_content"]:
+                            reasoning_parts.append(chunk["reasoning_content"])
+                        for chapter in parser.feed(chunk["content"]):
+                            await self._emit_chapter(chapter, chapter_count, emitted_numbers, on_chapter)
+                        if chunk["finish_reason"] == "length":
+                            print("⚠️ 大纲输出达到长度上限，已被截断")
+            except Exception as e:
+                # 已经收到部分章节时保留它们，否则按原逻辑回退
+                if not parser.chapters:
+                    raise
+                print(f"⚠️ 大纲流式输出中断: {e}")
+            
+            # DeepSeek-reasoner模型在content为空时使用reasoning_content
+            if not parser.buffer.strip() and reasoning_parts:
+                for chapter in parser.feed("".join(reasoning_parts)):
+                    await self._emit_chapter(chapter, chapter_count, emitted_numbers, on_chapter)
+            
+            if not parser.buffer.strip():
+                print("⚠️ API返回空内容")
+                return self._create_fallback_outline(title, chapter_count)
+            
+            if parser.completed:
+                outline_data = parser.fields
                 
-                if final_content:
-                    # 尝试解析JSON
-                    try:
-                        # 提取JSON部分（可能包含在代码块中）
-                        json_text = self._extract_json(final_content)
-                        outline_data = json.loads(json_text)
-                        
-                        # 验证大纲结构
-                        if self._validate_outline(outline_data, chapter_count):
-                            # 如果有必须用词，验证和补充分配
-                            if required_words:
-                                outline_data = self._ensure_words_distribution(outline_data, required_words)
-                            print(f"✅ 成功生成{chapter_count}章大纲")
-                            return outline_data
-                        else:
-                            print("⚠️ 生成的大纲结构不完整，使用备用方案")
-                            return self._create_fallback_outline(title, chapter_count)
-                            
-                    except json.JSONDecodeError as e:
-                        print(f"⚠️ JSON解析失败: {e}")
-                        print(f"原始内容: {final_content[:500]}...")
-                        return self._create_fallback_outline(title, chapter_count)
-                else:
-                    print("⚠️ API返回空内容")
-                    return self._create_fallback_outline(title, chapter_count)
+                # 验证大纲结构
+                if self._validate_outline(outline_data, chapter_count):
+                    # 如果有必须用词，验证和补充分配
+                    if required_words:
+                        outline_data = self._ensure_words_distribution(outline_data, required_words)
+                    print(f"✅ 成功生成{chapter_count}章大纲")
+                    decision.success = True
+                    return outline_data
+                print("⚠️ 生成的大纲结构不完整，保留有效章节并补写缺失部分")
+            elif emitted_numbers:
+                print("⚠️ 大纲输出被截断，保留已完成章节并补写缺失部分")
             else:
-                print("⚠️ API响应格式错误")
+                print("⚠️ JSON解析失败，未能解析出完整章节")
+                print(f"原始内容: {parser.buffer[:500]}...")
                 return self._create_fallback_outline(title, chapter_count)
+            
+            outline_data = await self._repair_outline(
+                title, chapter_count, parser, emitted_numbers, on_chapter
+            )
+            if required_words:
+                outline_data = self._ensure_words_distribution(outline_data, required_words)
+            return outline_data
                 
         except Exception as e:
             print(f"❌ 生成大纲时出错: {e}")
             return self._create_fallback_outline(title, chapter_count)
     
+    async def generate_hierarchical_outline(self,
+                                            title: str,
+                                            materials: List[Dict[str, Any]],
+                                            chapter_count: int,
+                                            required_words: List[str] = None,
+                                            on_chapter: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """分卷生成长篇大纲：先生成全书主线和分卷，再并发生成每卷的章节列表
+        
+        返回的大纲除扁平的chapters外还包含volumes（每卷的标题、概要和章节范围），
+        单卷输出被截断时只补写该卷缺失的章节，仍缺失的使用占位内容。
+        """
+        start_time = time.monotonic()
+        if not required_words:
+            required_words = self._extract_required_words_from_materials(materials)
+        
+        volume_ranges = self._split_volumes(chapter_count, settings.outline_volume_size)
+        arc = await self._generate_arc(title, materials, chapter_count, volume_ranges)
+        print(f"🗂️ 全书分为 {len(arc['volumes'])} 卷，开始并发生成各卷章节")
+        
+        emitted_numbers: Set[int] = set()
+        semaphore = asyncio.Semaphore(max(1, settings.outline_volume_concurrency))
+        
+        async def outline_volume(volume: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+            async with semaphore:
+                return await self._generate_volume_chapters(arc, volume, chapter_count, emitted_numbers, on_chapter)
+        
+        volume_results = await asyncio.gather(*(outline_volume(volume) for volume in arc["volumes"]))
+        chapters_by_number: Dict[int, Dict[str, Any]] = {}
+        for volume_chapters in volume_results:
+            chapters_by_number.update(volume_chapters)
+        
+        fallback = self._create_fallback_outline(title, chapter_count)
+        placeholder_count = chapter_count - len(chapters_by_number)
+        outline_data = {
+            "title": arc["title"],
+            "summary": arc["summary"],
+            "main_characters": arc["main_characters"],
+            "hierarchical": True,
+            "volumes": arc["volumes"],
+            "chapters": [
+                chapters_by_number.get(placeholder["number"], placeholder)
+                for placeholder in fallback["chapters"]
+            ]
+        }
+        if required_words:
+            outline_data = self._ensure_words_distribution(outline_data, required_words)
+        
+        elapsed = time.monotonic() - start_time
+        generation_metrics.incr("outline.hierarchical_runs")
+        generation_metrics.incr("outline.placeholder_chapters", placeholder_count)
+        generation_metrics.observe("outline.hierarchical_seconds", elapsed)
+        print(f"✅ 分卷大纲生成完成：{chapter_count} 章，占位 {placeholder_count} 章，耗时 {elapsed:.1f}秒")
+        return outline_data
+    
+    def _split_volumes(self, chapter_count: int, volume_size: int) -> List[tuple]:
+        """按卷大小均分章节范围，返回[(起始章, 结束章)]"""
+        volume_count = max(1, math.ceil(chapter_count / max(1, volume_size)))
+        base, extra = divmod(chapter_count, volume_count)
+        ranges = []
+        start = 1
+        for index in range(volume_count):
+            size = base + (1 if index < extra else 0)
+            ranges.append((start, start + size - 1))
+            start += size
+        return ranges
+    
+    async def _generate_arc(self,
+                            title: str,
+                            materials: List[Dict[str, Any]],
+                            chapter_count: int,
+                            volume_ranges: List[tuple]) -> Dict[str, Any]:
+        """生成全书主线、主要角色和各卷标题概要；失败时使用通用分卷"""
+        material_info = self._format_materials(materials)
+        ranges_text = "\n".join(
+            f"第{index}卷：第{start}-{end}章" for index, (start, end) in enumerate(volume_ranges, 1)
+        )
+        prompt = f"""
+请为长篇小说《{title}》设计全书主线和分卷结构，全书共{chapter_count}章，分为{len(volume_ranges)}卷：
+{ranges_text}
+
+创作材料参考：
+{material_info}
+
+要求：
+1. 全书主线完整，各卷之间层层递进，每卷有独立的阶段性冲突和高潮
+2. 每卷概要说明本卷的主要情节、冲突和结尾走向
+
+请按以下JSON格式返回（volumes按卷顺序，共{len(volume_ranges)}项）：
+{{
+    "title": "小说标题",
+    "summary": "全书故事简介",
+    "main_characters": [
+        {{"name": "角色名", "description": "角色描述"}}
+    ],
+    "volumes": [
+        {{"number": 1, "title": "卷标题", "summary": "本卷情节概要"}}
+    ]
+}}
+"""
+        data: Dict[str, Any] = {}
+        async with model_policy.use(TASK_OUTLINE) as decision:
+            try:
+                response = await self.client.chat_completion(
+                    messages=[
+                        {"role": "system", "content": "你是一个专业的长篇小说策划。请严格按照JSON格式返回结果。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.8,
+                    max_tokens=min(4000, 200 * len(volume_ranges) + 800),
+                    model=decision.model,
+                    response_format=self.client.json_response_format(decision.model)
+                )
+                message = response['choices'][0]['message']
+                content = message.get('content') or message.get('reasoning_content') or ''
+                parsed = json.loads(self._extract_json(content))
+                data = parsed if isinstance(parsed, dict) else {}
+            except Exception as e:
+                print(f"⚠️ 全书分卷生成失败，使用通用分卷: {e}")
+            decision.success = bool(data.get("volumes"))
+        
+        fallback = self._create_fallback_outline(title, chapter_count)
+        volumes_by_number = {
+            volume.get("number"): volume for volume in data.get("volumes", [])
+            if isinstance(volume, dict)
+        }
+        volumes = []
+        for index, (start, end) in enumerate(volume_ranges, 1):
+            volume = volumes_by_number.get(index, {})
+            volumes.append({
+                "number": index,
+                "title": volume.get("title") or f"第{index}卷",
+                "summary": volume.get("summary") or f"第{start}-{end}章的故事发展",
+                "chapter_start": start,
+                "chapter_end": end
+            })
+        return {
+            "title": data.get("title") or title,
+            "summary": data.get("summary") or fallback["summary"],
+            "main_characters": data.get("main_characters") or fallback["main_characters"],
+            "volumes": volumes
+        }
+    
+    async def _generate_volume_chapters(self,
+                                        arc: Dict[str, Any],
+                                        volume: Dict[str, Any],
+                                        chapter_count: int,
+                                        emitted_numbers: Set[int],
+                                        on_chapter: Optional[Callable[[Dict[str, Any]], Awaitable[None]]]) -> Dict[int, Dict[str, Any]]:
+        """流式生成一卷的章节列表，返回{章节号: 章节}；截断或不合格的章节单独补写"""
+        start, end = volume["chapter_start"], volume["chapter_end"]
+        volumes_text = "\n".join(
+            f"第{item['number']}卷《{item['title']}》（第{item['chapter_start']}-{item['chapter_end']}章）：{item['summary']}"
+            for item in arc["volumes"]
+        )
+        characters = "、".join(
+            character.get("name", "") for character in arc["main_characters"] if isinstance(character, dict)
+        )
+        prompt = f"""
+小说《{arc['title']}》全书简介：{arc['summary']}
+主要角色：{characters}
+
+分卷结构：
+{volumes_text}
+
+请为第{volume['number']}卷《{volume['title']}》写出第{start}章到第{end}章的章节大纲，共{end - start + 1}章，
+章节之间情节连贯，并与前后卷衔接。
+
+请按以下JSON格式返回：
+{{
+    "chapters": [
+        {{
+            "number": 章节序号,
+            "title": "章节标题",
+            "summary": "章节内容摘要，包含主要情节和冲突",
+            "key_events": ["关键事件1", "关键事件2"],
+            "characters_involved": ["涉及角色"]
+        }}
+    ]
+}}
+"""
+        chapters_by_number: Dict[int, Dict[str, Any]] = {}
+        
+        async def keep(chapter: Dict[str, Any]) -> None:
+            number = chapter.get("number")
+            if not isinstance(number, int) or not start <= number <= end:
+                return
+            await self._emit_chapter(chapter, chapter_count, emitted_numbers, on_chapter)
+            if number in emitted_numbers and number not in chapters_by_number:
+                chapters_by_number[number] = chapter
+        
+        parser = IncrementalOutlineParser()
+        reasoning_parts = []
+        async with model_policy.use(TASK_OUTLINE) as decision:
+            try:
+                async with aclosing(self.client.stream_chat_completion(
+                    messages=[
+                        {"role": "system", "content": "你是一个专业的小说大纲创作助手。请严格按照JSON格式返回结果。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.8,
+                    max_tokens=min(8000, 300 * (end - start + 1) + 400),
+                    model=decision.model,
+                    response_format=self.client.json_response_format(decision.model)
+                )) as stream:
+                    async for chunk in stream:
+                        if chunk["reasoning_content"]:
+                            reasoning_parts.append(chunk["reasoning_content"])
+                        for chapter in parser.feed(chunk["content"]):
+                            await keep(chapter)
+            except Exception as e:
+                print(f"⚠️ 第{volume['number']}卷章节流式输出中断: {e}")
+            
+            # DeepSeek-reasoner模型在content为空时使用reasoning_content
+            if not parser.buffer.strip() and reasoning_parts:
+                for chapter in parser.feed("".join(reasoning_parts)):
+                    await keep(chapter)
+            decision.success = len(chapters_by_number) == end - start + 1
+        
+        context = {"title": arc["title"], "summary": f"{arc['summary']}\n本卷《{volume['title']}》：{volume['summary']}"}
+        for _ in range(settings.outline_repair_max_rounds):
+            missing_numbers = [n for n in range(start, end + 1) if n not in chapters_by_number]
+            if not missing_numbers:
+                break
+            print(f"🩹 第{volume['number']}卷补写章节: {missing_numbers}")
+            generation_metrics.incr("outline.repair_calls")
+            try:
+                repaired = await self._request_missing_chapters(context, chapters_by_number, missing_numbers)
+            except Exception as e:
+                print(f"⚠️ 补写章节请求失败: {e}")
+                continue
+            for chapter in repaired:
+                await keep(chapter)
+        
+        return chapters_by_number
+    
+    async def _emit_chapter(self,
+                            chapter: Dict[str, Any],
+                            chapter_count: int,
+                            emitted_numbers: Set[int],
+                            on_chapter: Optional[Callable[[Dict[str, Any]], Awaitable[None]]]) -> None:
+        """校验流式解析出的章节，合格且未重复时回调"""
+        if not all(field in chapter for field in ("number", "title", "summary")):
+            return
+        number = chapter["number"]
+        if not isinstance(number, int) or not 1 <= number <= chapter_count or number in emitted_numbers:
+            return
+        
+        emitted_numbers.add(number)
+        if on_chapter:
+            try:
+                await on_chapter(chapter)
+            except Exception as e:
+                print(f"⚠️ 章节{number}回调处理失败: {e}")
+    
+    async def _repair_outline(self,
+                              title: str,
+                              chapter_count: int,
+                              parser: IncrementalOutlineParser,
+                              emitted_numbers: Set[int],
+                              on_chapter: Optional[Callable[[Dict[str, Any]], Awaitable[None]]]) -> Dict[str, Any]:
+        """保留有效章节，只为缺失或不合格的章节发起小请求补写，仍缺失的使用占位内容"""
+        fallback = self._create_fallback_outline(title, chapter_count)
+        
+        chapters_by_number = {
+            chapter["number"]: chapter for chapter in parser.chapters
+            if chapter.get("number") in emitted_numbers
+        }
+        outline_data = {
+            "title": parser.fields.get("title") or fallback["title"],
+            "summary": parser.fields.get("summary") or fallback["summary"],
+            "main_characters": parser.fields.get("main_characters") or fallback["main_characters"],
+        }
+        kept_count = len(chapters_by_number)
+        
+        for round_index in range(settings.outline_repair_max_rounds):
+            missing_numbers = [n for n in range(1, chapter_count + 1) if n not in chapters_by_number]
+            if not missing_numbers:
+                break
+            
+            print(f"🩹 第 {round_index + 1} 轮补写章节: {missing_numbers}")
+            generation_metrics.incr("outline.repair_calls")
+            try:
+                repaired = await self._request_missing_chapters(outline_data, chapters_by_number, missing_numbers)
+            except Exception as e:
+                print(f"⚠️ 补写章节请求失败: {e}")
+                continue
+            
+            for chapter in repaired:
+                await self._emit_chapter(chapter, chapter_count, emitted_numbers, on_chapter)
+                if chapter.get("number") in emitted_numbers and chapter["number"] not in chapters_by_number:
+                    chapters_by_number[chapter["number"]] = chapter
+        
+        repaired_count = len(chapters_by_number) - kept_count
+        placeholder_count = chapter_count - len(chapters_by_number)
+        generation_metrics.incr("outline.kept_chapters", kept_count)
+        generation_metrics.incr("outline.repaired_chapters", repaired_count)
+        generation_metrics.incr("outline.placeholder_chapters", placeholder_count)
+        if placeholder_count == 0:
+            # 修复成功，省下了一次完整的大纲重新生成
+            generation_metrics.incr("outline.full_calls_saved")
+        print(f"✅ 大纲修复完成：保留 {kept_count} 章，补写 {repaired_count} 章，占位 {placeholder_count} 章")
+        
+        outline_data["chapters"] = [
+            chapters_by_number.get(placeholder["number"], placeholder)
+            for placeholder in fallback["chapters"]
+        ]
+        return outline_data
+    
+    async def _request_missing_chapters(self,
+                                        outline_data: Dict[str, Any],
+                                        chapters_by_number: Dict[int, Dict[str, Any]],
+                                        missing_numbers: List[int]) -> List[Dict[str, Any]]:
+        """发送紧凑的补写请求，只包含已有章节的标题和简短摘要"""
+        existing = "\n".join(
+            f"第{number}章 {chapter['title']}：{str(chapter['summary'])[:60]}"
+            for number, chapter in sorted(chapters_by_number.items())
+        ) or "（暂无）"
+        missing_text = "、".join(str(number) for number in missing_numbers)
+        
+        prompt = f"""
+小说《{outline_data['title']}》的大纲中，第{missing_text}章缺失或格式不完整，请只补写这些章节。
+
+故事简介：{outline_data['summary']}
+
+已有章节：
+{existing}
+
+要求补写的章节与前后章节情节衔接，请按以下JSON格式返回：
+{{
+    "chapters": [
+        {{
+            "number": 章节序号,
+            "title": "章节标题",
+            "summary": "章节内容摘要，包含主要情节和冲突",
+            "key_events": ["关键事件1", "关键事件2"],
+            "characters_involved": ["涉及角色"]
+        }}
+    ]
+}}
+"""
+        return await self._request_chapter_list(prompt, len(missing_numbers), TASK_REPAIR, temperature=0.7)
+    
+    async def replan_chapters(self,
+                              outline_data: Dict[str, Any],
+                              edited_number: int,
+                              fixed_numbers: List[int],
+                              replan_numbers: List[int]) -> List[Dict[str, Any]]:
+        """某章大纲被修改后，只重新规划指定的后续章节
+        
+        按REPLAN_BATCH_SIZE分批依次请求，每批的输出上限都能容纳该批全部章节；
+        提示中只包含该批之前的章节（固定章节和前几批已重新规划的章节）、夹在该批中间的固定章节和该批之后最近的一个固定章节。
+        某一批失败时停止后续批次，返回已重新规划的章节（一章都没有时抛出异常）
+        """
+        chapters_by_number = {chapter["number"]: chapter for chapter in outline_data.get("chapters", [])}
+        fixed = set(fixed_numbers)
+        replanned: Dict[int, Dict[str, Any]] = {}
+        
+        for index in range(0, len(replan_numbers), REPLAN_BATCH_SIZE):
+            batch = replan_numbers[index:index + REPLAN_BATCH_SIZE]
+            context = {number: chapters_by_number[number] for number in fixed if number in chapters_by_number}
+            context.update(replanned)
+            before = [number for number in sorted(context) if number < batch[0] and number != edited_number]
+            # 夹在本批章节之间的固定章节，以及本批之后最近的一个固定章节
+            inside = [number for number in sorted(fixed) if batch[0] < number < batch[-1] and number in chapters_by_number]
+            after = inside + [number for number in sorted(fixed) if number > batch[-1] and number in chapters_by_number][:1]
+            try:
+                chapters = await self._replan_batch(
+                    outline_data, chapters_by_number[edited_number],
+                    [context[number] for number in before],
+                    [chapters_by_number[number] for number in after],
+                    batch
+                )
+            except Exception as e:
+                if not replanned:
+                    raise
+                print(f"⚠️ 重新规划第{batch[0]}-{batch[-1]}章失败，保留原大纲: {e}")
+                break
+            replanned.update(chapters)
+        
+        generation_metrics.incr("outline.replanned_chapters", len(replanned))
+        return [replanned[number] for number in sorted(replanned)]
+    
+    async def _replan_batch(self,
+                            outline_data: Dict[str, Any],
+                            edited: Dict[str, Any],
+                            before: List[Dict[str, Any]],
+                            after: List[Dict[str, Any]],
+                            batch: List[int]) -> Dict[int, Dict[str, Any]]:
+        """重新规划一批章节，返回{章节号: 章节}（只保留请求的、标题和摘要齐全的章节）"""
+        def brief(chapters: List[Dict[str, Any]]) -> str:
+            return "\n".join(
+                f"第{chapter['number']}章 {chapter['title']}：{str(chapter['summary'])[:60]}" for chapter in chapters
+            ) or "（暂无）"
+        
+        batch_text = "、".join(str(number) for number in batch)
+        following = f"\n\n其后不可改动的章节：\n{brief(after)}" if after else ""
+        prompt = f"""
+小说《{outline_data.get('title', '')}》的第{edited['number']}章大纲已被作者修改，请据此重新规划第{batch_text}章，使后续情节与修改后的内容衔接。
+
+故事简介：{outline_data.get('summary', '')}
+
+修改后的第{edited['number']}章：{edited['title']}
+{edited['summary']}
+关键事件：{', '.join(edited.get('key_events', []))}
+
+之前的章节：
+{brief(before)}{following}
+
+请按以下JSON格式返回（只包含第{batch_text}章）：
+{{
+    "chapters": [
+        {{
+            "number": 章节序号,
+            "title": "章节标题",
+            "summary": "章节内容摘要，包含主要情节和冲突",
+            "key_events": ["关键事件1", "关键事件2"],
+            "characters_involved": ["涉及角色"]
+        }}
+    ]
+}}
+"""
+        chapters = await self._request_chapter_list(prompt, len(batch), TASK_OUTLINE, temperature=0.8)
+        wanted = set(batch)
+        replanned = {}
+        for chapter in chapters:
+            number = chapter.get("number")
+            if number in wanted and chapter.get("title") and chapter.get("summary"):
+                replanned.setdefault(number, chapter)
+        return replanned
+    
+    async def _request_chapter_list(self,
+                                    prompt: str,
+                                    chapter_total: int,
+                                    task: str,
+                                    temperature: float) -> List[Dict[str, Any]]:
+        """发送返回{"chapters": [...]}的小请求，输出上限按章节数计算"""
+        async with model_policy.use(task) as decision:
+            response = await self.client.chat_completion(
+                messages=[
+                    {"role": "system", "content": "你是一个专业的小说大纲创作助手。请严格按照JSON格式返回结果。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperature,
+                max_tokens=min(CHAPTER_LIST_MAX_TOKENS,
+                               CHAPTER_LIST_TOKENS_PER_CHAPTER * chapter_total + CHAPTER_LIST_BASE_TOKENS),
+                model=decision.model,
+                response_format=self.client.json_response_format(decision.model)
+            )
+            
+            message = response['choices'][0]['message']
+            content = message.get('content') or message.get('reasoning_content') or ''
+            data = json.loads(self._extract_json(content))
+            chapters = data.get("chapters", []) if isinstance(data, dict) else data
+            chapters = [chapter for chapter in chapters if isinstance(chapter, dict)]
+            decision.success = bool(chapters)
+            return chapters
+    
+    def has_placeholders(self, outline_data: Dict[str, Any]) -> bool:
+        """判断大纲中是否含有备用占位章节"""
+        return any(
+            chapter.get("summary") == f"第{chapter.get('number')}章的内容概要"
+            for chapter in outline_data.get("chapters", [])
+        )
+    
+    async def personalize_outline(self, outline_data: Dict[str, Any], title: str) -> Dict[str, Any]:
+        """用一次小请求为模板大纲改写整体简介（书名使用新书标题），章节内容保持不变"""
+        prompt = f"""
+以下是一部小说的大纲简介，请为新书《{title}》改写故事简介，保持情节走向不变，但换用新的表述和细节。
+
+原简介：{outline_data.get('summary', '')}
+主要角色：{', '.join(c.get('name', '') for c in outline_data.get('main_characters', []) if isinstance(c, dict))}
+
+请按以下JSON格式返回：
+{{"summary": "新的故事简介"}}
+"""
+        try:
+            # 只改写简介的小请求，与补写章节同属轻量JSON任务
+            model = model_policy.select(TASK_REPAIR).model
+            response = await self.client.chat_completion(
+                messages=[
+                    {"role": "system", "content": "你是一个专业的小说编辑。请严格按照JSON格式返回结果。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.9,
+                max_tokens=600,
+                model=model,
+                response_format=self.client.json_response_format(model)
+            )
+            message = response['choices'][0]['message']
+            content = message.get('content') or message.get('reasoning_content') or ''
+            data = json.loads(self._extract_json(content))
+            if data.get("summary"):
+                outline_data["summary"] = data["summary"]
+        except Exception as e:
+            print(f"⚠️ 模板个性化失败，沿用原简介: {e}")
+        return outline_data
+    
     def _extract_json(self, text: str) -> str:
         """从文本中提取JSON部分"""
         # 尝试找到JSON代码块
@@ -46,6 +46,19 @@ class DialogueParser:
         
         return segments
     
+    @staticmethod
+    def _make_segment(speaker_type: SpeakerType, speaker_name: Optional[str],
+                      content: str, sequence: int) -> DialogueSegment:
+        """构建对话片段（字段由解析器生成，跳过pydantic校验以降低解析开销）"""
+        return DialogueSegment.model_construct(
+            speaker_type=speaker_type,
+            speaker_name=speaker_name,
+            content=content,
+            sequence=sequence,
+            is_read=False,
+            required_chars_used=[]
+        )
+    
     def _split_paragraphs(self, content: str) -> List[str]:
         """分割段落"""
         # 按换行符分割，保留章节结构
@@ -84,7 +97,7 @@ class DialogueParser:
         
         # 检查是否是章节标题
         if re.match(r'^[第]\w+[章节][：:]', paragraph):
-            segments.append(DialogueSegment(
+            segments.append(self._make_segment(
                 speaker_type=SpeakerType.NARRATOR,
                 speaker_name="旁白",
                 content=paragraph,
@@ -97,7 +110,7 @@ class DialogueParser:
         
         if not dialogue_matches:
             # 没有对话，整段作为旁白
-            segments.append(DialogueSegment(
+            segments.append(self._make_segment(
                 speaker_type=SpeakerType.NARRATOR,
                 speaker_name="旁白",
                 content=paragraph,
@@ -116,7 +129,7 @@ class DialogueParser:
             if start > last_end:
                 narrator_text = paragraph[last_end:start].strip()
                 if narrator_text:
-                    segments.append(DialogueSegment(
+                    segments.append(self._make_segment(
                         speaker_type=SpeakerType.NARRATOR,
                         speaker_name="旁白",
                         content=narrator_text,
@@ -127,7 +140,7 @@ class DialogueParser:
             # 识别说话者
             speaker_info = self._identify_speaker(paragraph, start, end, dialogue_content)
             
-            segments.append(DialogueSegment(
+            segments.append(self._make_segment(
                 speaker_type=speaker_info["type"],
                 speaker_name=speaker_info["name"],
                 content=dialogue_content,
@@ -140,7 +153,7 @@ class DialogueParser:
         if last_end < len(paragraph):
             narrator_text = paragraph[last_end:].strip()
             if narrator_text:
-                segments.append(DialogueSegment(
+                segments.append(self._make_segment(
                     speaker_type=SpeakerType.NARRATOR,
                     speaker_name="旁白",
                     content=narrator_text,
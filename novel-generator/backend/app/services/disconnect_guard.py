@@ -0,0 +1,81 @@
+"""
+客户端断开处理
+交互式生成请求在等待模型输出期间检测客户端是否断开，并按配置的策略取消上游请求或在后台完成并保存
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Request
+
+from ..config import settings
+from .generation_metrics import generation_metrics
+from .llm_usage import track_llm_usage, LLMUsage
+
+POLICY_CANCEL = "cancel"  # 取消生成任务（关闭上游连接）
+POLICY_BACKGROUND = "background"  # 在后台继续生成并保存结果
+
+CLIENT_CLOSED_REQUEST = 499
+
+
+async def _wait_for_disconnect(request: Request, poll_seconds: float) -> None:
+    """轮询直到客户端断开"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(poll_seconds)
+
+
+def _record_background_result(label: str, usage: LLMUsage, task: asyncio.Task) -> None:
+    """后台完成的任务：记录结果和用量"""
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        print(f"❌ 客户端断开后后台生成失败 [{label}]: {error}")
+        generation_metrics.incr(f"client_disconnect.{label}.background_failed")
+    else:
+        print(f"✅ 客户端断开后后台生成完成并已保存 [{label}]")
+        generation_metrics.incr(f"client_disconnect.{label}.background_completed")
+    generation_metrics.incr("client_disconnect.background_tokens", usage.completion_tokens)
+
+
+async def run_until_disconnected(request: Optional[Request],
+                                 factory: Callable[[], Awaitable[Any]],
+                                 label: str,
+                                 policy: Optional[str] = None) -> Any:
+    """执行交互式生成，客户端断开时按策略处理
+
+    - cancel：取消生成任务，已产生的token计入client_disconnect.abandoned_tokens
+    - background：生成任务继续运行并由原流程保存结果
+    没有Request对象（如内部调用）时直接执行
+    """
+    if request is None:
+        return await factory()
+
+    policy = policy or settings.client_disconnect_policy
+    with track_llm_usage() as usage:
+        # 任务创建时复制上下文，生成过程中的模型用量都会累加到usage
+        work = asyncio.create_task(factory())
+    watcher = asyncio.create_task(_wait_for_disconnect(request, settings.client_disconnect_poll_seconds))
+
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if work.done():
+        return work.result()
+
+    generation_metrics.incr(f"client_disconnect.{label}.{policy}")
+    if policy == POLICY_BACKGROUND:
+        print(f"🔌 客户端已断开，生成继续在后台进行 [{label}]")
+        work.add_done_callback(lambda task: _record_background_result(label, usage, task))
+    else:
+        print(f"🔌 客户端已断开，取消生成 [{label}]")
+        work.cancel()
+        await asyncio.gather(work, return_exceptions=True)
+        generation_metrics.incr("client_disconnect.abandoned_tokens", usage.completion_tokens)
+        generation_metrics.incr("client_disconnect.abandoned_calls", usage.calls)
+    raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="客户端已断开连接")
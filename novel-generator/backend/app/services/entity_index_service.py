@@ -0,0 +1,108 @@
+"""
+小说角色索引
+章节完成时从“角色名：”台词行和大纲主要角色中统计出场情况（首次/最近出场章节、台词行数、简介和最近台词），
+生成章节时只把本章characters_involved中的角色资料放入提示，保持角色连贯又不必发送全部角色
+"""
+
+from typing import Any, Dict, List
+
+from ..models.chapter_novel import ChapterNovel
+from ..models.novel_entity import NovelEntity
+from .content_normalizer import MARKER_PATTERN, NARRATION_ALIASES, PROTAGONIST_MARKER, SPEECH_VERB_SUFFIXES
+from .generation_metrics import generation_metrics
+
+NOTE_CHARS = 60  # 简介和台词的截取长度
+
+
+def _main_characters(novel: ChapterNovel) -> Dict[str, str]:
+    """大纲主要角色：{角色名: 简介}"""
+    return {
+        character["name"]: str(character.get("description", ""))[:NOTE_CHARS]
+        for character in (novel.outline or {}).get("main_characters", [])
+        if isinstance(character, dict) and character.get("name")
+    }
+
+
+class EntityIndexService:
+    """角色索引的更新和查询"""
+
+    def extract_appearances(self, content: str, known_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """统计章节中的角色出场：台词行的说话者，以及正文中提到的已知角色"""
+        appearances: Dict[str, Dict[str, Any]] = {}
+        for line in content.split("\n"):
+            match = MARKER_PATTERN.match(line.strip())
+            if not match:
+                continue
+            speaker, text = match.group(1), match.group(2).strip()
+            if (speaker in NARRATION_ALIASES or speaker == PROTAGONIST_MARKER or not text
+                    or speaker.endswith(SPEECH_VERB_SUFFIXES)):
+                continue
+            appearance = appearances.setdefault(speaker, {"lines": 0})
+            appearance["lines"] += 1
+            appearance["recent_line"] = text[:NOTE_CHARS]
+
+        for name in known_names:
+            if name not in appearances and name in content:
+                appearances[name] = {"lines": 0}
+        return appearances
+
+    async def update_from_chapter(self, novel: ChapterNovel, chapter_number: int, content: str) -> int:
+        """章节完成后更新角色索引，返回本章出场的角色数"""
+        main_characters = _main_characters(novel)
+        known = await NovelEntity.get_pymongo_collection().distinct("name", {"novel_id": str(novel.id)})
+        appearances = self.extract_appearances(content, list(set(known) | set(main_characters)))
+        for name, appearance in appearances.items():
+            if main_characters.get(name):
+                appearance["description"] = main_characters[name]
+
+        await NovelEntity.record_chapter(str(novel.id), chapter_number, appearances)
+        generation_metrics.incr("entity_index.updates")
+        return len(appearances)
+
+    async def context_for_chapter(self, novel: ChapterNovel, chapter_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """本章涉及角色的资料；索引中还没有的角色使用大纲中的简介"""
+        names = [name for name in chapter_info.get("characters_involved", []) if isinstance(name, str) and name]
+        if not names:
+            return []
+
+        entities = await NovelEntity.find(
+            NovelEntity.novel_id == str(novel.id), {"name": {"$in": names}}
+        ).to_list()
+        by_name = {entity.name: entity.to_dict() for entity in entities}
+        main_characters = _main_characters(novel)
+
+        characters = []
+        for name in dict.fromkeys(names):
+            if name in by_name:
+                characters.append(by_name[name])
+            elif name in main_characters:
+                characters.append({"name": name, "description": main_characters[name]})
+        generation_metrics.observe("entity_index.context_characters", len(characters))
+        return characters
+
+    async def get_index(self, novel_id: str) -> List[Dict[str, Any]]:
+        """小说的全部角色索引，按首次出场排序"""
+        entities = await NovelEntity.find(NovelEntity.novel_id == novel_id).sort(NovelEntity.first_chapter).to_list()
+        return [entity.to_dict() for entity in entities]
+
+    async def delete_novel(self, novel_id: str) -> None:
+        await NovelEntity.find(NovelEntity.novel_id == novel_id).delete()
+
+
+def format_character_context(characters: List[Dict[str, Any]]) -> str:
+    """把角色资料格式化为提示中的一段"""
+    lines = []
+    for character in characters:
+        parts = [character["name"]]
+        if character.get("description"):
+            parts.append(character["description"])
+        if character.get("first_chapter"):
+            parts.append(f"第{character['first_chapter']}章首次出场，最近出场于第{character['last_chapter']}章")
+        if character.get("recent_line"):
+            parts.append(f"最近台词：{character['recent_line']}")
+        lines.append("- " + "；".join(parts))
+    return "相关角色：\n" + "\n".join(lines) if lines else ""
+
+
+# 创建全局实例
+entity_index_service = EntityIndexService()
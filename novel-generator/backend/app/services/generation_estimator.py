@@ -0,0 +1,212 @@
+"""
+生成耗时和费用估算
+按模型的历史输出速度（tokens/秒）、首个token延迟、字符/token比例和当前调度队列深度，
+估算大纲、单章和剩余章节生成的token数、费用和耗时。每项都给出低/预期/高三个值：
+预期取历史中位数，低/高取历史第10/90百分位（约80%区间），历史样本不足时用配置的默认值并放宽到±50%
+"""
+
+import math
+from typing import Any, Dict, List, Optional
+
+from ..config import settings
+from .generation_metrics import generation_metrics
+from .llm_scheduler import llm_scheduler, PRIORITY_ORDER, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from .model_policy import model_policy, TASK_OUTLINE, TASK_CHAPTER
+from .token_calibrator import token_calibrator
+
+INTERVAL = "p10-p90"
+DEFAULT_SPREAD = 0.5  # 没有历史数据时区间的相对宽度
+
+OUTLINE_PROMPT_TOKENS = 1500  # 大纲类请求的提示长度
+OUTLINE_BASE_TOKENS = 400  # 大纲中章节之外的部分（简介、角色）
+OUTLINE_CHAPTER_TOKENS = (150, 220, 300)  # 每章大纲的输出长度（低、预期、高）
+ARC_VOLUME_TOKENS = 200  # 分卷大纲中每卷概要的输出长度
+CHAPTER_PROMPT_TOKENS = 1200  # 章节请求的提示长度（材料指导、前文概要、角色资料）
+CHAPTER_LENGTH_LOW_RATIO = 0.8  # 章节实际字数相对目标字数的下限
+TYPICAL_CHAPTER_LENGTH = 2000  # 估算排队时间时，假定排在前面的调用都是这个字数的章节
+
+
+def _quantiles(samples: List[float]) -> Optional[Dict[str, float]]:
+    if len(samples) < settings.estimator_min_samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        name: ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+        for name, q in (("p10", 0.1), ("p50", 0.5), ("p90", 0.9))
+    }
+
+
+def _band(low: float, expected: float, high: float, digits: Optional[int] = 1) -> Dict[str, float]:
+    return {"low": round(low, digits), "expected": round(expected, digits), "high": round(high, digits)}
+
+
+class _ModelProfile:
+    """一个模型的速度、延迟和字符/token比例（低、预期、高三种情形）"""
+
+    def __init__(self, model: str):
+        self.model = model
+        speed = _quantiles(generation_metrics.get_samples(f"llm.tokens_per_second.{model}"))
+        latency = _quantiles(generation_metrics.get_samples(f"llm.first_token_seconds.{model}"))
+        self.samples = len(generation_metrics.get_samples(f"llm.tokens_per_second.{model}"))
+        self.source = "history" if speed else "default"
+
+        if speed:
+            # 耗时低的情形对应速度快（p90），耗时高的情形对应速度慢（p10）
+            self.tokens_per_second = (speed["p90"], speed["p50"], speed["p10"])
+        else:
+            rate = settings.estimator_default_tokens_per_second
+            self.tokens_per_second = (rate * (1 + DEFAULT_SPREAD), rate, rate * (1 - DEFAULT_SPREAD))
+        if latency:
+            self.first_token_seconds = (latency["p10"], latency["p50"], latency["p90"])
+        else:
+            delay = settings.estimator_default_first_token_seconds
+            self.first_token_seconds = (delay * (1 - DEFAULT_SPREAD), delay, delay * (1 + DEFAULT_SPREAD))
+
+        self.chars_per_token = token_calibrator.chars_per_token(model)
+        self.price_input, self.price_output = _model_price(model)
+
+    def call_seconds(self, completion_tokens: tuple) -> tuple:
+        """一次调用的耗时（低、预期、高）"""
+        return tuple(
+            delay + tokens / rate
+            for tokens, rate, delay in zip(completion_tokens, self.tokens_per_second, self.first_token_seconds)
+        )
+
+    def cost(self, prompt_tokens: int, completion_tokens: tuple) -> Dict[str, Any]:
+        low, expected, high = (
+            (prompt_tokens * self.price_input + tokens * self.price_output) / 1_000_000
+            for tokens in completion_tokens
+        )
+        return {"currency": "CNY", **_band(low, expected, high, digits=4)}
+
+    def basis(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "interval": INTERVAL,
+            "throughput_samples": self.samples,
+            "tokens_per_second": _band(*reversed(self.tokens_per_second), digits=2),
+            "first_token_seconds": _band(*self.first_token_seconds, digits=2),
+            "chars_per_token": round(self.chars_per_token, 3)
+        }
+
+
+def _model_price(model: str) -> tuple:
+    """模型的(输入单价, 输出单价)，元/百万tokens；未配置的模型按0计"""
+    for item in settings.estimator_model_prices.split(","):
+        parts = [part.strip() for part in item.split(":")]
+        if len(parts) == 3 and parts[0] == model:
+            try:
+                return float(parts[1]), float(parts[2])
+            except ValueError:
+                break
+    return 0.0, 0.0
+
+
+class GenerationEstimator:
+    """大纲、单章和剩余章节生成的耗时和费用估算"""
+
+    def queue_wait(self, priority: str) -> tuple:
+        """按当前调度队列深度估算开始前的排队时间（低、预期、高）
+
+        排在前面的是同类别及更高优先级的等待者；槽位有空闲时不需要排队，
+        否则每一轮（可用槽位数个等待者）约需一次普通章节调用的时间
+        """
+        stats = llm_scheduler.stats()
+        rank = PRIORITY_ORDER.index(priority)
+        ahead = sum(stats[name]["queued"] for name in PRIORITY_ORDER[:rank + 1])
+        active = sum(item["active"] for item in stats.values())
+        capacity = settings.llm_max_concurrency
+        if priority != PRIORITY_INTERACTIVE:
+            capacity -= settings.llm_interactive_reserved_slots
+        capacity = max(1, capacity)
+        if ahead == 0 and active < capacity:
+            return 0.0, 0.0, 0.0
+        profile = _ModelProfile(model_policy.current_model(TASK_CHAPTER))
+        call_seconds = profile.call_seconds(self._chapter_tokens(profile, TYPICAL_CHAPTER_LENGTH))
+        rounds = (ahead + 1) / capacity
+        return tuple(rounds * seconds for seconds in call_seconds)
+
+    def estimate_outline(self, chapter_count: int) -> Dict[str, Any]:
+        """生成大纲：章节数超过分卷阈值时先生成分卷概要，再按并发数分批生成各卷章节"""
+        profile = _ModelProfile(model_policy.current_model(TASK_OUTLINE))
+        chapter_tokens = tuple(tokens * chapter_count + OUTLINE_BASE_TOKENS for tokens in OUTLINE_CHAPTER_TOKENS)
+
+        if chapter_count > settings.outline_hierarchical_threshold:
+            volume_count = math.ceil(chapter_count / max(1, settings.outline_volume_size))
+            arc_tokens = (ARC_VOLUME_TOKENS * volume_count + OUTLINE_BASE_TOKENS,) * 3
+            volume_tokens = tuple(tokens * math.ceil(chapter_count / volume_count) for tokens in OUTLINE_CHAPTER_TOKENS)
+            waves = math.ceil(volume_count / max(1, settings.outline_volume_concurrency))
+            seconds = tuple(
+                arc + waves * volume
+                for arc, volume in zip(profile.call_seconds(arc_tokens), profile.call_seconds(volume_tokens))
+            )
+            calls = volume_count + 1
+            completion = tuple(arc + chapters for arc, chapters in zip(arc_tokens, chapter_tokens))
+        else:
+            seconds = profile.call_seconds(chapter_tokens)
+            calls = 1
+            completion = chapter_tokens
+
+        return self._result(TASK_OUTLINE, profile, calls, completion, seconds,
+                            self.queue_wait(PRIORITY_INTERACTIVE), chapter_count=chapter_count)
+
+    def estimate_chapter(self, target_length: int) -> Dict[str, Any]:
+        """生成单章（交互优先级）"""
+        profile = _ModelProfile(model_policy.current_model(TASK_CHAPTER))
+        completion = self._chapter_tokens(profile, target_length)
+        seconds = profile.call_seconds(completion)
+        return self._result(TASK_CHAPTER, profile, 1, completion, seconds,
+                            self.queue_wait(PRIORITY_INTERACTIVE), target_length=target_length)
+
+    def estimate_chapters(self, chapter_count: int, target_length: int,
+                          concurrency: Optional[int] = None) -> Dict[str, Any]:
+        """批量生成chapter_count章（批量优先级，按并发数分批）"""
+        profile = _ModelProfile(model_policy.current_model(TASK_CHAPTER))
+        per_chapter = self._chapter_tokens(profile, target_length)
+        per_call = profile.call_seconds(per_chapter)
+
+        concurrency = max(1, min(concurrency or settings.chapter_run_concurrency,
+                                 settings.chapter_run_max_concurrency,
+                                 settings.llm_max_concurrency - settings.llm_interactive_reserved_slots))
+        waves = math.ceil(chapter_count / concurrency) if chapter_count else 0
+        completion = tuple(tokens * chapter_count for tokens in per_chapter)
+        seconds = tuple(waves * call for call in per_call)
+        return self._result("remaining_chapters", profile, chapter_count, completion, seconds,
+                            self.queue_wait(PRIORITY_BATCH),
+                            chapter_count=chapter_count, target_length=target_length, concurrency=concurrency)
+
+    def _chapter_tokens(self, profile: _ModelProfile, target_length: int) -> tuple:
+        """单章输出token数：字数在目标的0.8倍到流式校验上限之间"""
+        cpt = profile.chars_per_token
+        return (target_length * CHAPTER_LENGTH_LOW_RATIO / cpt,
+                target_length / cpt,
+                target_length * max(settings.stream_guard_length_ratio, 1.0) / cpt)
+
+    def _result(self,
+                task: str,
+                profile: _ModelProfile,
+                calls: int,
+                completion: tuple,
+                seconds: tuple,
+                queue_wait: tuple,
+                **params: Any) -> Dict[str, Any]:
+        prompt_tokens = calls * (OUTLINE_PROMPT_TOKENS if task == TASK_OUTLINE else CHAPTER_PROMPT_TOKENS)
+        wall = tuple(run + wait for run, wait in zip(seconds, queue_wait))
+        return {
+            "task": task,
+            "model": profile.model,
+            "params": params,
+            "calls": calls,
+            "tokens": {
+                "prompt": prompt_tokens,
+                "completion": _band(*completion, digits=None)
+            },
+            "cost": profile.cost(prompt_tokens, completion),
+            "wall_seconds": _band(*wall),
+            "queue_wait_seconds": _band(*queue_wait),
+            "basis": profile.basis()
+        }
+
+
+# 创建全局实例
+generation_estimator = GenerationEstimator()
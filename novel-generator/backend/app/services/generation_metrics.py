@@ -0,0 +1,69 @@
+"""
+生成过程指标服务
+在进程内统计计数器和观测值，供监控接口和估算逻辑使用
+"""
+
+from collections import defaultdict, deque
+from typing import Dict, Any, Deque
+import threading
+
+
+class GenerationMetrics:
+    """生成过程指标统计"""
+
+    def __init__(self, max_samples: int = 1000):
+        """初始化指标存储，观测值只保留最近max_samples条"""
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.max_samples))
+
+    def incr(self, name: str, value: float = 1) -> None:
+        """累加计数器"""
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        """记录一次观测值（耗时、长度等）"""
+        with self._lock:
+            self._samples[name].append(value)
+
+    def get_counter(self, name: str) -> float:
+        """获取计数器当前值"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def get_samples(self, name: str) -> list:
+        """获取观测值副本"""
+        with self._lock:
+            return list(self._samples.get(name, []))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出当前所有指标"""
+        with self._lock:
+            observations = {}
+            for name, samples in self._samples.items():
+                if not samples:
+                    continue
+                ordered = sorted(samples)
+                observations[name] = {
+                    "count": len(ordered),
+                    "avg": sum(ordered) / len(ordered),
+                    "p50": ordered[len(ordered) // 2],
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max": ordered[-1]
+                }
+            return {
+                "counters": dict(self._counters),
+                "observations": observations
+            }
+
+    def reset(self) -> None:
+        """清空所有指标"""
+        with self._lock:
+            self._counters.clear()
+            self._samples.clear()
+
+
+# 创建全局实例
+generation_metrics = GenerationMetrics()
@@ -0,0 +1,142 @@
+"""
+卡住的生成记录回收
+进程重启或崩溃会留下一直处于WRITING的章节和一直处于generating的v1小说，导致再次生成被拒绝。
+启动时和定期扫描这些记录：章节恢复为PLANNED重新排队（可由单章接口或“生成剩余章节”继续生成），
+v1小说标记为failed（可重新发起生成），每次回收的结果计入指标并保留最近的报告
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from ..config import settings
+from ..models.chapter_novel import ChapterInfo, ChapterStatus
+from ..models.novel import Novel
+from .generation_metrics import generation_metrics
+
+TRIGGER_STARTUP = "startup"
+TRIGGER_PERIODIC = "periodic"
+
+
+class GenerationReaper:
+    """回收过期的进行中记录
+
+    判断依据：章节的生成租约已过期（没有租约信息的旧记录按updated_at判断），
+    v1小说的updated_at超过novel_generation_lease_seconds；
+    单实例部署时（generation_reaper_single_instance），启动前更新的进行中记录都不可能再被持有，直接回收
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.started_at_utc = datetime.utcnow()
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def reap_once(self, trigger: str = TRIGGER_PERIODIC) -> Dict[str, Any]:
+        """执行一次回收并返回报告"""
+        takeover = trigger == TRIGGER_STARTUP and settings.generation_reaper_single_instance
+        chapters = await self._reap_chapters(takeover)
+        novels = await self._reap_novels(takeover)
+
+        report = {
+            "trigger": trigger,
+            "ran_at": datetime.now().isoformat(),
+            "chapters_requeued": chapters,
+            "novels_failed": novels
+        }
+        self.last_report = report
+        generation_metrics.incr("generation_reaper.runs")
+        generation_metrics.incr("generation_reaper.chapters_requeued", len(chapters))
+        generation_metrics.incr("generation_reaper.novels_failed", len(novels))
+        if chapters or novels:
+            print(f"🧹 回收卡住的生成记录（{trigger}）：章节 {len(chapters)} 个重新排队，v1小说 {len(novels)} 部标记失败")
+        return report
+
+    async def _reap_chapters(self, takeover: bool) -> List[Dict[str, Any]]:
+        """把过期的WRITING章节恢复为PLANNED（只改仍处于过期状态的记录，避免和新的租约竞争）"""
+        now = datetime.now()
+        if takeover:
+            stale = {"status": ChapterStatus.WRITING.value, "updated_at": {"$lt": self.started_at}}
+        else:
+            stale = {
+                "status": ChapterStatus.WRITING.value,
+                "$or": [
+                    {"lease_expires_at": {"$lt": now}},
+                    {"lease_expires_at": None,
+                     "updated_at": {"$lt": now - timedelta(seconds=settings.chapter_lease_seconds)}}
+                ]
+            }
+
+        collection = ChapterInfo.get_pymongo_collection()
+        candidates = await collection.find(
+            stale, projection={"novel_id": 1, "chapter_number": 1}
+        ).to_list(length=None)
+
+        reaped = []
+        for doc in candidates:
+            result = await collection.update_one(
+                {"_id": doc["_id"], **stale},
+                {"$set": {
+                    "status": ChapterStatus.PLANNED.value,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                    "updated_at": now
+                }}
+            )
+            if result.modified_count:
+                reaped.append({"novel_id": doc["novel_id"], "chapter_number": doc["chapter_number"]})
+        return reaped
+
+    async def _reap_novels(self, takeover: bool) -> List[str]:
+        """把过期的generating状态v1小说标记为failed"""
+        # v1小说的时间字段使用UTC
+        now = datetime.utcnow()
+        if takeover:
+            cutoff = self.started_at_utc
+        else:
+            cutoff = now - timedelta(seconds=settings.novel_generation_lease_seconds)
+        stale = {"status": "generating", "updated_at": {"$lt": cutoff}}
+
+        collection = Novel.get_pymongo_collection()
+        candidates = await collection.find(stale, projection={"_id": 1}).to_list(length=None)
+
+        reaped = []
+        for doc in candidates:
+            result = await collection.update_one(
+                {"_id": doc["_id"], **stale},
+                {"$set": {"status": "failed", "updated_at": now}}
+            )
+            if result.modified_count:
+                reaped.append(str(doc["_id"]))
+        return reaped
+
+    def start(self) -> None:
+        """启动时回收一次，之后按generation_reaper_interval_seconds定期回收"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        trigger = TRIGGER_STARTUP
+        while True:
+            try:
+                await self.reap_once(trigger)
+            except Exception as e:
+                print(f"⚠️ 回收卡住的生成记录失败: {e}")
+            trigger = TRIGGER_PERIODIC
+            await asyncio.sleep(settings.generation_reaper_interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "last_report": self.last_report
+        }
+
+
+# 创建全局实例
+generation_reaper = GenerationReaper()
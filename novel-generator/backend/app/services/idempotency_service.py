@@ -0,0 +1,83 @@
+"""
+幂等请求服务
+客户端带Idempotency-Key重试生成请求时，复用同一个键已在进行或已完成的生成任务，而不是再调用一次模型
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from ..config import settings
+from .generation_metrics import generation_metrics
+
+
+class IdempotencyConflictError(Exception):
+    """同一个Idempotency-Key被用于不同的请求"""
+
+
+class _IdempotencyEntry:
+    def __init__(self, scope: str, task: asyncio.Task):
+        self.scope = scope
+        self.task = task
+        self.created_at = time.monotonic()
+
+
+class IdempotencyService:
+    """进程内幂等键登记表
+
+    - 首次出现的键：在独立任务中执行生成，客户端断开也不会中断
+    - 重复的键：等待并返回同一个任务的结果
+    - 任务失败时移除登记，允许客户端用同一个键重试
+    """
+
+    def __init__(self, ttl_seconds: Optional[int] = None, max_entries: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds or settings.idempotency_ttl_seconds
+        self.max_entries = max_entries or settings.idempotency_max_entries
+        self._entries: "OrderedDict[str, _IdempotencyEntry]" = OrderedDict()
+
+    async def execute(self,
+                      key: Optional[str],
+                      scope: str,
+                      factory: Callable[[], Awaitable[Any]]) -> Any:
+        """按幂等键执行factory；没有键时直接执行"""
+        if not key:
+            return await factory()
+
+        self._purge()
+        entry = self._entries.get(key)
+        if entry:
+            if entry.scope != scope:
+                raise IdempotencyConflictError(f"Idempotency-Key已用于其他请求: {entry.scope}")
+            generation_metrics.incr("idempotency.replayed")
+            print(f"♻️ 幂等键 {key} 命中已有任务，复用结果")
+            return await asyncio.shield(entry.task)
+
+        task = asyncio.create_task(factory())
+        self._entries[key] = _IdempotencyEntry(scope, task)
+        task.add_done_callback(lambda done: self._forget_failed(key, done))
+        generation_metrics.incr("idempotency.started")
+        return await asyncio.shield(task)
+
+    def _forget_failed(self, key: str, task: asyncio.Task) -> None:
+        """失败或被取消的任务不缓存结果"""
+        entry = self._entries.get(key)
+        if entry and entry.task is task and (task.cancelled() or task.exception() is not None):
+            del self._entries[key]
+
+    def _purge(self) -> None:
+        """清理过期的已完成任务，并限制登记数量"""
+        now = time.monotonic()
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if entry.task.done() and now - entry.created_at > self.ttl_seconds:
+                del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            if not self._entries[oldest_key].task.done():
+                break
+            del self._entries[oldest_key]
+
+
+# 创建全局实例
+idempotency_service = IdempotencyService()
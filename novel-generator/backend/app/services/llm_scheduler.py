@@ -0,0 +1,221 @@
+"""
+LLM调用调度器
+所有模型调用共享一个并发预算：按优先级类别（交互 > 批量 > 后台）分配，同一类别内按小说/用户做公平排队，
+队列过长时在入口拒绝新请求（429），并记录每个类别的排队等待时间
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from ..config import settings
+from .generation_metrics import generation_metrics
+
+PRIORITY_INTERACTIVE = "interactive"  # 读者正在等待的生成（单章、大纲、v1整本）
+PRIORITY_BATCH = "batch"  # 批量生成剩余章节
+PRIORITY_BACKGROUND = "background"  # 预生成、数据填充等后台任务
+
+PRIORITY_ORDER = [PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_BACKGROUND]
+
+DEFAULT_FAIR_KEY = "default"
+
+current_llm_priority: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_llm_priority", default=PRIORITY_INTERACTIVE
+)
+current_llm_fair_key: contextvars.ContextVar[Tuple[str, float]] = contextvars.ContextVar(
+    "current_llm_fair_key", default=(DEFAULT_FAIR_KEY, 1.0)
+)
+
+
+def tag_llm_context(priority: Optional[str] = None, fair_key: Optional[str] = None, weight: float = 1.0) -> None:
+    """为当前任务（及其后创建的子任务）的模型调用设置优先级类别和公平排队键"""
+    if priority is not None:
+        if priority not in PRIORITY_ORDER:
+            raise ValueError(f"未知的优先级类别: {priority}")
+        current_llm_priority.set(priority)
+    if fair_key is not None:
+        current_llm_fair_key.set((fair_key, max(weight, 0.01)))
+
+
+class LLMWaitTracker:
+    """累计上下文内模型调用在调度队列中的等待时间（秒）"""
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+current_llm_wait_tracker: contextvars.ContextVar[Optional[LLMWaitTracker]] = contextvars.ContextVar(
+    "current_llm_wait_tracker", default=None
+)
+
+
+@contextmanager
+def track_llm_wait():
+    """在上下文内统计槽位排队等待时间；嵌套使用时内层的等待也计入外层"""
+    parent = current_llm_wait_tracker.get()
+    tracker = LLMWaitTracker()
+    token = current_llm_wait_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        current_llm_wait_tracker.reset(token)
+        if parent is not None:
+            parent.seconds += tracker.seconds
+
+
+class LLMQueueFullError(Exception):
+    """调度队列已满，拒绝新的生成请求"""
+
+
+class _Waiter:
+    def __init__(self, priority: str, key: str, finish_tag: float, start_tag: float):
+        self.priority = priority
+        self.key = key
+        self.finish_tag = finish_tag
+        self.start_tag = start_tag
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.perf_counter()
+
+
+class LLMScheduler:
+    """模型调用调度器
+
+    - 类别之间按严格优先级分配空闲槽位，并为交互类别预留llm_interactive_reserved_slots个槽位
+    - 类别内部按公平排队键（小说ID等）做加权公平排队（起始时间公平排队，权重越大份额越多）
+    """
+
+    def __init__(self,
+                 max_concurrency: Optional[int] = None,
+                 interactive_reserved_slots: Optional[int] = None,
+                 queue_limits: Optional[Dict[str, int]] = None):
+        self.max_concurrency = max_concurrency or settings.llm_max_concurrency
+        self.interactive_reserved_slots = (settings.llm_interactive_reserved_slots
+                                           if interactive_reserved_slots is None else interactive_reserved_slots)
+        self.queue_limits = queue_limits or {
+            PRIORITY_INTERACTIVE: settings.llm_queue_limit_interactive,
+            PRIORITY_BATCH: settings.llm_queue_limit_batch,
+            PRIORITY_BACKGROUND: settings.llm_queue_limit_background
+        }
+        self._active = 0
+        self._active_by_class: Dict[str, int] = {priority: 0 for priority in PRIORITY_ORDER}
+        self._queues: Dict[str, List[Tuple[float, int, _Waiter]]] = {priority: [] for priority in PRIORITY_ORDER}
+        self._waiting: Dict[str, int] = {priority: 0 for priority in PRIORITY_ORDER}
+        self._virtual_time: Dict[str, float] = {priority: 0.0 for priority in PRIORITY_ORDER}
+        self._last_finish: Dict[str, Dict[str, float]] = {priority: {} for priority in PRIORITY_ORDER}
+        self._seq = itertools.count()
+
+    def queue_depth(self, priority: str) -> int:
+        """类别当前排队数"""
+        return self._waiting[priority]
+
+    def check_admission(self, priority: str = PRIORITY_INTERACTIVE) -> None:
+        """入口准入检查：类别排队数达到上限时拒绝"""
+        if self._waiting[priority] >= self.queue_limits[priority]:
+            generation_metrics.incr(f"llm_scheduler.rejected.{priority}")
+            raise LLMQueueFullError(f"生成请求过多（{priority}队列已满），请稍后重试")
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个模型调用槽位，按当前上下文的优先级和公平排队键排队"""
+        priority = current_llm_priority.get()
+        key, weight = current_llm_fair_key.get()
+        waiter = self._enqueue(priority, key, weight)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已分配到槽位但调用方被取消，归还槽位
+                self._release(priority)
+            else:
+                self._waiting[priority] -= 1
+            raise
+
+        wait_ms = (time.perf_counter() - waiter.enqueued_at) * 1000
+        generation_metrics.observe(f"llm_scheduler.wait_ms.{priority}", wait_ms)
+        tracker = current_llm_wait_tracker.get()
+        if tracker is not None:
+            tracker.seconds += wait_ms / 1000
+        generation_metrics.incr(f"llm_scheduler.granted.{priority}")
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """各类别的运行数和排队数"""
+        return {
+            priority: {
+                "active": self._active_by_class[priority],
+                "queued": self._waiting[priority],
+                "queue_limit": self.queue_limits[priority]
+            }
+            for priority in PRIORITY_ORDER
+        }
+
+    def _enqueue(self, priority: str, key: str, weight: float) -> _Waiter:
+        start_tag = max(self._virtual_time[priority], self._last_finish[priority].get(key, 0.0))
+        finish_tag = start_tag + 1.0 / weight
+        self._last_finish[priority][key] = finish_tag
+        waiter = _Waiter(priority, key, finish_tag, start_tag)
+        heapq.heappush(self._queues[priority], (finish_tag, next(self._seq), waiter))
+        self._waiting[priority] += 1
+        return waiter
+
+    def _release(self, priority: str) -> None:
+        self._active -= 1
+        self._active_by_class[priority] -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """把空闲槽位分配给优先级最高、公平标签最小的等待者"""
+        while self._active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._active += 1
+            self._active_by_class[waiter.priority] += 1
+            self._waiting[waiter.priority] -= 1
+            self._virtual_time[waiter.priority] = waiter.start_tag
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        shared_capacity = self.max_concurrency - self.interactive_reserved_slots
+        for priority in PRIORITY_ORDER:
+            # 非交互类别不能占用为交互请求预留的槽位
+            if priority != PRIORITY_INTERACTIVE and self._active >= shared_capacity:
+                return None
+            queue = self._queues[priority]
+            while queue:
+                _, _, waiter = heapq.heappop(queue)
+                if not waiter.future.cancelled():
+                    return waiter
+            self._trim(priority)
+        return None
+
+    def _trim(self, priority: str) -> None:
+        """类别队列清空时重置公平排队状态，避免记录无限增长"""
+        if not self._queues[priority]:
+            self._last_finish[priority].clear()
+            self._virtual_time[priority] = 0.0
+
+
+def require_llm_capacity(priority: str = PRIORITY_INTERACTIVE):
+    """FastAPI依赖：入口准入控制，队列已满时返回429"""
+    def dependency():
+        try:
+            llm_scheduler.check_admission(priority)
+        except LLMQueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+    return dependency
+
+
+# 创建全局实例
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,76 @@
+"""
+LLM用量跟踪
+通过上下文变量把一次请求内（包括其派生的并发任务）所有模型调用的token用量累加到同一个计数对象；
+另外按模型记录输出速度和首个token延迟，供生成耗时估算使用
+"""
+
+import contextvars
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .generation_metrics import generation_metrics
+from .stream_guard import ESTIMATED_CHARS_PER_TOKEN
+
+MIN_THROUGHPUT_TOKENS = 50  # 输出太短的调用不参与速度统计
+
+
+class LLMUsage:
+    """一次请求的模型用量"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens
+        }
+
+
+current_llm_usage: contextvars.ContextVar[Optional[LLMUsage]] = contextvars.ContextVar(
+    "current_llm_usage", default=None
+)
+
+
+@contextmanager
+def track_llm_usage() -> Iterator[LLMUsage]:
+    """在with块内（及其中创建的任务里）记录模型用量"""
+    usage = LLMUsage()
+    token = current_llm_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        current_llm_usage.reset(token)
+
+
+def record_llm_usage(prompt_tokens: int = 0, completion_tokens: int = 0, calls: int = 0) -> None:
+    """累加到当前上下文的用量计数（没有跟踪时忽略）"""
+    usage = current_llm_usage.get()
+    if usage is None:
+        return
+    usage.calls += calls
+    usage.prompt_tokens += prompt_tokens
+    usage.completion_tokens += completion_tokens
+
+
+def estimate_tokens(text_length: int) -> int:
+    """按字符数估算token数（流式输出没有usage字段时使用）"""
+    return int(text_length / ESTIMATED_CHARS_PER_TOKEN)
+
+
+def record_llm_throughput(model: str,
+                          completion_tokens: int,
+                          seconds: float,
+                          first_token_seconds: Optional[float] = None) -> None:
+    """记录一次调用的输出速度（tokens/秒）和首个token延迟"""
+    if first_token_seconds is not None:
+        generation_metrics.observe(f"llm.first_token_seconds.{model}", first_token_seconds)
+    if completion_tokens >= MIN_THROUGHPUT_TOKENS and seconds > 0:
+        generation_metrics.observe(f"llm.tokens_per_second.{model}", completion_tokens / seconds)
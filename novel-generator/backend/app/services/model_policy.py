@@ -0,0 +1,169 @@
+"""
+按任务选择模型
+每类任务（大纲、章节、修复、验证重试）配置候选模型列表（优先的放前面），
+根据实测耗时和成功率（章节类任务以必须字词覆盖率计）自动在候选之间切换，选择结果计入指标
+"""
+
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from ..config import settings
+from .generation_metrics import generation_metrics
+from .llm_scheduler import track_llm_wait
+
+TASK_OUTLINE = "outline"  # 大纲、章节规划
+TASK_CHAPTER = "chapter"  # 章节正文
+TASK_REPAIR = "repair"  # 补写大纲缺失章节
+TASK_VALIDATION_RETRY = "validation_retry"  # 必须字词覆盖不达标后的重新生成
+
+TASKS = [TASK_OUTLINE, TASK_CHAPTER, TASK_REPAIR, TASK_VALIDATION_RETRY]
+
+EWMA_ALPHA = 0.2  # 指数滑动平均系数，越大越偏向最近的结果
+
+
+class _ModelStats:
+    """单个任务下单个模型的滑动统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.latency = 0.0
+        self.success_rate = 1.0
+
+    def update(self, latency: float, success: bool) -> None:
+        if self.count == 0:
+            self.latency = latency
+            self.success_rate = 1.0 if success else 0.0
+        else:
+            self.latency += EWMA_ALPHA * (latency - self.latency)
+            self.success_rate += EWMA_ALPHA * ((1.0 if success else 0.0) - self.success_rate)
+        self.count += 1
+
+
+class ModelDecision:
+    """一次模型选择，调用方在结束前可设置success"""
+
+    def __init__(self, task: str, model: str, reason: str):
+        self.task = task
+        self.model = model
+        self.reason = reason
+        self.success: Optional[bool] = None
+
+
+class ModelPolicy:
+    """按任务选择模型的策略
+
+    依次检查候选模型，选第一个“健康”的：样本不足min_samples（信任配置顺序），
+    或成功率不低于min_success_rate且平均耗时不超过该任务的耗时预算；
+    都不健康时选综合得分最高的；另外以explore_ratio的概率随机试用其他候选，使被降级的模型有机会恢复
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, _ModelStats]] = {task: {} for task in TASKS}
+        self._last_choice: Dict[str, str] = {}
+
+    def candidates(self, task: str) -> List[str]:
+        """任务配置的候选模型（优先的在前）"""
+        raw = getattr(settings, f"{task}_model", "") or settings.deepseek_model
+        models = [name.strip() for name in raw.split(",") if name.strip()]
+        return models or [settings.deepseek_model]
+
+    def current_model(self, task: str) -> str:
+        """任务最近一次（非试用）选择的模型，还没有选择过时为首选候选"""
+        return self._last_choice.get(task, self.candidates(task)[0])
+
+    def latency_budget(self, task: str) -> float:
+        return getattr(settings, f"task_model_latency_budget_{task}")
+
+    def select(self, task: str) -> ModelDecision:
+        """为任务选择模型并记录选择指标"""
+        candidates = self.candidates(task)
+        model, reason = self._choose(task, candidates)
+
+        generation_metrics.incr(f"model_policy.{task}.selected.{model}")
+        if model != candidates[0]:
+            generation_metrics.incr(f"model_policy.{task}.fallbacks")
+        previous = self._last_choice.get(task)
+        if previous and previous != model and reason != "explore":
+            generation_metrics.incr(f"model_policy.{task}.switches")
+            print(f"🔀 任务 {task} 的模型切换: {previous} -> {model}（{reason}）")
+        if reason != "explore":
+            self._last_choice[task] = model
+        return ModelDecision(task, model, reason)
+
+    def record(self, task: str, model: str, latency: float, success: bool) -> None:
+        """记录一次调用结果"""
+        self._stats[task].setdefault(model, _ModelStats()).update(latency, success)
+        generation_metrics.observe(f"model_policy.{task}.latency.{model}", latency)
+        generation_metrics.incr(f"model_policy.{task}.{'success' if success else 'failure'}.{model}")
+
+    @asynccontextmanager
+    async def use(self, task: str):
+        """选择模型并在结束时记录耗时和结果
+
+        耗时不含在调度队列中等待槽位的时间，排队长短不影响模型的选择；
+        调用方未设置decision.success时，正常结束记为成功、抛出异常记为失败；被取消时不记录
+        """
+        decision = self.select(task)
+        start = time.monotonic()
+        with track_llm_wait() as wait:
+            try:
+                yield decision
+            except Exception:
+                self.record(task, decision.model, self._elapsed(start, wait.seconds), False)
+                raise
+        self.record(task, decision.model, self._elapsed(start, wait.seconds),
+                    True if decision.success is None else decision.success)
+
+    @staticmethod
+    def _elapsed(start: float, wait_seconds: float) -> float:
+        return max(0.0, time.monotonic() - start - wait_seconds)
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """各任务各模型的统计和当前选择"""
+        return {
+            task: {
+                "current": self.current_model(task),
+                "candidates": self.candidates(task),
+                "models": {
+                    model: {
+                        "count": stats.count,
+                        "latency_seconds": round(stats.latency, 2),
+                        "success_rate": round(stats.success_rate, 3)
+                    }
+                    for model, stats in self._stats[task].items()
+                }
+            }
+            for task in TASKS
+        }
+
+    def _choose(self, task: str, candidates: List[str]) -> tuple:
+        if len(candidates) == 1 or not settings.task_model_adaptive:
+            return candidates[0], "configured"
+
+        model, reason = self._choose_by_stats(task, candidates)
+        if random.random() < settings.task_model_explore_ratio:
+            return random.choice([name for name in candidates if name != model]), "explore"
+        return model, reason
+
+    def _choose_by_stats(self, task: str, candidates: List[str]) -> tuple:
+        budget = self.latency_budget(task)
+        task_stats = self._stats[task]
+        for model in candidates:
+            stats = task_stats.get(model)
+            if stats is None or stats.count < settings.task_model_min_samples:
+                return model, "insufficient_samples"
+            if stats.success_rate >= settings.task_model_min_success_rate and stats.latency <= budget:
+                return model, "healthy"
+
+        # 所有候选都不健康：成功率优先，耗时按预算折算扣分
+        def score(model: str) -> float:
+            stats = task_stats[model]
+            return stats.success_rate - 0.5 * stats.latency / budget
+
+        return max(candidates, key=score), "best_score"
+
+
+# 创建全局实例
+model_policy = ModelPolicy()
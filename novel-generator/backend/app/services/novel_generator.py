@@ -1,10 +1,37 @@
 from typing import Dict, Any, Optional, List
+import asyncio
 import json
 import random
+import re
+import time
+import zlib
+from datetime import datetime
 from ..config import settings
 from .deepseek_client import DeepSeekClient
 from ..models.material import Material
+from ..models.dialogue import SpeakerType
 from .dialogue_parser import DialogueParser
+from .content_normalizer import canonicalize_quotes
+from .generation_metrics import generation_metrics
+from .model_policy import model_policy, TASK_OUTLINE, TASK_CHAPTER, TASK_VALIDATION_RETRY
+from .synthetic_corpus import SyntheticCorpusGenerator, STYLE_MARKED
+
+CHINESE_DIGITS = "零一二三四五六七八九"
+CHAPTER_HEADING_PATTERN = re.compile(r'^第([一二三四五六七八九十百零\d]+)章[：:]\s*(.*)$', re.MULTILINE)
+MOCK_CHAPTER_COUNT = 5  # AI不可用时模拟内容的章节数
+MOCK_CHAPTER_LENGTH = 600  # 模拟内容每章字数
+
+
+def to_chinese_number(number: int) -> str:
+    """将章节序号转换为中文数字（1-99）"""
+    if number < 10:
+        return CHINESE_DIGITS[number]
+    tens, ones = divmod(number, 10)
+    if number < 20:
+        return "十" + (CHINESE_DIGITS[ones] if ones else "")
+    if number < 100:
+        return CHINESE_DIGITS[tens] + "十" + (CHINESE_DIGITS[ones] if ones else "")
+    return str(number)
 
 
 class NovelGenerator:
@@ -32,35 +59,245 @@ class NovelGenerator:
                                    material_id: Optional[str] = None) -> str:
         """生成完整的小说内容（支持材料投喂）"""
         
-        # 获取材料信息
-        material = None
-        if material_id:
+        result = await self.generate_novel_with_analysis(
+            title, description, genre, style, character_info, plot_outline, material_id
+        )
+        return result["content"]
+    
+    async def generate_novel_with_analysis(self,
+                                           title: str,
+                                           description: str,
+                                           genre: str,
+                                           style: str,
+                                           character_info: str,
+                                           plot_outline: str,
+                                           material_id: Optional[str] = None,
+                                           material: Optional[Material] = None,
+                                           task: str = TASK_CHAPTER) -> Dict[str, Any]:
+        """生成小说内容，并附带只计算一次的分析结果（有必须字符时）
+        
+        task决定章节生成使用的模型（首次生成或验证重试），生成成功且必须字符覆盖率达标记为该模型的一次成功。
+        返回 {"content": 小说内容, "chapters": 章节列表, "analysis": analyze_content的结果或None}
+        """
+        
+        # 获取材料信息（调用方已加载时直接复用）
+        if material is None and material_id:
             try:
                 material = await Material.get(material_id)
                 print(f"📚 使用材料: {material.title if material else '未找到'}")
             except Exception as e:
                 print(f"⚠️ 材料获取失败: {e}")
         
+        chapters = None
+        decision = None
+        generated = False
         if not self.client:
-            return self._generate_mock_content(title, description, genre, material)
+            content = self._generate_mock_content(title, description, genre, material)
+        else:
+            decision = model_policy.select(task)
+            started = time.monotonic()
+            try:
+                print(f"🤖 开始生成小说内容: {title}（模型: {decision.model}）")
+                plan = await self._plan_chapters(
+                    title, description, genre, style, character_info, plot_outline, material
+                )
+                if plan:
+                    chapters = await self._generate_chapters_concurrently(
+                        title, description, genre, style, character_info, material, plan,
+                        model=decision.model
+                    )
+                    content = self._stitch_chapters(chapters)
+                else:
+                    # 规划失败时退回整本一次性生成
+                    prompt = self._build_enhanced_novel_prompt(
+                        title, description, genre, style, character_info, plot_outline, material
+                    )
+                    content = await self.client.generate_novel_content(prompt, model=decision.model)
+                generated = True
+                print(f"✅ 小说内容生成完成，长度: {len(content)} 字符")
+            except Exception as e:
+                print(f"❌ AI生成失败: {e}")
+                content = self._generate_mock_content(title, description, genre, material)
         
-        prompt = self._build_enhanced_novel_prompt(
-            title, description, genre, style, character_info, plot_outline, material
-        )
+        if chapters is None:
+            chapters = self._split_chapters(content)
+        
+        # 分析对话和必须字符使用情况
+        analysis = None
+        if material and material.required_characters:
+            required_chars = [char.character for char in material.required_characters]
+            analysis = self.analyze_content(content, required_chars)
+        
+        if decision:
+            covered = analysis is None or analysis["coverage"]["usage_rate"] >= settings.task_model_min_coverage
+            model_policy.record(task, decision.model, time.monotonic() - started, generated and covered)
+        
+        return {"content": content, "chapters": chapters, "analysis": analysis}
+    
+    async def _plan_chapters(self,
+                             title: str,
+                             description: str,
+                             genre: str,
+                             style: str,
+                             character_info: str,
+                             plot_outline: str,
+                             material: Optional[Material] = None) -> List[Dict[str, str]]:
+        """先用一次轻量请求规划章节（标题+概要），失败时返回空列表"""
+        
+        category = f"\n小说类别：{material.category}" if material else ""
+        prompt = f"""
+        请为以下小说规划5-8个章节，只需给出每章标题和一句话概要：
+        
+        标题：{title}
+        描述：{description}
+        类型：{genre}
+        风格：{style}
+        人物设定：{character_info}
+        情节大纲：{plot_outline}{category}
+        
+        要求情节连贯、有起承转合。请严格按以下JSON格式返回，不要添加任何解释：
+        {{"chapters": [{{"title": "章节标题", "summary": "本章概要"}}]}}
+        """
         
         try:
-            print(f"🤖 开始生成小说内容: {title}")
-            content = await self.client.generate_novel_content(prompt)
-            print(f"✅ 小说内容生成完成，长度: {len(content)} 字符")
-            
-            # 分析对话和必须字符使用情况
-            if material and material.required_characters:
-                self._analyze_character_usage(content, material)
-            
-            return content
+            async with model_policy.use(TASK_OUTLINE) as decision:
+                response = await self.client.chat_completion(
+                    messages=[
+                        {"role": "system", "content": "你是一个专业的小说策划助手，请严格按照JSON格式返回结果。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=1500,
+                    temperature=0.7,
+                    model=decision.model
+                )
+                message = response['choices'][0]['message']
+                text = message.get('content') or message.get('reasoning_content') or ''
+                start, end = text.find("{"), text.rfind("}")
+                plan = json.loads(text[start:end + 1]).get("chapters", [])
+                plan = [
+                    {"title": str(item.get("title", "")).strip(), "summary": str(item.get("summary", "")).strip()}
+                    for item in plan if isinstance(item, dict) and item.get("title")
+                ]
+                if not plan:
+                    raise ValueError("章节规划为空")
+            print(f"🗺️ 章节规划完成，共 {len(plan)} 章")
+            return plan[:8]
         except Exception as e:
-            print(f"❌ AI生成失败: {e}")
-            return self._generate_mock_content(title, description, genre, material)
+            print(f"⚠️ 章节规划失败，改为整本生成: {e}")
+            return []
+    
+    async def _generate_chapters_concurrently(self,
+                                              title: str,
+                                              description: str,
+                                              genre: str,
+                                              style: str,
+                                              character_info: str,
+                                              material: Optional[Material],
+                                              plan: List[Dict[str, str]],
+                                              model: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按规划并发生成各章节，返回按章节号排序的章节列表"""
+        
+        # 将必须字符轮流分配到各章节，整本覆盖所有字符
+        required_chars = [char.character for char in material.required_characters] if material else []
+        chars_by_chapter = [required_chars[i::len(plan)] for i in range(len(plan))]
+        
+        plan_text = "\n".join(
+            f"        第{to_chinese_number(i)}章：{item['title']}——{item['summary']}"
+            for i, item in enumerate(plan, 1)
+        )
+        semaphore = asyncio.Semaphore(max(1, settings.novel_chapter_concurrency))
+        start_time = time.monotonic()
+        
+        async def generate_one(number: int, item: Dict[str, str]) -> Dict[str, Any]:
+            prompt = f"""
+        请为小说《{title}》创作第{to_chinese_number(number)}章：{item['title']}
+        
+        描述：{description}
+        类型：{genre}
+        风格：{style}
+        人物设定：{character_info}
+        
+        全书章节规划：
+{plan_text}
+        
+        本章概要：{item['summary']}
+        """
+            prompt += self._build_material_section(material, chars_by_chapter[number - 1])
+            prompt += """
+        
+        【创作要求】
+        1. 只写本章内容，1000-1500字，与前后章节规划衔接自然
+        2. 包含大量对话，特别是主角对话
+        3. 不要输出章节标题
+        
+        **【重要格式要求】**：
+        对话部分必须按以下格式标记：
+           - 旁白和叙述部分：在段落开头标注"正文："
+           - 主角说话：标注"主角："后跟对话内容
+           - 其他角色说话：标注"角色名："或"其他角色："后跟对话内容
+        
+        请直接返回章节正文，不要添加任何解释或格式说明。
+        """
+            async with semaphore:
+                chapter_content, continuations = await self.client.generate_novel_content_with_continuations(
+                    prompt, max_tokens=settings.novel_chapter_max_tokens, model=model
+                )
+            return {
+                "chapter_number": number,
+                "title": item["title"],
+                "content": chapter_content.strip(),
+                "continuation_count": continuations,
+                "created_at": datetime.utcnow()
+            }
+        
+        # 单章失败不影响其他章节：只重新生成失败的章节，重试后仍失败才放弃整本
+        pending = list(enumerate(plan, 1))
+        chapters = []
+        for attempt in range(settings.novel_chapter_retries + 1):
+            results = await asyncio.gather(
+                *(generate_one(number, item) for number, item in pending), return_exceptions=True
+            )
+            failed = []
+            for (number, item), result in zip(pending, results):
+                if isinstance(result, asyncio.CancelledError):
+                    raise result
+                if isinstance(result, BaseException):
+                    print(f"⚠️ 第{number}章生成失败: {result}")
+                    failed.append((number, item, result))
+                else:
+                    chapters.append(result)
+            if not failed:
+                break
+            generation_metrics.incr("novel_chapters.failed", len(failed))
+            pending = [(number, item) for number, item, _ in failed]
+        else:
+            raise Exception(f"{len(failed)} 个章节重试后仍生成失败: {failed[0][2]}")
+        
+        elapsed = time.monotonic() - start_time
+        generation_metrics.observe("novel_chapters.wall_seconds", elapsed)
+        print(f"📚 {len(chapters)} 个章节并发生成完成，耗时 {elapsed:.1f}秒")
+        return sorted(chapters, key=lambda chapter: chapter["chapter_number"])
+    
+    def _stitch_chapters(self, chapters: List[Dict[str, Any]]) -> str:
+        """将章节拼接为整本内容（第X章：标题）"""
+        return "\n\n".join(
+            f"第{to_chinese_number(chapter['chapter_number'])}章：{chapter['title']}\n{chapter['content']}"
+            for chapter in chapters
+        )
+    
+    def _split_chapters(self, content: str) -> List[Dict[str, Any]]:
+        """按"第X章："标题将整本内容拆分为章节列表"""
+        headings = list(CHAPTER_HEADING_PATTERN.finditer(content))
+        chapters = []
+        for index, heading in enumerate(headings):
+            end = headings[index + 1].start() if index + 1 < len(headings) else len(content)
+            chapters.append({
+                "chapter_number": index + 1,
+                "title": heading.group(2).strip(),
+                "content": content[heading.end():end].strip(),
+                "created_at": datetime.utcnow()
+            })
+        return chapters
     
     def _build_enhanced_novel_prompt(self, title: str, description: str, genre: str, 
                                    style: str, character_info: str, plot_outline: str, 
@@ -80,46 +317,7 @@ class NovelGenerator:
         """
         
         # 如果有材料，添加材料指导
-        if material:
-            prompt += f"""
-        
-        【重要：材料投喂指导】
-        小说类别：{material.category}
-        """
-            
-            if material.example_novels:
-                prompt += f"参考小说：{', '.join(material.example_novels)}\n"
-            
-            # 添加写作指导
-            guidelines = material.writing_guidelines
-            if guidelines:
-                prompt += "\n写作指导要求：\n"
-                if guidelines.world_building:
-                    prompt += f"• 世界观设定：{guidelines.world_building}\n"
-                if guidelines.character_development:
-                    prompt += f"• 角色刻画：{guidelines.character_development}\n"
-                if guidelines.background_setting:
-                    prompt += f"• 背景设定：{guidelines.background_setting}\n"
-                if guidelines.plot_development:
-                    prompt += f"• 情节发展：{guidelines.plot_development}\n"
-                if guidelines.language_style:
-                    prompt += f"• 语言风格：{guidelines.language_style}\n"
-            
-            # 添加必须使用的汉字要求
-            if material.required_characters:
-                required_chars = [char.character for char in material.required_characters]
-                prompt += f"""
-        
-        【核心要求：必须使用指定汉字】
-        在主角的对话中，必须自然地使用以下汉字：
-        {', '.join(required_chars)}
-        
-        注意：
-        1. 这些汉字必须出现在主角的对话（引号内的内容）中
-        2. 使用要自然流畅，不能生硬插入
-        3. 主角对话要丰富，确保有足够机会使用这些字符
-        4. 其他角色对话无此限制
-        """
+        prompt += self._build_material_section(material)
         
         # 通用要求
         prompt += """
@@ -166,72 +364,77 @@ class NovelGenerator:
         
         return prompt
     
+    def _build_material_section(self, material: Optional[Material] = None,
+                                required_chars: Optional[List[str]] = None) -> str:
+        """构建提示词中的材料投喂部分（required_chars为空时使用材料的全部必须字符）"""
+        
+        if not material:
+            return ""
+        
+        section = f"""
+        
+        【重要：材料投喂指导】
+        小说类别：{material.category}
+        """
+        
+        if material.example_novels:
+            section += f"参考小说：{', '.join(material.example_novels)}\n"
+        
+        # 添加写作指导
+        guidelines = material.writing_guidelines
+        if guidelines:
+            section += "\n写作指导要求：\n"
+            if guidelines.world_building:
+                section += f"• 世界观设定：{guidelines.world_building}\n"
+            if guidelines.character_development:
+                section += f"• 角色刻画：{guidelines.character_development}\n"
+            if guidelines.background_setting:
+                section += f"• 背景设定：{guidelines.background_setting}\n"
+            if guidelines.plot_development:
+                section += f"• 情节发展：{guidelines.plot_development}\n"
+            if guidelines.language_style:
+                section += f"• 语言风格：{guidelines.language_style}\n"
+        
+        # 添加必须使用的汉字要求
+        if required_chars is None and material.required_characters:
+            required_chars = [char.character for char in material.required_characters]
+        if required_chars:
+            section += f"""
+        
+        【核心要求：必须使用指定汉字】
+        在主角的对话中，必须自然地使用以下汉字：
+        {', '.join(required_chars)}
+        
+        注意：
+        1. 这些汉字必须出现在主角的对话（引号内的内容）中
+        2. 使用要自然流畅，不能生硬插入
+        3. 主角对话要丰富，确保有足够机会使用这些字符
+        4. 其他角色对话无此限制
+        """
+        
+        return section
+    
     def _generate_mock_content(self, title: str, description: str, genre: str, 
                              material: Optional[Material] = None) -> str:
-        """生成模拟小说内容（当AI不可用时）"""
+        """生成模拟小说内容（当AI不可用时）
         
-        # 如果有材料，尝试使用必须字符
+        使用按标题固定种子的合成语料，同一标题总是得到相同的内容；有材料时写入全部必须字符
+        """
         required_chars = []
         if material and material.required_characters:
-            required_chars = [char.character for char in material.required_characters[:10]]  # 使用前10个
-        
-        # 构建包含必须字符的主角对话
-        protagonist_dialogues = [
-            "\"今天似乎有些不同。\"我望着窗外，心中涌起一种莫名的预感。",
-            "\"这一切都不是巧合。\"我喃喃自语，眼中闪烁着坚定的光芒。",
-            "\"原来如此，所有的线索都指向同一个方向。\"我恍然大悟。",
-            "\"现在后悔还来得及吗？\"我苦笑道，但眼中的决心却更加坚定。",
-            "\"无论结果如何，我都不会后悔。\"我深吸一口气，迎向了自己的命运。"
-        ]
-        
-        # 如果有必须字符，随机插入到对话中
-        if required_chars:
-            for i, char in enumerate(required_chars[:len(protagonist_dialogues)]):
-                old_dialogue = protagonist_dialogues[i]
-                # 简单地在对话中插入字符（实际应用中需要更智能的插入方式）
-                new_dialogue = old_dialogue.replace("我", f"我{char}然")
-                protagonist_dialogues[i] = new_dialogue
-        
-        mock_content = f"""第一章：序幕
-
-{description}
-
-这是一个关于{genre}的故事。主角在一个平凡的日子里，突然发现自己的生活即将发生巨大的变化。
-
-{protagonist_dialogues[0]}
-
-第二章：初现端倪
-
-随着时间的推移，奇异的事件开始接连发生。主角意识到，自己可能卷入了一个远超想象的事件中。
-
-{protagonist_dialogues[1]}
-
-第三章：真相渐显
-
-经过一番调查，主角终于发现了事件背后的真相。原来一切都与一个古老的秘密有关。
-
-{protagonist_dialogues[2]}
-
-第四章：危机四伏
-
-知晓真相的主角并没有感到轻松，反而意识到自己正面临着前所未有的危险。
-
-{protagonist_dialogues[3]}
-
-第五章：最终对决
-
-在经历了重重考验后，主角终于迎来了最终的挑战。这是决定一切的关键时刻。
-
-{protagonist_dialogues[4]}
-
-尾声：新的开始
-
-当一切尘埃落定，主角回望来路，发现自己已经成长了许多。虽然经历了种种困难，但这段经历也让他收获了宝贵的财富。
-
-这就是{title}的故事，一个关于成长、勇气和坚持的传奇。
-
-[注：由于AI服务暂时不可用，以上为示例内容。请配置DeepSeek API密钥以获得完整的AI生成内容。]"""
-        
+            required_chars = [char.character for char in material.required_characters]
+        
+        chapters = SyntheticCorpusGenerator(
+            seed=zlib.crc32(title.encode("utf-8")),
+            chapter_length=MOCK_CHAPTER_LENGTH,
+            required_chars=required_chars,
+            styles=(STYLE_MARKED,)  # 模拟内容直接展示给读者，只用标准标记写法；混合风格留给基准和压力测试
+        ).generate_chapters(MOCK_CHAPTER_COUNT)
+        if description:
+            chapters[0]["content"] = f"正文：{description}\n{chapters[0]['content']}"
+        
+        mock_content = self._stitch_chapters(chapters)
+        mock_content += f"\n\n[注：由于AI服务暂时不可用，以上为《{title}》（{genre}）的示例内容。请配置DeepSeek API密钥以获得完整的AI生成内容。]"
         if material:
             mock_content += f"\n\n[使用材料：{material.title}]"
             if required_chars:
@@ -239,25 +442,47 @@ class NovelGenerator:
         
         return mock_content.strip()
     
-    def _analyze_character_usage(self, content: str, material: Material) -> Dict[str, Any]:
-        """分析小说中必须字符的使用情况"""
+    def analyze_content(self, content: str, required_chars: List[str]) -> Dict[str, Any]:
+        """解析一次小说内容，返回可复用的分析结果
         
-        # 解析对话
-        dialogue_segments = self.dialogue_parser.parse_novel_content(content)
+        返回 {"segments": 对话片段, "coverage": 必须字符使用情况, "stats": 统计信息}
+        """
+        
+        start_time = time.perf_counter()
+        
+        # 解析对话（引号统一为半角后DialogueParser才能识别全角引号中的对话）
+        dialogue_segments = self.dialogue_parser.parse_novel_content(canonicalize_quotes(content))
         
         # 分析必须字符使用
-        required_chars = [char.character for char in material.required_characters]
-        analysis = self.dialogue_parser.analyze_required_characters(dialogue_segments, required_chars)
+        coverage = self.dialogue_parser.analyze_required_characters(dialogue_segments, required_chars)
+        
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        generation_metrics.observe("novel_analysis.parse_ms", elapsed_ms)
+        
+        speaker_counts = {speaker_type.value: 0 for speaker_type in SpeakerType}
+        for segment in dialogue_segments:
+            speaker_counts[segment.speaker_type.value] += 1
+        
+        stats = {
+            "content_length": len(content),
+            "segment_count": len(dialogue_segments),
+            "speaker_counts": speaker_counts,
+            "parse_ms": round(elapsed_ms, 2)
+        }
         
         print(f"📊 字符使用分析:")
-        print(f"   总必须字符: {analysis['total_required_chars']}")
-        print(f"   已使用字符: {analysis['used_chars_count']}")
-        print(f"   使用率: {analysis['usage_rate']:.1%}")
+        print(f"   总必须字符: {coverage['total_required_chars']}")
+        print(f"   已使用字符: {coverage['used_chars_count']}")
+        print(f"   使用率: {coverage['usage_rate']:.1%}")
         
-        if analysis['unused_chars']:
-            print(f"   未使用字符: {', '.join(analysis['unused_chars'])}")
+        if coverage['unused_chars']:
+            print(f"   未使用字符: {', '.join(coverage['unused_chars'])}")
         
-        return analysis
+        return {
+            "segments": dialogue_segments,
+            "coverage": coverage,
+            "stats": stats
+        }
     
     async def generate_with_material_validation(self, 
                                               title: str,
@@ -267,8 +492,13 @@ class NovelGenerator:
                                               character_info: str,
                                               plot_outline: str,
                                               material_id: str,
-                                              max_retries: int = 3) -> Dict[str, Any]:
-        """带材料验证的小说生成（如果字符使用率不达标会重试）"""
+                                              max_retries: int = 3,
+                                              concurrent_drafts: int = 1) -> Dict[str, Any]:
+        """带材料验证的小说生成（如果字符使用率不达标会重试）
+        
+        concurrent_drafts > 1 时每轮并发生成多份草稿，任一份达标即取消其余草稿；
+        整轮都不达标时再进行下一轮，最多max_retries轮，返回所有轮次中最好的草稿。
+        """
         
         material = await Material.get(material_id)
         if not material:
@@ -277,32 +507,160 @@ class NovelGenerator:
         required_chars = [char.character for char in material.required_characters]
         min_usage_rate = 0.8  # 最低使用率要求
         
+        if concurrent_drafts > 1:
+            return await self._generate_best_of_n_rounds(
+                title, description, genre, style, character_info, plot_outline,
+                material, required_chars, min_usage_rate, concurrent_drafts, max_retries
+            )
+        
         for attempt in range(max_retries):
             print(f"🎯 第 {attempt + 1} 次生成尝试")
             
-            content = await self.generate_novel_content(
-                title, description, genre, style, character_info, plot_outline, material_id
+            # 首次生成之后的尝试属于验证重试，单独选择模型
+            result = await self._generate_scored_draft(
+                title, description, genre, style, character_info, plot_outline, material, required_chars,
+                task=TASK_CHAPTER if attempt == 0 else TASK_VALIDATION_RETRY
             )
+            coverage = result["analysis"]["coverage"]
             
-            # 分析字符使用情况
-            dialogue_segments = self.dialogue_parser.parse_novel_content(content)
-            analysis = self.dialogue_parser.analyze_required_characters(dialogue_segments, required_chars)
-            
-            if analysis['usage_rate'] >= min_usage_rate:
-                print(f"✅ 字符使用率达标: {analysis['usage_rate']:.1%}")
-                return {
-                    "content": content,
-                    "analysis": analysis,
-                    "attempt": attempt + 1,
-                    "success": True
-                }
+            if coverage['usage_rate'] >= min_usage_rate:
+                print(f"✅ 字符使用率达标: {coverage['usage_rate']:.1%}")
+                return self._build_validation_result(result, attempt + 1, True)
             else:
-                print(f"⚠️ 字符使用率不达标: {analysis['usage_rate']:.1%}，需要重试")
+                print(f"⚠️ 字符使用率不达标: {coverage['usage_rate']:.1%}，需要重试")
         
         print(f"❌ 经过 {max_retries} 次尝试，仍未达到字符使用率要求")
+        return self._build_validation_result(result, max_retries, False)
+    
+    async def _generate_scored_draft(self,
+                                     title: str,
+                                     description: str,
+                                     genre: str,
+                                     style: str,
+                                     character_info: str,
+                                     plot_outline: str,
+                                     material: Material,
+                                     required_chars: List[str],
+                                     task: str = TASK_CHAPTER) -> Dict[str, Any]:
+        """生成一份草稿并保证带有分析结果（材料无必须字符时也计算一次）"""
+        result = await self.generate_novel_with_analysis(
+            title, description, genre, style, character_info, plot_outline, material=material, task=task
+        )
+        if result["analysis"] is None:
+            result["analysis"] = self.analyze_content(result["content"], required_chars)
+        return result
+    
+    def _build_validation_result(self, result: Dict[str, Any], attempt: int, success: bool) -> Dict[str, Any]:
+        """组装验证生成的返回结果"""
         return {
-            "content": content,
-            "analysis": analysis,
-            "attempt": max_retries,
-            "success": False
+            "content": result["content"],
+            "chapters": result["chapters"],
+            "analysis": result["analysis"]["coverage"],
+            "segments": result["analysis"]["segments"],
+            "stats": result["analysis"]["stats"],
+            "attempt": attempt,
+            "success": success
         }
+    
+    async def _generate_best_of_n_rounds(self,
+                                         title: str,
+                                         description: str,
+                                         genre: str,
+                                         style: str,
+                                         character_info: str,
+                                         plot_outline: str,
+                                         material: Material,
+                                         required_chars: List[str],
+                                         min_usage_rate: float,
+                                         draft_count: int,
+                                         max_rounds: int) -> Dict[str, Any]:
+        """最多max_rounds轮并发草稿，首轮之后属于验证重试；某轮有草稿达标即结束"""
+        
+        start_time = time.monotonic()
+        best = None
+        completed = 0
+        
+        for round_index in range(max_rounds):
+            print(f"🎯 第 {round_index + 1}/{max_rounds} 轮：并发生成 {draft_count} 份草稿")
+            draft, round_completed = await self._generate_best_of_n(
+                title, description, genre, style, character_info, plot_outline, material, required_chars,
+                min_usage_rate, draft_count, task=TASK_CHAPTER if round_index == 0 else TASK_VALIDATION_RETRY
+            )
+            completed += round_completed
+            if draft and (best is None or
+                          draft["analysis"]["coverage"]['usage_rate'] > best["analysis"]["coverage"]['usage_rate']):
+                best = draft
+            if best and best["analysis"]["coverage"]['usage_rate'] >= min_usage_rate:
+                break
+        
+        elapsed = time.monotonic() - start_time
+        generation_metrics.observe("best_of_n.wall_seconds", elapsed)
+        
+        if best is None:
+            raise Exception(f"{max_rounds} 轮共 {max_rounds * draft_count} 份草稿全部生成失败")
+        
+        usage_rate = best["analysis"]["coverage"]['usage_rate']
+        success = usage_rate >= min_usage_rate
+        generation_metrics.incr("best_of_n.success" if success else "best_of_n.failure")
+        if success:
+            print(f"✅ 草稿使用率达标: {usage_rate:.1%}，耗时 {elapsed:.1f}秒")
+        else:
+            print(f"❌ {max_rounds} 轮草稿均未达到字符使用率要求，返回最佳草稿")
+        
+        return self._build_validation_result(best, completed, success)
+    
+    async def _generate_best_of_n(self,
+                                  title: str,
+                                  description: str,
+                                  genre: str,
+                                  style: str,
+                                  character_info: str,
+                                  plot_outline: str,
+                                  material: Material,
+                                  required_chars: List[str],
+                                  min_usage_rate: float,
+                                  draft_count: int,
+                                  task: str = TASK_CHAPTER) -> tuple:
+        """一轮并发生成多份草稿，按完成顺序评分，首个达标草稿胜出后取消其余草稿
+        
+        返回(本轮最佳草稿, 完成的草稿数)，全部失败时最佳草稿为None
+        """
+        
+        async def run_draft() -> Dict[str, Any]:
+            return await self._generate_scored_draft(
+                title, description, genre, style, character_info, plot_outline, material, required_chars, task=task
+            )
+        
+        tasks = [asyncio.create_task(run_draft()) for _ in range(draft_count)]
+        best = None
+        completed = 0
+        
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    draft = await next_done
+                except Exception as e:
+                    print(f"⚠️ 草稿生成失败: {e}")
+                    continue
+                
+                completed += 1
+                usage_rate = draft["analysis"]["coverage"]['usage_rate']
+                print(f"📝 第 {completed} 份完成的草稿使用率: {usage_rate:.1%}")
+                
+                if best is None or usage_rate > best["analysis"]["coverage"]['usage_rate']:
+                    best = draft
+                
+                if usage_rate >= min_usage_rate:
+                    break
+        finally:
+            cancelled = 0
+            for draft_task in tasks:
+                if not draft_task.done():
+                    draft_task.cancel()
+                    cancelled += 1
+            if cancelled:
+                await asyncio.gather(*tasks, return_exceptions=True)
+                generation_metrics.incr("best_of_n.cancelled_drafts", cancelled)
+                print(f"🛑 已取消 {cancelled} 份未完成的草稿")
+        
+        return best, completed
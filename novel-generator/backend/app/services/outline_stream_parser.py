@@ -0,0 +1,121 @@
+"""
+大纲流式JSON解析器
+逐块读取模型输出的大纲JSON，每当一个章节对象闭合就立即产出，输出被截断时也能保留已完成的章节
+"""
+
+import json
+from typing import Dict, List, Any, Optional
+
+
+class IncrementalOutlineParser:
+    """增量大纲JSON解析器
+
+    只跟踪字符串/转义状态和括号深度，不回溯：
+    - 顶层字段（title、summary、main_characters等）在值结束时解析并记录到fields
+    - chapters数组中的每个章节对象闭合时立即解析并返回
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields: Dict[str, Any] = {}
+        self.chapters: List[Dict[str, Any]] = []
+        self.completed = False  # 根对象是否已闭合
+
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = True
+        self._current_key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self._chapter_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """输入一段增量文本，返回本次新闭合的章节对象"""
+        self.buffer += text
+        buf = self.buffer
+        new_chapters = []
+
+        for i in range(self._pos, len(buf)):
+            if self.completed:
+                break
+            ch = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._expect_key:
+                            self._current_key = self._loads(buf[self._string_start:i + 1])
+                        else:
+                            self._finish_value(i + 1)
+                continue
+
+            # 根对象之前的内容（如```json代码块标记）直接跳过
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+                self._mark_value_start(i)
+            elif ch in "{[":
+                self._mark_value_start(i)
+                if ch == "{" and self._depth == 2 and self._current_key == "chapters":
+                    self._chapter_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._depth == 2 and self._chapter_start is not None:
+                    chapter = self._loads(buf[self._chapter_start:i + 1])
+                    self._chapter_start = None
+                    if isinstance(chapter, dict):
+                        self.chapters.append(chapter)
+                        new_chapters.append(chapter)
+                if self._depth == 1:
+                    self._finish_value(i + 1)
+                elif self._depth == 0:
+                    if self._value_start is not None:
+                        self._finish_value(i)
+                    self.completed = True
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                    self._value_start = None
+                elif ch == ",":
+                    if self._value_start is not None:
+                        self._finish_value(i)
+                    self._expect_key = True
+                elif not ch.isspace():
+                    # 数字、true/false/null等标量值
+                    self._mark_value_start(i)
+
+        self._pos = len(buf)
+        return new_chapters
+
+    def _mark_value_start(self, index: int) -> None:
+        if self._depth == 1 and not self._expect_key and self._value_start is None:
+            self._value_start = index
+
+    def _finish_value(self, end: int) -> None:
+        """顶层字段的值结束，解析并记录"""
+        if self._current_key is not None and self._value_start is not None:
+            value = self._loads(self.buffer[self._value_start:end].strip())
+            if value is not None:
+                self.fields[self._current_key] = value
+        self._value_start = None
+
+    @staticmethod
+    def _loads(text: str) -> Any:
+        try:
+            return json.loads(text)
+        except (json.JSONDecodeError, ValueError):
+            return None
@@ -0,0 +1,123 @@
+"""
+大纲模板服务
+相同材料、章节数和必须字词的小说复用已生成的大纲，按配置的复用/多样性策略决定是否直接实例化
+"""
+
+import copy
+import hashlib
+import random
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from ..config import settings
+from ..models.outline_template import OutlineTemplate
+from .generation_metrics import generation_metrics
+
+POLICY_OFF = "off"  # 不复用模板
+POLICY_REUSE = "reuse"  # 有可用模板就复用
+POLICY_VARIETY = "variety"  # 按比例复用，模板使用次数达到上限后改为重新生成
+
+
+def build_template_key(material_ids: List[str], chapter_count: int, required_words: List[str]) -> str:
+    """根据材料ID、章节数和必须字词生成模板键（与顺序无关）"""
+    raw = "|".join([
+        ",".join(sorted(material_ids)),
+        str(chapter_count),
+        ",".join(sorted(set(required_words)))
+    ])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class OutlineTemplateService:
+    """大纲模板服务"""
+
+    def __init__(self, policy: Optional[str] = None):
+        self.policy = policy or settings.outline_template_policy
+
+    async def save_template(self,
+                            material_ids: List[str],
+                            chapter_count: int,
+                            required_words: List[str],
+                            outline: Dict[str, Any],
+                            source_novel_id: Optional[str] = None) -> Optional[OutlineTemplate]:
+        """保存新生成的大纲为模板，每个模板键最多保留outline_template_max_per_key份
+
+        没有材料的大纲不保存：模板键只剩章节数和必须字词，会被不相关的小说复用
+        """
+        if self.policy == POLICY_OFF or not material_ids:
+            return None
+
+        template_key = build_template_key(material_ids, chapter_count, required_words)
+        template = OutlineTemplate(
+            template_key=template_key,
+            material_ids=sorted(material_ids),
+            chapter_count=chapter_count,
+            required_words=sorted(set(required_words)),
+            outline=copy.deepcopy(outline),
+            source_novel_id=source_novel_id
+        )
+        await template.insert()
+
+        # 超出数量上限时删除使用次数最多的旧模板，保持多样性
+        templates = await OutlineTemplate.find(
+            OutlineTemplate.template_key == template_key
+        ).sort(-OutlineTemplate.use_count).to_list()
+        for stale in templates[:max(0, len(templates) - settings.outline_template_max_per_key)]:
+            await stale.delete()
+
+        generation_metrics.incr("outline_template.saved")
+        return template
+
+    async def pick_template(self,
+                            material_ids: List[str],
+                            chapter_count: int,
+                            required_words: List[str],
+                            force: bool = False,
+                            exclude_novel_id: Optional[str] = None) -> Optional[OutlineTemplate]:
+        """按策略挑选可复用的模板；force为True时忽略复用比例，只要有模板就返回
+
+        exclude_novel_id为重新生成大纲的小说，跳过由它自己生成的模板，避免原样返回旧大纲
+        """
+        if (self.policy == POLICY_OFF and not force) or not material_ids:
+            return None
+
+        template_key = build_template_key(material_ids, chapter_count, required_words)
+        query = OutlineTemplate.find(OutlineTemplate.template_key == template_key)
+        if exclude_novel_id:
+            query = query.find(OutlineTemplate.source_novel_id != exclude_novel_id)
+        if self.policy == POLICY_VARIETY and not force:
+            # 达到使用上限的模板不再复用，促使生成新的大纲
+            query = query.find(OutlineTemplate.use_count < settings.outline_template_max_uses)
+            if random.random() >= settings.outline_template_reuse_ratio:
+                generation_metrics.incr("outline_template.skipped_for_variety")
+                return None
+
+        # 优先使用次数最少的模板
+        templates = await query.sort(OutlineTemplate.use_count).limit(1).to_list()
+        if not templates:
+            generation_metrics.incr("outline_template.misses")
+            return None
+
+        generation_metrics.incr("outline_template.hits")
+        return templates[0]
+
+    async def instantiate(self,
+                          template: OutlineTemplate,
+                          title: str,
+                          outline_gen: Any = None,
+                          personalize: bool = False) -> Dict[str, Any]:
+        """从模板生成大纲副本，可选用模型只改写书名和简介"""
+        outline = copy.deepcopy(template.outline)
+        outline["title"] = title
+
+        if personalize and hasattr(outline_gen, "personalize_outline"):
+            outline = await outline_gen.personalize_outline(outline, title)
+
+        await OutlineTemplate.find_one(OutlineTemplate.id == template.id).update(
+            {"$inc": {"use_count": 1}, "$set": {"last_used_at": datetime.now()}}
+        )
+        return outline
+
+
+# 创建全局实例
+outline_template_service = OutlineTemplateService()
@@ -0,0 +1,126 @@
+"""
+流式输出校验器
+在章节流式生成过程中实时检查格式标记、长度和重复，发现问题时提前中断上游请求
+"""
+
+import re
+from typing import Dict, List, Optional
+
+# 中文内容的粗略字符/token比例，用于估算节省的token数
+ESTIMATED_CHARS_PER_TOKEN = 1.6
+
+# 合规行：正文：、主角：、角色名：（允许半角冒号）
+MARKER_LINE_PATTERN = re.compile(r'^(正文|主角|[^：:\s"“]{1,20})[：:]')
+# 不参与格式统计的行：章节标题、Markdown标题
+IGNORED_LINE_PATTERN = re.compile(r'^(#+\s*|第\S{1,6}[章节])')
+
+
+class StreamGuard:
+    """章节流式输出校验器"""
+
+    ABORT_FORMAT = "format"
+    ABORT_LENGTH = "length"
+    ABORT_REPETITION = "repetition"
+
+    def __init__(self,
+                 target_length: int,
+                 check_lines: int = 6,
+                 min_marker_ratio: float = 0.6,
+                 length_ratio: float = 1.6,
+                 repeat_threshold: int = 3,
+                 enforce_format: bool = True):
+        self.target_length = target_length
+        self.check_lines = check_lines
+        self.min_marker_ratio = min_marker_ratio
+        self.max_length = int(target_length * length_ratio) if length_ratio > 0 else 0
+        self.repeat_threshold = repeat_threshold
+        self.enforce_format = enforce_format
+
+        self.text = ""
+        self.abort_reason: Optional[str] = None
+        self._pending_line = ""
+        self._checked_lines = 0
+        self._marked_lines = 0
+        self._line_counts: Dict[str, int] = {}
+        # 已完成行在text中的结束位置，用于中断时截取到完整行
+        self._line_ends: List[int] = []
+        self._repeat_start: Optional[int] = None
+
+    @property
+    def aborted(self) -> bool:
+        return self.abort_reason is not None
+
+    @property
+    def should_retry(self) -> bool:
+        """格式错误或有效内容过少时应重试"""
+        if self.abort_reason == self.ABORT_FORMAT:
+            return True
+        if self.abort_reason == self.ABORT_REPETITION:
+            return len(self.result_text()) < self.target_length * 0.5
+        return False
+
+    def feed(self, delta: str) -> bool:
+        """输入一段增量内容，返回False表示应中断流"""
+        if self.aborted or not delta:
+            return not self.aborted
+
+        line_start = len(self.text) - len(self._pending_line)
+        self.text += delta
+        self._pending_line += delta
+
+        while "\n" in self._pending_line:
+            line, self._pending_line = self._pending_line.split("\n", 1)
+            line_end = line_start + len(line)
+            self._line_ends.append(line_end)
+            self._check_line(line.strip(), line_start)
+            line_start = line_end + 1
+            if self.aborted:
+                return False
+
+        if self.max_length and len(self.text) > self.max_length:
+            self.abort_reason = self.ABORT_LENGTH
+            return False
+
+        return True
+
+    def _check_line(self, line: str, line_start: int) -> None:
+        """检查一行完整内容"""
+        if not line:
+            return
+
+        # 格式检查：只看前check_lines个有效行
+        if self.enforce_format and self._checked_lines < self.check_lines:
+            if not IGNORED_LINE_PATTERN.match(line):
+                self._checked_lines += 1
+                if MARKER_LINE_PATTERN.match(line):
+                    self._marked_lines += 1
+                if self._checked_lines == self.check_lines:
+                    if self._marked_lines / self._checked_lines < self.min_marker_ratio:
+                        self.abort_reason = self.ABORT_FORMAT
+                        return
+
+        # 重复检查：同一较长行反复出现说明模型陷入循环
+        if self.repeat_threshold and len(line) >= 8:
+            count = self._line_counts.get(line, 0) + 1
+            self._line_counts[line] = count
+            if count == 2 and self._repeat_start is None:
+                self._repeat_start = line_start
+            if count >= self.repeat_threshold:
+                self.abort_reason = self.ABORT_REPETITION
+
+    def result_text(self) -> str:
+        """返回可保留的内容：中断时截取到最后一个完整行，重复时截取到重复开始前"""
+        if not self.aborted:
+            return self.text
+        if self.abort_reason == self.ABORT_REPETITION and self._repeat_start is not None:
+            return self.text[:self._repeat_start].rstrip()
+        if self._line_ends:
+            return self.text[:self._line_ends[-1]].rstrip()
+        return self.text.rstrip()
+
+    def estimate_tokens_saved(self, max_tokens: int) -> int:
+        """估算提前中断节省的token数"""
+        if not self.aborted:
+            return 0
+        used_tokens = int(len(self.text) / ESTIMATED_CHARS_PER_TOKEN)
+        return max(0, max_tokens - used_tokens)
@@ -0,0 +1,182 @@
+"""
+合成小说语料
+按随机种子生成可复现的章节内容，用于解析器和生成流程的基准测试、压力测试，以及AI不可用时的模拟内容。
+可配置章节字数和对白比例；标记写法混合多种风格（正文：/主角：/角色名：、旁白别名、半角冒号、
+直角引号、带括号注释的说话者、引号叙述体），并把类别必须字符（小说类别拼音汉字分配表.json）分散写入各章
+"""
+
+import json
+import random
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+LEXICON_FILE_NAME = "小说类别拼音汉字分配表.json"
+
+
+def _default_lexicon_path() -> Path:
+    """向上查找仓库根目录下的类别必须字符表（容器中只挂载了backend目录时可能找不到）"""
+    for directory in Path(__file__).resolve().parents:
+        candidate = directory / LEXICON_FILE_NAME
+        if candidate.exists():
+            return candidate
+    return Path(LEXICON_FILE_NAME)
+
+
+STYLE_MARKED = "marked"  # 正文：/主角：/角色名：
+STYLE_MARKED_VARIANT = "marked_variant"  # 旁白别名、半角冒号、直角引号、说话者带括号注释
+STYLE_QUOTED = "quoted"  # 不带标记的叙述体，对白用引号包裹
+MARKER_STYLES = (STYLE_MARKED, STYLE_MARKED_VARIANT, STYLE_QUOTED)
+
+STYLE_WEIGHTS = {STYLE_MARKED: 6, STYLE_MARKED_VARIANT: 2, STYLE_QUOTED: 2}  # 各章主风格的抽取权重
+STYLE_STICKINESS = 0.85  # 每行沿用本章主风格的概率，其余行随机换一种
+PROTAGONIST_SHARE = 0.4  # 对白中主角台词的占比
+
+NAMES = ["林婉", "老周", "沈青", "陆川", "苏瑶", "韩立", "叶寒", "秦岚", "顾长风", "白芷"]
+PLACES = ["城墙上", "客栈里", "山道旁", "院子里", "码头边", "书房中", "长街尽头", "古庙前", "渡口", "药铺后堂"]
+TIMES = ["夜色沉沉", "天刚蒙蒙亮", "午后的阳光斜斜照进来", "细雨连绵", "风声渐紧", "暮色四合", "雪下了一整夜"]
+SCENERY = [
+    "灯火在风中摇曳", "远处传来隐约的钟声", "人声渐渐远去", "空气里弥漫着潮湿的气息",
+    "几只寒鸦掠过屋檐", "更夫的梆子声一下一下敲进夜里", "檐下的铜铃轻轻作响", "炉火噼啪地跳了一下"
+]
+ACTIONS = [
+    "{name}把茶盏推到桌边", "{name}沉默地望着窗外", "我攥紧了手中的信", "{name}的眉头皱得更紧了",
+    "我不由得放慢了脚步", "{name}从袖中取出一张泛黄的地图", "我侧身让开了门口", "{name}低头拨弄着灯芯"
+]
+LINES = [
+    "这件事没那么简单。", "你总是想得太多。", "多留个心眼，总不会错。", "明早就会有回音。", "我们没有退路了！",
+    "先别急着下结论。", "那就等吧……", "你到底瞒了我什么？", "路上小心，别回头。", "我答应过的事，从来不会反悔。",
+    "再晚一步，就什么都来不及了！", "这里不是说话的地方。", "你怎么会在这里？", "他真的还活着吗？"
+]
+SPEECH_VERBS = ["说", "低声道", "问", "笑道", "叹了口气说", "压低声音说"]
+NOTES = ["低声", "冷笑", "迟疑", "急切"]
+TITLES = ["风起", "夜探", "旧约", "渡口", "暗潮", "故人", "雪夜", "迷局", "归途", "残灯", "对峙", "破晓"]
+
+# 写入必须字符的句式
+NARRATION_CHAR_TEMPLATES = ["{name}在纸上写下一个“{char}”字", "我想起那块刻着“{char}”字的木牌", "墙上的“{char}”字已经斑驳"]
+DIALOGUE_CHAR_TEMPLATES = ["你还记得那个{char}字吗？", "信上只有一个{char}字。", "这个{char}字背后另有玄机！"]
+
+
+@lru_cache(maxsize=4)
+def load_category_lexicon(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """读取类别必须字符表：{类别名: [汉字]}；文件不存在时返回空字典"""
+    lexicon_path = Path(path) if path else _default_lexicon_path()
+    if not lexicon_path.exists():
+        print(f"⚠️ 未找到类别必须字符表: {lexicon_path}")
+        return {}
+    with open(lexicon_path, encoding="utf-8") as f:
+        categories = json.load(f)
+    return {
+        item["category_name"]: [entry["char"] for entry in item.get("pinyin_chars", []) if entry.get("char")]
+        for item in categories
+        if item.get("category_name")
+    }
+
+
+class SyntheticCorpusGenerator:
+    """合成章节生成器
+
+    同一组参数和种子总是生成相同的内容。dialogue_ratio为对白行占比；required_chars按
+    required_coverage的比例选取后分散到各章，每个字至少出现一次（未选中的字用于测试覆盖率不足的情况）
+    """
+
+    def __init__(self,
+                 seed: int = 0,
+                 chapter_length: int = 2000,
+                 dialogue_ratio: float = 0.5,
+                 required_chars: Optional[Sequence[str]] = None,
+                 required_coverage: float = 1.0,
+                 styles: Sequence[str] = MARKER_STYLES):
+        unknown = set(styles) - set(MARKER_STYLES)
+        if not styles or unknown:
+            raise ValueError(f"未知的标记风格: {sorted(unknown) or '空'}")
+        self.seed = seed
+        self.chapter_length = chapter_length
+        self.dialogue_ratio = min(max(dialogue_ratio, 0.0), 1.0)
+        self.required_chars = list(dict.fromkeys(required_chars or []))
+        self.required_coverage = min(max(required_coverage, 0.0), 1.0)
+        self.styles = list(styles)
+
+    def generate_chapters(self, chapter_count: int) -> List[Dict[str, Any]]:
+        """生成chapter_count章：[{chapter_number, title, content, style, required_chars_used}]"""
+        rng = random.Random(self.seed)
+        used_count = round(len(self.required_chars) * self.required_coverage)
+        selected = rng.sample(self.required_chars, used_count)
+        assignments: List[List[str]] = [[] for _ in range(max(chapter_count, 0))]
+        for index, char in enumerate(selected):
+            if assignments:
+                assignments[index % chapter_count].append(char)
+
+        return [
+            self._generate_chapter(random.Random(f"{self.seed}:{number}"), number, assignments[number - 1])
+            for number in range(1, chapter_count + 1)
+        ]
+
+    def _generate_chapter(self, rng: random.Random, number: int, chars: List[str]) -> Dict[str, Any]:
+        weights = [STYLE_WEIGHTS[style] for style in self.styles]
+        style = rng.choices(self.styles, weights=weights)[0]
+        cast = rng.sample(NAMES, 3)
+        lines: List[str] = []
+        length = 0
+        while length < self.chapter_length:
+            line_style = style if rng.random() < STYLE_STICKINESS else rng.choice(self.styles)
+            if rng.random() < self.dialogue_ratio:
+                line = self._dialogue(rng, line_style, cast)
+            else:
+                line = self._narration(rng, line_style, cast)
+            lines.append(line)
+            length += len(line) + 1
+
+        # 必须字符各写入一行，位置随机
+        for char in chars:
+            is_dialogue = rng.random() < self.dialogue_ratio
+            templates = DIALOGUE_CHAR_TEMPLATES if is_dialogue else NARRATION_CHAR_TEMPLATES
+            text = rng.choice(templates).format(char=char, name=rng.choice(cast))
+            line = (self._dialogue(rng, style, cast, text) if is_dialogue
+                    else self._narration(rng, style, cast, text))
+            lines.insert(rng.randrange(len(lines) + 1), line)
+
+        return {
+            "chapter_number": number,
+            "title": rng.choice(TITLES) + rng.choice(["", "", "（上）", "（下）"]),
+            "content": "\n".join(lines),
+            "style": style,
+            "required_chars_used": chars
+        }
+
+    def _narration(self, rng: random.Random, style: str, cast: List[str], text: Optional[str] = None) -> str:
+        if text is None:
+            text = "，".join([
+                rng.choice(TIMES), rng.choice(PLACES) + rng.choice(SCENERY),
+                rng.choice(ACTIONS).format(name=rng.choice(cast))
+            ])
+        text += "。"
+        if style == STYLE_MARKED:
+            return f"正文：{text}"
+        if style == STYLE_MARKED_VARIANT:
+            return f"{rng.choice(['旁白', '叙述', '正文'])}{rng.choice(['：', ':'])}{text}"
+        return text
+
+    def _dialogue(self, rng: random.Random, style: str, cast: List[str], text: Optional[str] = None) -> str:
+        text = text or rng.choice(LINES)
+        protagonist = rng.random() < PROTAGONIST_SHARE
+        speaker = "主角" if protagonist else rng.choice(cast)
+        if style == STYLE_MARKED:
+            return f"{speaker}：“{text}”" if rng.random() < 0.5 else f"{speaker}：{text}"
+        if style == STYLE_MARKED_VARIANT:
+            if not protagonist and rng.random() < 0.3:
+                speaker = f"{speaker}（{rng.choice(NOTES)}）"
+            return f"{speaker}{rng.choice(['：', ':'])}「{text}」"
+        subject = "我" if protagonist else speaker
+        return f"“{text}”{subject}{rng.choice(SPEECH_VERBS)}。"
+
+
+def generate_corpus(chapter_count: int,
+                    seed: int = 0,
+                    category: Optional[str] = None,
+                    lexicon_path: Optional[str] = None,
+                    **options: Any) -> List[Dict[str, Any]]:
+    """生成合成章节；指定category且未给出required_chars时使用该类别的必须字符"""
+    if category and "required_chars" not in options:
+        options["required_chars"] = load_category_lexicon(lexicon_path).get(category, [])
+    return SyntheticCorpusGenerator(seed=seed, **options).generate_chapters(chapter_count)
@@ -0,0 +1,92 @@
+"""
+max_tokens校准
+按模型从实际完成的生成中学习“字符/token”比例，根据目标字数计算章节请求的max_tokens（加安全余量），
+并跟踪因达到长度上限被截断的比例；截断率升高时自动放宽余量
+"""
+
+import math
+from typing import Dict, Optional
+
+from ..config import settings
+from .generation_metrics import generation_metrics
+from .stream_guard import ESTIMATED_CHARS_PER_TOKEN
+
+EWMA_ALPHA = 0.1  # 指数滑动平均系数
+MIN_SAMPLE_CHARS = 200  # 太短的输出不参与比例估计
+
+
+class _ModelCalibration:
+    """单个模型的校准状态"""
+
+    def __init__(self):
+        self.chars_per_token = ESTIMATED_CHARS_PER_TOKEN
+        self.samples = 0
+        self.completions = 0
+        self.truncations = 0
+        self.truncation_rate = 0.0
+
+    def update(self, chars: int, completion_tokens: Optional[int], truncated: bool) -> None:
+        self.completions += 1
+        self.truncations += 1 if truncated else 0
+        self.truncation_rate += EWMA_ALPHA * ((1.0 if truncated else 0.0) - self.truncation_rate)
+        if completion_tokens and chars >= MIN_SAMPLE_CHARS:
+            ratio = chars / completion_tokens
+            if self.samples == 0:
+                self.chars_per_token = ratio
+            else:
+                self.chars_per_token += EWMA_ALPHA * (ratio - self.chars_per_token)
+            self.samples += 1
+
+
+class TokenCalibrator:
+    """按模型校准章节生成的max_tokens
+
+    max_tokens = 目标字数 × 允许的最大长度倍数（stream_guard_length_ratio）÷ 字符/token × (1 + 余量)，
+    余量 = token_calibration_margin + 近期截断率，结果限制在[min_tokens, max_tokens]之间
+    """
+
+    def __init__(self):
+        self._models: Dict[str, _ModelCalibration] = {}
+
+    def _get(self, model: str) -> _ModelCalibration:
+        return self._models.setdefault(model, _ModelCalibration())
+
+    def chars_per_token(self, model: str) -> float:
+        """模型当前的字符/token比例（还没有样本时为默认估计值）"""
+        calibration = self._models.get(model)
+        return calibration.chars_per_token if calibration else ESTIMATED_CHARS_PER_TOKEN
+
+    def max_tokens_for(self, model: str, target_length: int, default: int = 4000) -> int:
+        """按目标字数计算max_tokens；关闭校准时返回default"""
+        if not settings.token_calibration_enabled:
+            return default
+        calibration = self._get(model)
+        length_ratio = max(settings.stream_guard_length_ratio, 1.0)
+        margin = settings.token_calibration_margin + calibration.truncation_rate
+        budget = math.ceil(target_length * length_ratio / calibration.chars_per_token * (1 + margin))
+        return max(settings.token_calibration_min_tokens, min(settings.token_calibration_max_tokens, budget))
+
+    def record(self, model: str, chars: int, completion_tokens: Optional[int], truncated: bool) -> None:
+        """记录一次完整的生成：输出字符数、实际completion token数（没有usage时为None）、是否因长度上限截断"""
+        calibration = self._get(model)
+        calibration.update(chars, completion_tokens, truncated)
+        generation_metrics.incr(f"token_calibration.{model}.completions")
+        if truncated:
+            generation_metrics.incr(f"token_calibration.{model}.truncated")
+            print(f"✂️ 模型 {model} 的输出达到max_tokens上限被截断（近期截断率 {calibration.truncation_rate:.1%}）")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            model: {
+                "chars_per_token": round(calibration.chars_per_token, 3),
+                "samples": calibration.samples,
+                "completions": calibration.completions,
+                "truncations": calibration.truncations,
+                "truncation_rate": round(calibration.truncation_rate, 3)
+            }
+            for model, calibration in self._models.items()
+        }
+
+
+# 创建全局实例
+token_calibrator = TokenCalibrator()
@@ -0,0 +1,211 @@
+"""
+小说预生成池
+按材料类别在后台预先生成若干部“已有大纲和第一章”的小说，用户开始新小说时直接领取，无需等待大纲和首章生成。
+每个类别的目标数量按最近的领取速率调整，预生成的模型调用使用后台优先级，不占用交互请求的槽位
+"""
+
+import asyncio
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from ..config import settings
+from ..models.chapter_novel import (
+    ChapterNovel, ChapterInfo, ChapterStatus, NovelStatus, POOL_WARMING, POOL_READY
+)
+from ..models.material import Material, MaterialContextView
+from .chapter_run_service import generate_chapter_record
+from .deepseek_outline_generator import DeepSeekOutlineGenerator
+from .entity_index_service import entity_index_service
+from .generation_metrics import generation_metrics
+from .llm_scheduler import tag_llm_context, PRIORITY_BACKGROUND
+
+
+class WarmPoolService:
+    """预生成池管理
+
+    目标数量 = warm_pool_min_size + ceil(最近warm_pool_claim_window_seconds内的领取速率 × warm_pool_lead_seconds)，
+    不超过warm_pool_max_size；lead_seconds是预生成一部小说的大致耗时，即补充期间预计会被领取的数量
+    """
+
+    def __init__(self):
+        self._outline_gen: Any = None
+        self._chapter_gen: Any = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def start(self, outline_gen: Any, chapter_gen: Any) -> None:
+        """启动后台补充循环"""
+        self._outline_gen = outline_gen
+        self._chapter_gen = chapter_gen
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def claim(self, category: str, title: Optional[str] = None) -> Optional[ChapterNovel]:
+        """领取一部就绪的小说（单次原子操作），池中没有时返回None，并唤醒补充循环"""
+        novel = await ChapterNovel.claim_pooled(category, title)
+        generation_metrics.incr(f"warm_pool.{'hits' if novel else 'misses'}")
+        self._wakeup.set()
+        return novel
+
+    async def categories(self) -> Dict[str, List[str]]:
+        """激活材料按类别分组：{类别: [材料ID]}"""
+        materials = await Material.get_pymongo_collection().find(
+            {"is_active": True}, projection={"category": 1}
+        ).to_list(length=None)
+        grouped: Dict[str, List[str]] = {}
+        for doc in materials:
+            grouped.setdefault(doc["category"], []).append(str(doc["_id"]))
+        return grouped
+
+    async def target_size(self, category: str) -> int:
+        """按最近的领取速率计算类别的目标池大小"""
+        window = settings.warm_pool_claim_window_seconds
+        claims = await ChapterNovel.get_pymongo_collection().count_documents({
+            "pool_category": category,
+            "pool_claimed_at": {"$gte": datetime.now() - timedelta(seconds=window)}
+        })
+        expected = math.ceil(claims / window * settings.warm_pool_lead_seconds)
+        return min(settings.warm_pool_max_size, settings.warm_pool_min_size + expected)
+
+    async def stats(self) -> Dict[str, Dict[str, int]]:
+        """各类别的就绪数、预生成中数量和目标大小"""
+        pipeline = [
+            {"$match": {"pool_state": {"$in": [POOL_WARMING, POOL_READY]}}},
+            {"$group": {"_id": {"category": "$pool_category", "state": "$pool_state"}, "count": {"$sum": 1}}}
+        ]
+        counts: Dict[str, Dict[str, int]] = {}
+        async for doc in ChapterNovel.get_pymongo_collection().aggregate(pipeline):
+            counts.setdefault(doc["_id"]["category"], {})[doc["_id"]["state"]] = doc["count"]
+
+        result = {}
+        for category in await self.categories():
+            result[category] = {
+                "ready": counts.get(category, {}).get(POOL_READY, 0),
+                "warming": counts.get(category, {}).get(POOL_WARMING, 0),
+                "target": await self.target_size(category)
+            }
+        return result
+
+    async def refill_once(self) -> int:
+        """为低于目标大小的类别补充预生成小说，返回本轮完成的数量"""
+        await self._purge_abandoned()
+        pool = await self.stats()
+        grouped = await self.categories()
+
+        jobs = []
+        for category, state in pool.items():
+            deficit = state["target"] - state["ready"] - state["warming"]
+            jobs.extend([category] * max(0, deficit))
+        if not jobs:
+            return 0
+
+        semaphore = asyncio.Semaphore(max(1, settings.warm_pool_concurrency))
+
+        async def warm(category: str) -> bool:
+            async with semaphore:
+                return await self._warm_one(category, grouped[category])
+
+        results = await asyncio.gather(*(warm(category) for category in jobs))
+        return sum(1 for ok in results if ok)
+
+    async def _warm_one(self, category: str, material_ids: List[str]) -> bool:
+        """预生成一部小说：大纲 + 第一章，完成后标记为可领取；失败时删除"""
+        tag_llm_context(PRIORITY_BACKGROUND, fair_key=f"warm_pool:{category}")
+        novel = ChapterNovel(
+            title=f"{category.split(':')[-1].split('：')[-1].strip()}（预生成）",
+            total_chapters=settings.warm_pool_chapter_count,
+            material_ids=material_ids,
+            status=NovelStatus.PLANNING,
+            pool_category=category,
+            pool_state=POOL_WARMING
+        )
+        await novel.insert()
+        print(f"🔥 预生成池补充：{category}")
+
+        try:
+            material_docs = await Material.find({"category": category, "is_active": True}).to_list()
+            materials = [material.to_dict() for material in material_docs]
+            if isinstance(self._outline_gen, DeepSeekOutlineGenerator):
+                outline_data = await self._outline_gen.generate_outline(
+                    title=novel.title,
+                    materials=materials,
+                    chapter_count=novel.total_chapters
+                )
+            else:
+                outline_data = self._outline_gen.generate_outline(
+                    title=novel.title,
+                    materials=materials,
+                    chapter_count=novel.total_chapters
+                )
+
+            novel.title = outline_data.get("title") or novel.title
+            novel.outline = outline_data
+            novel.status = NovelStatus.OUTLINED
+            novel.updated_at = datetime.now()
+            await novel.save()
+            await ChapterInfo.upsert_outline_chapters(str(novel.id), outline_data["chapters"])
+
+            chapter = await novel.get_chapter(1)
+            contexts = [
+                MaterialContextView(**material).model_dump() for material in materials
+            ]
+            await generate_chapter_record(
+                novel, chapter, outline_data["chapters"][0], self._chapter_gen, contexts,
+                settings.warm_pool_target_length, previous_heads=[]
+            )
+            if chapter.status != ChapterStatus.COMPLETED:
+                raise RuntimeError("第一章生成失败")
+
+            await ChapterNovel.get_pymongo_collection().update_one(
+                {"_id": novel.id, "pool_state": POOL_WARMING},
+                {"$set": {"pool_state": POOL_READY, "updated_at": datetime.now()}}
+            )
+            generation_metrics.incr("warm_pool.warmed")
+            return True
+        except asyncio.CancelledError:
+            await asyncio.shield(self._discard(novel))
+            raise
+        except Exception as e:
+            print(f"⚠️ 预生成小说失败 [{category}]: {e}")
+            generation_metrics.incr("warm_pool.failed")
+            await self._discard(novel)
+            return False
+
+    async def _discard(self, novel: ChapterNovel) -> None:
+        await ChapterInfo.find(ChapterInfo.novel_id == str(novel.id)).delete()
+        await entity_index_service.delete_novel(str(novel.id))
+        await novel.delete()
+
+    async def _purge_abandoned(self) -> None:
+        """删除进程重启等原因遗留的预生成中记录"""
+        stale_before = datetime.now() - timedelta(seconds=settings.novel_generation_lease_seconds)
+        abandoned = await ChapterNovel.find(
+            {"pool_state": POOL_WARMING, "updated_at": {"$lt": stale_before}}
+        ).to_list()
+        for novel in abandoned:
+            await self._discard(novel)
+        if abandoned:
+            print(f"🧹 已清理 {len(abandoned)} 部中断的预生成小说")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refill_once()
+            except Exception as e:
+                print(f"⚠️ 预生成池补充失败: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.warm_pool_refill_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+
+# 创建全局实例
+warm_pool_service = WarmPoolService()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+离线批量生成小说（不依赖Web服务和数据库）
+读取docs/目录下的材料文件（MaterialParser格式），按并发上限生成大纲和章节，
+结果逐条写入gzip压缩的JSONL（每条记录带必须字词覆盖统计），已完成的任务记录在检查点文件中，中断后重新运行会跳过
+用法: python generate_offline.py [--docs ../docs] [--output offline_novels.jsonl.gz] [--novels-per-material 1]
+                               [--chapters 5] [--target-length 2000] [--concurrency 4] [--limit N]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from app.config import settings
+from app.services.chapter_generator import ChapterGenerator
+from app.services.deepseek_outline_generator import DeepSeekOutlineGenerator
+from app.services.llm_scheduler import tag_llm_context, PRIORITY_BATCH
+from app.services.llm_usage import track_llm_usage
+from app.services.material_parser import MaterialParser
+
+
+def load_materials(docs_dir: Path, limit: int = 0) -> List[Dict[str, Any]]:
+    """解析材料文件，转换为与Material.to_dict()相同结构的字典"""
+    parser = MaterialParser()
+    materials = []
+    for path in sorted(docs_dir.glob("*.md")):
+        data = parser.parse_material_file(path.read_text(encoding="utf-8"), path.name)
+        data["writing_guidelines"] = data["writing_guidelines"].model_dump()
+        data["required_characters"] = [char.model_dump() for char in data["required_characters"]]
+        data["id"] = path.stem
+        data.pop("file_content", None)
+        materials.append(data)
+    return materials[:limit] if limit else materials
+
+
+def load_checkpoint(path: Path) -> Set[str]:
+    """已完成的任务键（每行一个）"""
+    if not path.exists():
+        return set()
+    return {line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()}
+
+
+def coverage_stats(material: Dict[str, Any], chapters: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """统计材料必须字词在全部章节中的覆盖情况"""
+    required = sorted({char["character"] for char in material["required_characters"]})
+    text = "".join(chapter["content"] for chapter in chapters if chapter["status"] == "completed")
+    missing = [word for word in required if word not in text]
+    return {
+        "required": len(required),
+        "used": len(required) - len(missing),
+        "rate": round((len(required) - len(missing)) / len(required), 3) if required else 1.0,
+        "missing": missing
+    }
+
+
+class OfflineRunner:
+    """按并发上限生成小说，逐条写出结果并更新检查点"""
+
+    def __init__(self, args: argparse.Namespace):
+        api_key = settings.deepseek_api_key
+        if not api_key:
+            raise SystemExit("需要配置DEEPSEEK_API_KEY")
+        self.args = args
+        self.outline_gen = DeepSeekOutlineGenerator(api_key)
+        self.chapter_gen = ChapterGenerator(api_key)
+        self.output = Path(args.output)
+        self.checkpoint = Path(f"{args.output}.done")
+        self.write_lock = asyncio.Lock()
+        self.novels = 0
+        self.chapters = 0
+        self.characters = 0
+        self.tokens = 0
+        self.failed = 0
+
+    async def generate_novel(self, key: str, material: Dict[str, Any], index: int) -> Dict[str, Any]:
+        """生成一部小说：大纲 + 逐章正文（章节依赖前文，按顺序生成）"""
+        tag_llm_context(PRIORITY_BATCH, fair_key=key)
+        start = time.perf_counter()
+        with track_llm_usage() as usage:
+            title = f"{material['title']}·{index + 1}"
+            outline = await self.outline_gen.generate_outline(
+                title=title, materials=[material], chapter_count=self.args.chapters
+            )
+            chapters: List[Dict[str, Any]] = []
+            for chapter_info in outline["chapters"]:
+                recent = chapters[-3:]
+                result = await self.chapter_gen.generate_chapter(
+                    novel_title=outline.get("title") or title,
+                    chapter_info=chapter_info,
+                    previous_chapters=[chapter["content"] for chapter in recent],
+                    materials=[material],
+                    target_length=self.args.target_length,
+                    previous_chapter_numbers=[chapter["number"] for chapter in recent]
+                )
+                chapters.append({
+                    "number": chapter_info["number"],
+                    "title": chapter_info["title"],
+                    "content": result["content"],
+                    "word_count": result["word_count"],
+                    "status": result["status"],
+                    "words_completion_rate": result["words_completion_rate"]
+                })
+
+        return {
+            "key": key,
+            "material_file": material["file_name"],
+            "category": material["category"],
+            "title": outline.get("title") or title,
+            "outline": outline,
+            "chapters": chapters,
+            "coverage": coverage_stats(material, chapters),
+            "usage": usage.to_dict(),
+            "elapsed_seconds": round(time.perf_counter() - start, 2)
+        }
+
+    async def write_record(self, record: Dict[str, Any]) -> None:
+        """追加一条记录（每次写入一个完整的gzip成员，中断时不会损坏已写入的数据），再记录检查点"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        async with self.write_lock:
+            with gzip.open(self.output, "at", encoding="utf-8") as f:
+                f.write(line)
+            with self.checkpoint.open("a", encoding="utf-8") as f:
+                f.write(record["key"] + "\n")
+
+        self.novels += 1
+        self.chapters += sum(1 for chapter in record["chapters"] if chapter["status"] == "completed")
+        self.characters += sum(chapter["word_count"] for chapter in record["chapters"])
+        self.tokens += record["usage"]["prompt_tokens"] + record["usage"]["completion_tokens"]
+
+    async def run(self, materials: List[Dict[str, Any]]) -> None:
+        done = load_checkpoint(self.checkpoint)
+        jobs = [
+            (f"{material['file_name']}#{index}", material, index)
+            for material in materials
+            for index in range(self.args.novels_per_material)
+        ]
+        pending = [job for job in jobs if job[0] not in done]
+        print(f"📚 材料 {len(materials)} 份，任务 {len(jobs)} 个，已完成 {len(jobs) - len(pending)} 个，"
+              f"本次生成 {len(pending)} 个（并发 {self.args.concurrency}）")
+
+        semaphore = asyncio.Semaphore(max(1, self.args.concurrency))
+        start = time.perf_counter()
+
+        async def run_job(key: str, material: Dict[str, Any], index: int) -> None:
+            async with semaphore:
+                try:
+                    record = await self.generate_novel(key, material, index)
+                except Exception as e:
+                    self.failed += 1
+                    print(f"❌ {key} 生成失败: {e}")
+                    return
+                await self.write_record(record)
+                elapsed = time.perf_counter() - start
+                print(f"✅ {key}：{record['title']}，覆盖率 {record['coverage']['rate']:.0%}，"
+                      f"进度 {self.novels}/{len(pending)}，{self.novels / elapsed * 60:.2f} 部/分钟")
+
+        await asyncio.gather(*(run_job(*job) for job in pending))
+
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        print(f"\n完成 {self.novels} 部，失败 {self.failed} 部，耗时 {elapsed:.1f} 秒")
+        print(f"吞吐: {self.novels / elapsed * 60:.2f} 部/分钟, {self.chapters / elapsed * 60:.2f} 章/分钟, "
+              f"{self.characters / elapsed:.0f} 字/秒, {self.tokens / elapsed:.0f} tokens/秒")
+        print(f"输出: {self.output}（检查点: {self.checkpoint}）")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="离线批量生成小说并写入gzip压缩的JSONL")
+    parser.add_argument("--docs", default=str(Path(__file__).resolve().parent.parent / "docs"),
+                        help="材料文件目录")
+    parser.add_argument("--output", default="offline_novels.jsonl.gz", help="输出文件")
+    parser.add_argument("--novels-per-material", type=int, default=1, help="每份材料生成的小说数")
+    parser.add_argument("--chapters", type=int, default=5, help="每部小说的章节数")
+    parser.add_argument("--target-length", type=int, default=2000, help="每章目标字数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时生成的小说数")
+    parser.add_argument("--limit", type=int, default=0, help="只使用前N份材料（0为全部）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    materials = load_materials(Path(args.docs), args.limit)
+    if not materials:
+        raise SystemExit(f"{args.docs} 中没有材料文件")
+    asyncio.run(OfflineRunner(args).run(materials))
@@ -6,6 +6,12 @@ import uvicorn
 from app.api import router as api_router
 from app.database import connect_to_mongo, close_mongo_connection
 from app.config import settings
+from app.services.generation_metrics import generation_metrics
+from app.services.llm_scheduler import llm_scheduler
+from app.services.model_policy import model_policy
+from app.services.generation_reaper import generation_reaper
+from app.services.warm_pool_service import warm_pool_service
+from app.services.token_calibrator import token_calibrator
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -38,10 +44,25 @@ async def startup_event():
         print("MongoDB连接成功")
     except Exception as e:
         print(f"MongoDB连接失败: {e}")
+        return
+    
+    # 回收上次进程遗留的进行中记录，并定期回收过期记录
+    if settings.generation_reaper_enabled:
+        generation_reaper.start()
+    
+    # 按类别后台预生成小说，供新小说直接领取
+    if settings.warm_pool_enabled:
+        from app.api.novels_new import get_outline_generator, get_chapter_generator
+        try:
+            warm_pool_service.start(get_outline_generator(), get_chapter_generator())
+        except ValueError as e:
+            print(f"预生成池未启动: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时执行"""
+    await generation_reaper.stop()
+    await warm_pool_service.stop()
     try:
         # 关闭MongoDB连接
         await close_mongo_connection()
@@ -63,6 +84,16 @@ async def health_check():
     """健康检查"""
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """生成过程指标（含模型调用调度队列状态、按任务的模型选择和卡住记录的回收报告）"""
+    snapshot = generation_metrics.snapshot()
+    snapshot["llm_scheduler"] = llm_scheduler.stats()
+    snapshot["model_policy"] = model_policy.stats()
+    snapshot["generation_reaper"] = generation_reaper.stats()
+    snapshot["token_calibration"] = token_calibrator.stats()
+    return snapshot
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",